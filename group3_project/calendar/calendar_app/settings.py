@@ -106,6 +106,16 @@ DATABASES = {
     }
 }
 
+# Per-process cache for calendar payloads; point this at memcached or Redis
+# to share entries between gunicorn workers
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    }
+}
+CALENDAR_CACHE_TIMEOUT = 3600  # seconds a calendar payload is kept; versions make stale entries unreachable
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -160,3 +170,33 @@ LOGIN_URL = 'login'
 
 # load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+
+# Canvas API client
+CANVAS_MAX_WORKERS = 16  # threads per sync used to fan out Canvas requests
+CANVAS_PER_HOST_LIMIT = 8  # in-flight requests allowed against one Canvas host
+# Outside the source tree, e.g. /var/cache/calendai/canvas_http_cache.sqlite3; unset disables conditional caching
+CANVAS_HTTP_CACHE_PATH = os.getenv('CANVAS_HTTP_CACHE_PATH') or None
+CANVAS_HTTP_CACHE_MAX_BYTES = 64 * 1024 * 1024
+CANVAS_HTTP_CACHE_TTL = 0  # seconds a cached response is reused without revalidating
+CANVAS_RATE_LIMIT_RESERVE = 50.0  # budget units per token left unspent as headroom
+CANVAS_RATE_LIMIT_REFILL = 10.0  # units per second Canvas is assumed to give back
+CANVAS_RATE_LIMIT_RETRIES = 5  # throttled attempts before the 403 is surfaced
+CANVAS_RATE_LIMIT_BACKOFF = 0.5  # base seconds for jittered exponential backoff
+CANVAS_RATE_LIMIT_MAX_BACKOFF = 30.0
+CANVAS_CONNECT_TIMEOUT = 5.0  # seconds
+CANVAS_READ_TIMEOUT = 30.0  # seconds without a byte from Canvas
+CANVAS_HEDGE = True  # send a duplicate request when the first is slower than usual
+CANVAS_HEDGE_PERCENTILE = 0.95  # of recent response times, per host
+CANVAS_HEDGE_MIN_SAMPLES = 20
+CANVAS_HEDGE_MIN_DELAY = 0.25  # seconds; hedges below this cost more load than they save
+CANVAS_BREAKER_THRESHOLD = 5  # consecutive failures before a host's breaker opens
+CANVAS_BREAKER_COOLDOWN = 30.0  # seconds an open breaker fails fast before a trial request
+CANVAS_ASYNC_FETCH = False  # serve fetch-assignments from the async view (run under ASGI)
+CANVAS_ASYNC_MAX_CONNECTIONS = 100  # pooled httpx connections per event loop
+
+# Canvas sync jobs: "thread" runs them in the web process, "worker" leaves
+# them for `manage.py sync_worker`, "inline" runs them inside the request
+SYNC_JOB_RUNNER = 'thread'
+SYNC_JOB_STALE_AFTER = 600  # seconds before a running job is considered abandoned
+SYNC_STALE_MINUTES = 60  # `manage.py sync_canvas` refreshes profiles not synced for this long
+SYNC_LOCK_DIR = None  # per-user flock files on SQLite hosts; None uses the system temp dir
@@ -1,4 +1,5 @@
 from django.contrib import admin
-from .models import Event
+from .models import Course, Event
 
+admin.site.register(Course)
 admin.site.register(Event)
@@ -0,0 +1,220 @@
+"""
+Asyncio Canvas client for ASGI deployments.
+
+The threaded client in canvas.py ties up a thread for every request in
+flight. This one sends requests from the event loop through one pooled
+httpx.AsyncClient per loop (HTTP/2 when the h2 package is installed), so a
+single worker can hold many users' syncs at once; the client stays open
+while any caller on the loop is inside loop_client(). It shares the circuit
+breakers, per-token rate limiters, response cache and request metrics with
+the threaded client; only the transport differs. Hedged requests are left
+to the threaded client.
+"""
+import asyncio
+import importlib.util
+import logging
+import time
+import weakref
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+
+import httpx
+from django.conf import settings
+
+from .canvas import _count, _host_latencies, _max_workers, _per_host_limit, _timeouts, with_per_page
+from .circuit import breaker_for
+from .http_cache import response_cache
+from .rate_limit import is_throttled, rate_limiter, retry_after
+
+logger = logging.getLogger(__name__)
+
+# Mirrors the threaded session's Retry: connection failures (in the
+# transport) and these answers are retried before the breaker hears of them
+RETRY_STATUSES = (500, 502, 503, 504)
+SERVER_RETRIES = 3
+RETRY_BACKOFF = 0.5
+
+# An AsyncClient and its connections belong to the loop that opened them
+_loops = weakref.WeakKeyDictionary()
+
+
+def http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+class _LoopState:
+    def __init__(self):
+        connect, read = _timeouts()
+        max_connections = getattr(settings, "CANVAS_ASYNC_MAX_CONNECTIONS", 100)
+        transport = httpx.AsyncHTTPTransport(
+            http2=http2_available(), retries=SERVER_RETRIES,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+        self.client = httpx.AsyncClient(
+            transport=transport, timeout=httpx.Timeout(read, connect=connect), follow_redirects=True
+        )
+        self.host_slots = {}
+        self.users = 0
+
+    def host_slot(self, url) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc
+        slot = self.host_slots.get(host)
+        if slot is None:
+            slot = self.host_slots[host] = asyncio.Semaphore(_per_host_limit())
+        return slot
+
+
+def _loop_state() -> _LoopState:
+    loop = asyncio.get_running_loop()
+    state = _loops.get(loop)
+    if state is None or state.client.is_closed:
+        state = _loops[loop] = _LoopState()
+    return state
+
+
+@asynccontextmanager
+async def loop_client():
+    """
+    Keeps the running loop's client open for the block. Overlapping blocks
+    on one loop share it and the last one to leave closes it, so the loop
+    async_to_sync starts for each call leaves no connection pool behind.
+    """
+    loop = asyncio.get_running_loop()
+    state = _loop_state()
+    state.users += 1
+    try:
+        yield state.client
+    finally:
+        state.users -= 1
+        if state.users == 0:
+            if _loops.get(loop) is state:
+                del _loops[loop]
+            await state.client.aclose()
+
+
+async def acanvas_get(url, headers):
+    """canvas_get for event loops, revalidating against the same response cache."""
+    cache = response_cache()
+    entry = await asyncio.to_thread(cache.lookup, url, headers) if cache else None
+    if entry is not None and entry.is_fresh(cache.ttl):
+        await asyncio.to_thread(cache.touch, entry)
+        cache.record_hit(entry)
+        return entry.replay(url)
+
+    request_headers = {**headers, **entry.conditional_headers()} if entry is not None else headers
+    resp = await _apaced_get(url, request_headers)
+
+    if entry is not None and resp.status_code == 304:
+        await asyncio.to_thread(cache.revalidated, entry)
+        cache.record_hit(entry)
+        return entry.replay(url)
+
+    resp.raise_for_status()
+    if cache:
+        cache.record_miss()
+        await asyncio.to_thread(cache.store, url, headers, resp)
+    return resp
+
+
+async def _acquire(limiter) -> int:
+    start = time.monotonic()
+    while True:
+        seq, delay = limiter.try_acquire(time.monotonic() - start)
+        if seq is not None:
+            return seq
+        # An unbounded wait is for in-flight responses to report the budget
+        await asyncio.sleep(min(delay, 1.0) if delay != float("inf") else 0.05)
+
+
+async def _get(client, url, headers):
+    attempt = 0
+    while True:
+        resp = await client.get(url, headers=headers)
+        if resp.status_code not in RETRY_STATUSES or attempt >= SERVER_RETRIES:
+            return resp
+        delay = retry_after(resp)
+        await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt if delay is None else delay)
+        attempt += 1
+
+
+async def _asend(state, url, headers, limiter):
+    seq = await _acquire(limiter)
+    _count("requests")
+    resp = None
+    try:
+        async with state.host_slot(url):
+            start = time.monotonic()
+            resp = await _get(state.client, url, headers)
+        if resp.status_code < 500:
+            _host_latencies(urlsplit(url).netloc).append(time.monotonic() - start)
+    except httpx.TimeoutException:
+        _count("timeouts")
+        raise
+    finally:
+        limiter.release(seq, resp)
+    return resp
+
+
+async def _apaced_get(url, headers):
+    """_paced_get for event loops: breaker, rate limiter and throttling retries."""
+    state = _loop_state()
+    breaker = breaker_for(urlsplit(url).netloc)
+    limiter = rate_limiter(headers)
+    retries = getattr(settings, "CANVAS_RATE_LIMIT_RETRIES", 5)
+    attempt = 0
+    while True:
+        breaker.before_request()
+        try:
+            resp = await _asend(state, url, headers, limiter)
+        except BaseException:
+            # Any error, not only transport ones, so a half-open trial is never left running
+            breaker.record_failure()
+            raise
+        if resp.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        if not is_throttled(resp) or attempt >= retries:
+            return resp
+        delay = limiter.back_off(attempt, resp)
+        logger.info("Canvas throttled %s, retrying in %.2fs", url, delay)
+        attempt += 1
+
+
+async def afetch_records(url, headers, shape=None):
+    """
+    Reads every page of a Canvas listing, following Link rel="next";
+    shape is applied to each page's records as in sync.fetch_records.
+    """
+    records = []
+    resp = await acanvas_get(with_per_page(url), headers)
+    while True:
+        page = resp.json()
+        records.extend(page if shape is None else (kept for kept in map(shape, page) if kept is not None))
+        next_url = resp.links.get("next", {}).get("url")
+        if not next_url:
+            return records
+        resp = await acanvas_get(next_url, headers)
+
+
+async def afetch_all(fetch, urls, headers, default=None, on_result=None):
+    """
+    fetch_all for event loops: awaits fetch(url, headers) for every url,
+    at most CANVAS_MAX_WORKERS at a time, with the same ordering, default
+    and on_result contract.
+    """
+    urls = list(urls)
+    results = [default] * len(urls)
+    gate = asyncio.Semaphore(_max_workers())
+
+    async def run(index, url):
+        async with gate:
+            try:
+                results[index] = await fetch(url, headers)
+            except Exception as e:
+                logger.warning("Canvas fetch failed for %s: %s", url, e)
+        if on_result:
+            on_result(index, results[index])
+
+    await asyncio.gather(*(run(i, url) for i, url in enumerate(urls)))
+    return results
@@ -0,0 +1,120 @@
+"""
+Per-user calendar versions and the cached calendar feeds.
+
+UserProfile.calendar_version goes up whenever one of the user's events is
+saved or deleted (see signals.py), and the serialized calendar_events
+payload and .ics rendering are cached under that version, so a changed
+calendar simply stops matching its old entries. The version lives in the
+database rather than the cache so every web process sees the same one.
+
+Bulk writes send no signals. Code that uses bulk_create, bulk_update or
+queryset.update on Event wraps them in calendar_changes() and adds the
+user; the same block also folds the per-row post_delete signals of a
+queryset.delete() into one bump.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+from django.utils.timezone import now
+
+from .models import UserProfile
+
+_deferred = threading.local()
+
+_stats = {"hits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+
+
+def _cache():
+    return caches[getattr(settings, "CALENDAR_CACHE_ALIAS", "default")]
+
+
+def calendar_version(user_id) -> int:
+    version = UserProfile.objects.filter(user_id=user_id).values_list("calendar_version", flat=True).first()
+    return version or 0
+
+
+def bump_calendar_version(user_id):
+    if user_id is None:
+        return
+    pending = getattr(_deferred, "users", None)
+    if pending is not None:
+        pending.add(user_id)
+        return
+    UserProfile.objects.filter(user_id=user_id).update(
+        calendar_version=F("calendar_version") + 1, calendar_changed_at=now()
+    )
+
+
+@contextmanager
+def calendar_changes():
+    """
+    Collects version bumps made inside the block and applies one per user
+    when it exits. Yields the set of user ids, which callers add to for
+    writes that send no signals.
+    """
+    if getattr(_deferred, "users", None) is not None:
+        yield _deferred.users
+        return
+    _deferred.users = users = set()
+    try:
+        yield users
+    finally:
+        _deferred.users = None
+        for user_id in users:
+            bump_calendar_version(user_id)
+
+
+def _lookup(cache_key):
+    payload = _cache().get(cache_key)
+    with _stats_lock:
+        _stats["hits" if payload is not None else "misses"] += 1
+    return payload
+
+
+def _store(cache_key, payload):
+    _cache().set(cache_key, payload, getattr(settings, "CALENDAR_CACHE_TIMEOUT", 3600))
+
+
+def cached_payload(user_id, version, key, build):
+    """
+    The bytes build() returns for the user's calendar at version, from the
+    cache when an earlier request already built them.
+    """
+    cache_key = f"calendar:{user_id}:{version}:{key}"
+    payload = _lookup(cache_key)
+    if payload is None:
+        payload = build()
+        _store(cache_key, payload)
+    return payload
+
+
+def cached_stream(user_id, version, key, render):
+    """
+    cached_payload for streamed bodies: an iterator over the cached bytes,
+    or over the chunks render() produces, which are cached together once
+    the last one has gone out. A stream the client abandons is not cached.
+    """
+    cache_key = f"calendar:{user_id}:{version}:{key}"
+    payload = _lookup(cache_key)
+    if payload is not None:
+        return iter((payload,))
+    return _caching(cache_key, render())
+
+
+def _caching(cache_key, chunks):
+    parts = []
+    for chunk in chunks:
+        parts.append(chunk)
+        yield chunk
+    _store(cache_key, b"".join(parts))
+
+
+def calendar_cache_stats():
+    with _stats_lock:
+        hits, misses = _stats["hits"], _stats["misses"]
+    lookups = hits + misses
+    return {"hits": hits, "misses": misses, "hit_ratio": hits / lookups if lookups else 0.0}
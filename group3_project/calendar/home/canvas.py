@@ -0,0 +1,331 @@
+import logging
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .circuit import breaker_for, breaker_states
+from .http_cache import response_cache
+from .rate_limit import is_throttled, rate_limiter
+
+logger = logging.getLogger(__name__)
+
+# Set up a shared session. Transport errors and 5xx answers are retried
+# with backoff here; rate limiting is handled per token in canvas_get.
+# Read timeouts are not retried: a slow response is hedged instead, and
+# resending after a full read timeout would only multiply the wait.
+session = requests.Session()
+retries = Retry(
+    total=3, read=False, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504),
+    allowed_methods=("GET",), respect_retry_after_header=True, raise_on_status=False,
+)
+adapter = HTTPAdapter(pool_connections=50, pool_maxsize=50, max_retries=retries)
+session.mount("https://", adapter)
+session.mount("http://", adapter)
+
+# Per-host semaphores are process wide so that concurrent syncs for
+# different users still share one cap against the same Canvas instance.
+_host_slots = {}
+_host_slots_lock = threading.Lock()
+
+# Shared pool that requests the next page of a listing while the caller is
+# still working through the current one. It only ever runs single requests,
+# so it cannot deadlock against the fetch_all pools that feed it.
+_prefetch_pool = None
+_prefetch_pool_lock = threading.Lock()
+
+# Pool for hedged sends. Its tasks are single requests that never submit
+# more work, so callers waiting on it cannot deadlock.
+_send_pool = None
+_send_pool_lock = threading.Lock()
+
+# Recent successful response times per host, for the hedging threshold
+_latencies = {}
+_latencies_lock = threading.Lock()
+
+_metrics = Counter()
+_metrics_lock = threading.Lock()
+
+
+def _max_workers() -> int:
+    return getattr(settings, "CANVAS_MAX_WORKERS", 16)
+
+
+def _per_host_limit() -> int:
+    return getattr(settings, "CANVAS_PER_HOST_LIMIT", 8)
+
+
+def host_slot(url: str) -> threading.BoundedSemaphore:
+    host = urlsplit(url).netloc
+    with _host_slots_lock:
+        slot = _host_slots.get(host)
+        if slot is None:
+            slot = threading.BoundedSemaphore(_per_host_limit())
+            _host_slots[host] = slot
+        return slot
+
+
+def _prefetcher() -> ThreadPoolExecutor:
+    global _prefetch_pool
+    with _prefetch_pool_lock:
+        if _prefetch_pool is None:
+            _prefetch_pool = ThreadPoolExecutor(max_workers=_max_workers(), thread_name_prefix="canvas-prefetch")
+        return _prefetch_pool
+
+
+def _sender() -> ThreadPoolExecutor:
+    global _send_pool
+    with _send_pool_lock:
+        if _send_pool is None:
+            _send_pool = ThreadPoolExecutor(max_workers=4 * _max_workers(), thread_name_prefix="canvas-send")
+        return _send_pool
+
+
+def _timeouts():
+    return getattr(settings, "CANVAS_CONNECT_TIMEOUT", 5.0), getattr(settings, "CANVAS_READ_TIMEOUT", 30.0)
+
+
+def _count(name):
+    with _metrics_lock:
+        _metrics[name] += 1
+
+
+def _host_latencies(host) -> deque:
+    with _latencies_lock:
+        samples = _latencies.get(host)
+        if samples is None:
+            samples = deque(maxlen=200)
+            _latencies[host] = samples
+        return samples
+
+
+def hedge_delay(host):
+    """
+    Seconds to wait on a request to host before sending a duplicate: the
+    CANVAS_HEDGE_PERCENTILE of recent response times, never less than
+    CANVAS_HEDGE_MIN_DELAY. None while hedging is off or too few responses
+    have been seen to know what slow looks like.
+    """
+    if not getattr(settings, "CANVAS_HEDGE", True):
+        return None
+    samples = sorted(_host_latencies(host))
+    if len(samples) < getattr(settings, "CANVAS_HEDGE_MIN_SAMPLES", 20):
+        return None
+    percentile = samples[int(getattr(settings, "CANVAS_HEDGE_PERCENTILE", 0.95) * (len(samples) - 1))]
+    return max(percentile, getattr(settings, "CANVAS_HEDGE_MIN_DELAY", 0.25))
+
+
+def client_metrics():
+    with _metrics_lock:
+        counts = dict(_metrics)
+    with _latencies_lock:
+        hosts = list(_latencies)
+    return {
+        "requests": counts.get("requests", 0),
+        "hedged": counts.get("hedged", 0),
+        "hedge_wins": counts.get("hedge_wins", 0),
+        "timeouts": counts.get("timeouts", 0),
+        "hedge_delay": {host: hedge_delay(host) for host in hosts},
+        "breakers": breaker_states(),
+    }
+
+
+def canvas_get(url, headers):
+    """
+    GETs a Canvas URL, revalidating against the response cache when one is
+    configured. A 304 (or an entry still inside CANVAS_HTTP_CACHE_TTL) is
+    answered with the cached body, so callers always see a 200.
+    """
+    cache = response_cache()
+    entry = cache.lookup(url, headers) if cache else None
+    if entry is not None and entry.is_fresh(cache.ttl):
+        cache.touch(entry)
+        cache.record_hit(entry)
+        return entry.replay(url)
+
+    request_headers = {**headers, **entry.conditional_headers()} if entry is not None else headers
+    resp = _paced_get(url, request_headers)
+
+    if entry is not None and resp.status_code == 304:
+        cache.revalidated(entry)
+        cache.record_hit(entry)
+        return entry.replay(url)
+
+    resp.raise_for_status()
+    if cache:
+        cache.record_miss()
+        cache.store(url, headers, resp)
+    return resp
+
+
+def _send(url, headers, limiter, sent=None):
+    seq = limiter.acquire()
+    _count("requests")
+    resp = None
+    try:
+        with host_slot(url):
+            if sent is not None:
+                sent.set()
+            start = time.monotonic()
+            resp = session.get(url, headers=headers, timeout=_timeouts())
+        if resp.status_code < 500:
+            _host_latencies(urlsplit(url).netloc).append(time.monotonic() - start)
+    except requests.Timeout:
+        _count("timeouts")
+        raise
+    finally:
+        limiter.release(seq, resp)
+    return resp
+
+
+def _hedged_send(url, headers, limiter):
+    """
+    Sends the request and, if no answer has come back within hedge_delay,
+    sends a duplicate; whichever answers first wins. The loser is left to
+    finish (bounded by the read timeout) and its response is dropped.
+    """
+    delay = hedge_delay(urlsplit(url).netloc)
+    if delay is None:
+        return _send(url, headers, limiter)
+    sent = threading.Event()
+    primary = _sender().submit(_send, url, headers, limiter, sent)
+    # Time the primary from when it goes out, not while it waits on the budget or a host slot
+    while not sent.wait(0.05) and not primary.done():
+        pass
+    try:
+        return primary.result(timeout=delay)
+    except FutureTimeout:
+        pass
+    _count("hedged")
+    backup = _sender().submit(_send, url, headers, limiter)
+    pending = {primary, backup}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is backup:
+                    _count("hedge_wins")
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+def _paced_get(url, headers):
+    """
+    Sends one GET through the host's circuit breaker and the token's rate
+    limiter, waiting out throttled answers (Retry-After, or jittered
+    backoff) up to CANVAS_RATE_LIMIT_RETRIES times before handing the last
+    response back.
+    """
+    breaker = breaker_for(urlsplit(url).netloc)
+    limiter = rate_limiter(headers)
+    retries = getattr(settings, "CANVAS_RATE_LIMIT_RETRIES", 5)
+    attempt = 0
+    while True:
+        breaker.before_request()
+        try:
+            resp = _hedged_send(url, headers, limiter)
+        except BaseException:
+            # Any error, not only transport ones, so a half-open trial is never left running
+            breaker.record_failure()
+            raise
+        if resp.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        if not is_throttled(resp) or attempt >= retries:
+            return resp
+        delay = limiter.back_off(attempt, resp)
+        logger.info("Canvas throttled %s, retrying in %.2fs", url, delay)
+        attempt += 1
+
+
+# Fetches JSON data
+def fetch_json(url, headers):
+    return canvas_get(url, headers).json()
+
+
+def cache_stats():
+    cache = response_cache()
+    if cache is None:
+        return {"hits": 0, "misses": 0, "hit_ratio": 0.0, "bytes_saved": 0}
+    return cache.stats()
+
+
+def with_per_page(url, per_page=100):
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    if not any(key == "per_page" for key, _ in query):
+        query.append(("per_page", str(per_page)))
+    return urlunsplit(parts._replace(query=urlencode(query, safe="[]")))
+
+
+def iter_canvas_pages(url, headers):
+    """
+    Yields the records of a paginated Canvas listing one page at a time.
+
+    Follows the Link rel="next" header until Canvas stops sending one. The
+    request for the next page is started before the current page is handed
+    out, so parsing and consuming overlap with the following round trip,
+    and at most two pages are held in memory.
+    """
+    resp = canvas_get(with_per_page(url), headers)
+    while True:
+        next_url = resp.links.get("next", {}).get("url")
+        pending = _prefetcher().submit(canvas_get, next_url, headers) if next_url else None
+        try:
+            yield from resp.json()
+        except BaseException:
+            if pending is not None:
+                pending.cancel()
+            raise
+        if pending is None:
+            return
+        resp = pending.result()
+
+
+def fetch_all(fetch, urls, headers, default=None, on_result=None):
+    """
+    Calls fetch(url, headers) for every url through a bounded thread pool.
+    The per-host cap is applied to the individual requests in canvas_get.
+
+    Results come back in the same order as urls, so callers can zip them
+    against whatever they built the urls from. A failed fetch is logged and
+    replaced by default. on_result(index, result) is called on the calling
+    thread as each fetch completes, in completion order.
+    """
+    urls = list(urls)
+    if not urls:
+        return []
+
+    def run(url):
+        try:
+            return fetch(url, headers)
+        except Exception as e:
+            logger.warning("Canvas fetch failed for %s: %s", url, e)
+            return default
+
+    results = [default] * len(urls)
+    workers = min(_max_workers(), len(urls))
+    if workers <= 1:
+        for i, url in enumerate(urls):
+            results[i] = run(url)
+            if on_result:
+                on_result(i, results[i])
+        return results
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="canvas") as pool:
+        futures = {pool.submit(run, url): i for i, url in enumerate(urls)}
+        for future in as_completed(futures):
+            i = futures[future]
+            results[i] = future.result()
+            if on_result:
+                on_result(i, results[i])
+    return results
@@ -0,0 +1,88 @@
+"""
+Per-host circuit breakers for the Canvas client.
+
+After CANVAS_BREAKER_THRESHOLD consecutive failures (requests that raise,
+such as connection errors and timeouts, or 5xx answers) a host's breaker opens and requests to it fail
+immediately with CircuitOpen instead of tying up workers. Once
+CANVAS_BREAKER_COOLDOWN seconds have passed one trial request is let
+through: success closes the breaker, failure opens it for another cooldown.
+"""
+import threading
+import time
+
+import requests
+from django.conf import settings
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(requests.ConnectionError):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, host, threshold, cooldown):
+        self.host = host
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = HALF_OPEN
+            if self.state == CLOSED:
+                return
+            if self.state == HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return
+            self.rejected += 1
+        raise CircuitOpen(f"Canvas at {self.host} is unavailable; circuit open")
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.threshold:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+
+    def snapshot(self):
+        with self._lock:
+            return {"state": self.state, "failures": self.failures, "rejected": self.rejected}
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(host) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                host,
+                getattr(settings, "CANVAS_BREAKER_THRESHOLD", 5),
+                getattr(settings, "CANVAS_BREAKER_COOLDOWN", 30.0),
+            )
+            _breakers[host] = breaker
+        return breaker
+
+
+def breaker_states():
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.host: breaker.snapshot() for breaker in breakers}
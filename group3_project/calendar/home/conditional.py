@@ -0,0 +1,49 @@
+"""
+Conditional GET for per-user pages and API responses.
+
+revalidated() wraps a view in django.views.decorators.http.condition with
+an ETag function built from cheap version stamps (the user's calendar
+version, a note's updated_at), so a repeat request whose If-None-Match
+still matches is answered 304 before the view queries for, renders or
+serializes its body. Responses are marked private, no-cache: browsers keep
+them but ask again on every use, and shared caches never store them.
+"""
+import hashlib
+
+from django.contrib.messages import get_messages
+from django.middleware.csrf import get_token
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+
+def stamp_etag(*stamps):
+    key = ":".join(str(stamp) for stamp in stamps)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def user_etag(request, *stamps):
+    """An ETag for data that depends only on the user and stamps."""
+    if not request.user.is_authenticated:
+        return None
+    return stamp_etag(request.user.pk, *stamps)
+
+
+def page_etag(request, *stamps):
+    """
+    user_etag for rendered pages, which also embed the CSRF token and show
+    queued messages: a new CSRF cookie changes the tag, and pending
+    messages always get a fresh render so they are not left unshown.
+    """
+    if len(get_messages(request)):
+        return None
+    # get_token sets the secret up first when the browser has no cookie yet
+    get_token(request)
+    return user_etag(request, request.META["CSRF_COOKIE"], *stamps)
+
+
+def revalidated(etag_func, last_modified_func=None):
+    """condition() plus Cache-Control: private, no-cache."""
+    def decorator(view):
+        view = condition(etag_func=etag_func, last_modified_func=last_modified_func)(view)
+        return cache_control(private=True, no_cache=True)(view)
+    return decorator
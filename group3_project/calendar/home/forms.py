@@ -1,40 +1,63 @@
+from datetime import datetime, time, timezone
 from django import forms
-from home.models import Event
+from home import recurrence
+from home.models import Course, Event
 from typing import Any
 
 
 class EventForm(forms.ModelForm):
 
-    course_name = forms.ChoiceField(choices=[], required=True)
+    # No course is a personal event
+    course = forms.ModelChoiceField(queryset=Course.objects.none(), required=False, empty_label="Personal")
 
     due_date = forms.DateTimeField(
         widget=forms.DateTimeInput(attrs={'type': 'datetime-local'}),
         label="Due Date & Time"
     )
 
+    # Turned into Event.recurrence by clean()
+    repeat = forms.ChoiceField(
+        choices=[('', 'Does not repeat'), ('DAILY', 'Daily'), ('WEEKLY', 'Weekly')], required=False
+    )
+    repeat_interval = forms.IntegerField(
+        min_value=1, max_value=recurrence.MAX_INTERVAL, initial=1, required=False, label="Every (days or weeks)"
+    )
+    repeat_until = forms.DateField(widget=forms.DateInput(attrs={'type': 'date'}), required=False, label="Until")
+    repeat_count = forms.IntegerField(
+        min_value=1, max_value=recurrence.MAX_COUNT, required=False, label="Number of occurrences"
+    )
+
     class Meta:
         model = Event
-        fields = ['title', 'description', 'due_date', 'event_type', 'course_name']
+        fields = ['title', 'description', 'due_date', 'event_type', 'course']
 
     def __init__(self, *args: Any, **kwargs: Any) -> None:
         user = kwargs.pop('user', None)
         super().__init__(*args, **kwargs)
         if user:
-            courses = (
-                Event.objects.filter(user=user)
-                .exclude(course_name__isnull=True)
-                .exclude(course_name__exact='')
-                .values_list('course_name', flat=True)
-                .distinct()
-            )
-
-            choices = [(course, course) for course in courses]
-
-            choices.insert(0, ('Personal', 'Personal'))
-
-            choices.insert(0, ("", "--- Select a course ---"))
-
-            self.fields['course_name'].choices = choices
+            self.fields['course'].queryset = Course.objects.filter(user=user).order_by('name')
 
         for fld in self.fields.values():
             fld.widget.attrs.update({'class': 'form-control'})
+
+    def clean(self) -> dict:
+        cleaned = super().clean()
+        cleaned['recurrence'] = ''
+        if not cleaned.get('repeat'):
+            return cleaned
+        until = cleaned.get('repeat_until')
+        if until and cleaned.get('repeat_count'):
+            raise forms.ValidationError("Choose an end date or a number of occurrences, not both.")
+        rule = recurrence.Rule(
+            cleaned['repeat'],
+            cleaned.get('repeat_interval') or 1,
+            # The whole of the last day counts, in UTC like the due date
+            datetime.combine(until, time(23, 59, 59), timezone.utc) if until else None,
+            cleaned.get('repeat_count'),
+        )
+        cleaned['recurrence'] = recurrence.format_rule(rule)
+        return cleaned
+
+    def save(self, commit: bool = True) -> Event:
+        self.instance.recurrence = self.cleaned_data['recurrence']
+        return super().save(commit)
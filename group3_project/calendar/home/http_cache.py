@@ -0,0 +1,186 @@
+"""
+Persistent conditional-request cache for Canvas API responses.
+
+Entries live in a small SQLite file outside the Django database, so they
+survive restarts, are shared by every worker on the host, and are not tied
+to request transactions. Each entry is keyed on the URL plus the access
+token that fetched it, and keeps the validators (ETag / Last-Modified), the
+headers pagination needs and the raw body.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.structures import CaseInsensitiveDict
+
+# Response headers replayed with a cached body
+KEPT_HEADERS = ("Content-Type", "Link", "ETag", "Last-Modified")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    headers TEXT NOT NULL,
+    body BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    stored_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+"""
+
+
+class CachedResponse:
+    def __init__(self, key, etag, last_modified, headers, body, stored_at):
+        self.key = key
+        self.etag = etag
+        self.last_modified = last_modified
+        self.headers = headers
+        self.body = body
+        self.stored_at = stored_at
+
+    def is_fresh(self, ttl):
+        return ttl > 0 and time.time() - self.stored_at < ttl
+
+    def conditional_headers(self):
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def replay(self, url):
+        resp = requests.Response()
+        resp.status_code = 200
+        resp.url = url
+        resp.headers = CaseInsensitiveDict(self.headers)
+        resp.encoding = "utf-8"
+        resp._content = self.body
+        return resp
+
+
+class ResponseCache:
+    def __init__(self, path, max_bytes, ttl=0):
+        self.path = str(path)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def key_for(url, headers):
+        token = headers.get("Authorization", "")
+        return hashlib.sha256(f"{url}\0{token}".encode()).hexdigest()
+
+    def lookup(self, url, headers):
+        key = self.key_for(url, headers)
+        row = self._connect().execute(
+            "SELECT etag, last_modified, headers, body, stored_at FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, kept, body, stored_at = row
+        return CachedResponse(key, etag, last_modified, json.loads(kept), body, stored_at)
+
+    def store(self, url, headers, resp):
+        etag = resp.headers.get("ETag")
+        last_modified = resp.headers.get("Last-Modified")
+        if not (etag or last_modified or self.ttl):
+            return
+        body = resp.content
+        if len(body) > self.max_bytes:
+            return
+        kept = {name: resp.headers[name] for name in KEPT_HEADERS if name in resp.headers}
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (self.key_for(url, headers), url, etag, last_modified, json.dumps(kept), body, len(body), now, now),
+        )
+        self._evict(conn)
+
+    def revalidated(self, entry):
+        # A 304 restarts the entry's freshness window as well as its LRU position
+        now = time.time()
+        entry.stored_at = now
+        self._connect().execute(
+            "UPDATE responses SET stored_at = ?, last_used = ? WHERE key = ?", (now, now, entry.key)
+        )
+
+    def touch(self, entry):
+        self._connect().execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), entry.key))
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        freed = 0
+        doomed = []
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_used"):
+            doomed.append((key,))
+            freed += size
+            if total - freed <= self.max_bytes:
+                break
+        conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+
+    def record_hit(self, entry):
+        with self._stats_lock:
+            self.hits += 1
+            self.bytes_saved += len(entry.body)
+
+    def record_miss(self):
+        with self._stats_lock:
+            self.misses += 1
+
+    def stats(self):
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "bytes_saved": self.bytes_saved,
+            }
+
+    def clear(self):
+        self._connect().execute("DELETE FROM responses")
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def response_cache():
+    """Returns the cache configured by CANVAS_HTTP_CACHE_PATH, or None if it is disabled."""
+    path = getattr(settings, "CANVAS_HTTP_CACHE_PATH", None)
+    if not path:
+        return None
+    max_bytes = getattr(settings, "CANVAS_HTTP_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+    ttl = getattr(settings, "CANVAS_HTTP_CACHE_TTL", 0)
+    with _caches_lock:
+        cache = _caches.get(str(path))
+        if cache is None:
+            cache = ResponseCache(path, max_bytes, ttl)
+            _caches[str(path)] = cache
+        cache.max_bytes = max_bytes
+        cache.ttl = ttl
+        return cache
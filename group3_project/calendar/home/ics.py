@@ -0,0 +1,97 @@
+"""
+iCalendar (RFC 5545) rendering for the calendar subscription feed.
+
+render_calendar turns an iterable of Event values into the bytes of a
+VCALENDAR, a chunk at a time, so the feed view can stream a long history
+straight from a queryset iterator without building it in memory first.
+"""
+from datetime import timezone
+
+PRODID = "-//CalendAI//Deadlines//EN"
+# Bump when the output format changes so cached renderings are not reused
+RENDER_VERSION = 2
+# Events written per yielded chunk
+CHUNK_EVENTS = 200
+LINE_OCTETS = 75
+
+# Plus course_name, the event's course name or None
+EVENT_FIELDS = (
+    "pk", "title", "description_excerpt", "event_type", "due_date", "recurrence", "recurrence_exceptions"
+)
+EVENT_CATEGORIES = {"assignment": "Assignment", "quiz": "Quiz", "test": "Test"}
+
+
+def escape_text(value):
+    return (
+        value.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+        .replace("\r\n", "\\n").replace("\n", "\\n").replace("\r", "\\n")
+    )
+
+
+def fold(line):
+    """The content line as CRLF-terminated bytes, folded at 75 octets without splitting a character."""
+    data = line.encode()
+    out = []
+    limit = LINE_OCTETS
+    while len(data) > limit:
+        cut = limit
+        # Back up over UTF-8 continuation bytes
+        while data[cut] & 0xC0 == 0x80:
+            cut -= 1
+        out.append(data[:cut] + b"\r\n ")
+        data = data[cut:]
+        limit = LINE_OCTETS - 1  # the leading space counts
+    out.append(data + b"\r\n")
+    return b"".join(out)
+
+
+def format_datetime(value):
+    return value.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def event_lines(event, stamp):
+    due = format_datetime(event["due_date"])
+    summary = f"{event['course_name']}: {event['title']}" if event["course_name"] else event["title"]
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:event-{event['pk']}@calendai",
+        f"DTSTAMP:{stamp}",
+        f"DTSTART:{due}",
+        f"DTEND:{due}",
+        f"SUMMARY:{escape_text(summary)}",
+    ]
+    # A recurring event is written once; the calendar app expands the rule
+    if event["recurrence"]:
+        lines.append(f"RRULE:{event['recurrence']}")
+    if event["recurrence_exceptions"]:
+        lines.append(f"EXDATE:{','.join(sorted(event['recurrence_exceptions']))}")
+    if event["description_excerpt"]:
+        lines.append(f"DESCRIPTION:{escape_text(event['description_excerpt'])}")
+    if event["event_type"] in EVENT_CATEGORIES:
+        lines.append(f"CATEGORIES:{EVENT_CATEGORIES[event['event_type']]}")
+    lines.append("END:VEVENT")
+    return lines
+
+
+def render_calendar(events, name, stamp):
+    """
+    Yields the calendar as bytes chunks. events are dicts with
+    EVENT_FIELDS; stamp is the DTSTAMP datetime for every event.
+    """
+    stamp = format_datetime(stamp)
+    yield b"".join(fold(line) for line in (
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        f"PRODID:{PRODID}",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        f"X-WR-CALNAME:{escape_text(name)}",
+    ))
+    chunk = []
+    for count, event in enumerate(events, 1):
+        chunk.extend(fold(line) for line in event_lines(event, stamp))
+        if count % CHUNK_EVENTS == 0:
+            yield b"".join(chunk)
+            chunk = []
+    chunk.append(fold("END:VCALENDAR"))
+    yield b"".join(chunk)
@@ -0,0 +1,274 @@
+"""
+Background Canvas sync jobs.
+
+fetch_assignments only records a SyncJob and hands it to a runner; the sync
+itself happens on a thread of the web process or in `manage.py sync_worker`,
+depending on SYNC_JOB_RUNNER:
+
+    "thread"  - start a daemon thread once the enqueuing transaction commits
+    "worker"  - leave the job queued for a sync_worker process to claim
+    "inline"  - run the job before returning (tests, debugging)
+
+A user has at most one queued or running job. Requests that arrive while
+one is in flight attach to it instead of starting a second sync.
+
+`manage.py sync_canvas` refreshes stale profiles in the background. Each
+user is leased (UserProfile.sync_lease_until) by one worker at a time, and
+the sync itself goes through the same single-flight job path.
+
+Under ASGI, fetch_assignments_async runs the sync on the event loop inside
+the request (arun_sync_now), sharing the same jobs and single-flight rules.
+"""
+import logging
+import os
+import tempfile
+import threading
+import traceback
+from contextlib import contextmanager
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import SyncJob, UserProfile
+from .sync import async_sync_canvas, sync_canvas
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+IN_FLIGHT = ("queued", "running")
+
+_local_locks = {}
+_local_locks_guard = threading.Lock()
+
+
+def _runner() -> str:
+    return getattr(settings, "SYNC_JOB_RUNNER", "thread")
+
+
+@contextmanager
+def user_sync_lock(user_id):
+    """
+    Serializes sync bookkeeping for one user across threads and processes.
+
+    SQLite has no row locks, so on the SQLite host this is an flock on a
+    per-user file that every gunicorn worker shares; other databases lock
+    the user's profile row for the length of a transaction.
+    """
+    if connection.vendor != "sqlite":
+        with transaction.atomic():
+            list(UserProfile.objects.select_for_update().filter(user_id=user_id).values_list("pk"))
+            yield
+        return
+
+    with _local_locks_guard:
+        local = _local_locks.setdefault(user_id, threading.Lock())
+    with local:
+        if fcntl is None:
+            yield
+            return
+        lock_dir = getattr(settings, "SYNC_LOCK_DIR", None) or os.path.join(tempfile.gettempdir(), "calendai-sync-locks")
+        os.makedirs(lock_dir, exist_ok=True)
+        with open(os.path.join(lock_dir, f"user-{user_id}.lock"), "w") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def _in_flight_job(user, canvas_url):
+    with user_sync_lock(user.pk):
+        requeue_stale(user=user)
+        job = SyncJob.objects.filter(user=user, status__in=IN_FLIGHT).order_by("created_at").first()
+        if job is None:
+            return SyncJob.objects.create(user=user, canvas_url=canvas_url)
+        logger.info("Sync for user %s attached to in-flight job %s", user.pk, job.pk)
+        return job
+
+
+def enqueue_sync(user, canvas_url):
+    """
+    Returns the user's in-flight sync job, creating and dispatching one if
+    there is none. Concurrent callers for the same user get the same job.
+    """
+    job = _in_flight_job(user, canvas_url)
+    runner = _runner()
+    if runner == "inline":
+        run_job(job.pk)
+        job.refresh_from_db()
+    elif runner == "thread" and job.status == "queued":
+        # A second thread for an already claimed job just loses the claim
+        transaction.on_commit(lambda: start_thread(job.pk))
+    return job
+
+
+def run_sync_now(user, canvas_url):
+    """
+    Runs the user's sync on this thread and returns the finished job, or
+    None if another runner already has the user's in-flight job.
+    """
+    job = _in_flight_job(user, canvas_url)
+    if not claim(job.pk):
+        return None
+    run_job(job.pk, claimed=True)
+    job.refresh_from_db()
+    return job
+
+
+def _claimable(max_age):
+    now = timezone.now()
+    return UserProfile.objects.filter(
+        Q(last_synced_at__isnull=True) | Q(last_synced_at__lt=now - max_age),
+        Q(sync_lease_until__isnull=True) | Q(sync_lease_until__lt=now),
+    )
+
+
+def stale_profiles(max_age, limit=None):
+    """User ids with a Canvas token whose last sync is older than max_age and that no worker has leased."""
+    users = (
+        _claimable(max_age).exclude(canvas_token="").exclude(canvas_url="")
+        .order_by(F("last_synced_at").asc(nulls_first=True), "pk")
+        .values_list("user_id", flat=True)
+    )
+    return list(users[:limit] if limit else users)
+
+
+def claim_lease(user_id, owner, duration, max_age):
+    """
+    Leases the user's profile to owner until now + duration. False if another
+    worker holds it or has synced it since it was listed as stale.
+    """
+    return _claimable(max_age).filter(user_id=user_id).update(
+        sync_lease_until=timezone.now() + duration, sync_lease_owner=owner
+    ) == 1
+
+
+def release_lease(user_id, owner):
+    UserProfile.objects.filter(user_id=user_id, sync_lease_owner=owner).update(
+        sync_lease_until=None, sync_lease_owner=""
+    )
+
+
+def start_thread(job_id):
+    thread = threading.Thread(target=_run_in_thread, args=(job_id,), name=f"sync-job-{job_id}", daemon=True)
+    thread.start()
+    return thread
+
+
+def _run_in_thread(job_id):
+    try:
+        run_job(job_id)
+    finally:
+        close_old_connections()
+
+
+def claim(job_id):
+    """Moves a queued job to running; False if another runner got there first."""
+    return SyncJob.objects.filter(pk=job_id, status="queued").update(
+        status="running", started_at=timezone.now()
+    ) == 1
+
+
+def claim_next():
+    for job_id in SyncJob.objects.filter(status="queued").order_by("created_at").values_list("pk", flat=True)[:10]:
+        if claim(job_id):
+            return job_id
+    return None
+
+
+def requeue_stale(max_age=None, user=None):
+    """Puts jobs whose runner died mid-sync back in the queue."""
+    if max_age is None:
+        max_age = timedelta(seconds=getattr(settings, "SYNC_JOB_STALE_AFTER", 600))
+    jobs = SyncJob.objects.filter(status="running", started_at__lt=timezone.now() - max_age)
+    if user is not None:
+        jobs = jobs.filter(user=user)
+    return jobs.update(status="queued", started_at=None)
+
+
+def run_job(job_id, claimed=False):
+    if not claimed and not claim(job_id):
+        return
+    job = SyncJob.objects.select_related("user__userprofile").get(pk=job_id)
+    try:
+        profile = job.user.userprofile
+        counts = sync_canvas(job.user, job.canvas_url, profile.canvas_token, progress=job, mode=profile.sync_mode)
+    except Exception as e:
+        traceback.print_exc()
+        job.status = "failed"
+        job.error = str(e)
+    else:
+        job.status = "done"
+        job.counts = counts
+    _finish(job)
+
+
+def _finish(job):
+    job.finished_at = timezone.now()
+    job.save(update_fields=["status", "counts", "error", "finished_at"])
+    if job.status == "done":
+        UserProfile.objects.filter(user=job.user).update(last_synced_at=job.finished_at)
+    logger.info("Sync job %s finished: %s", job.pk, job.status)
+
+
+class BufferedProgress:
+    """
+    Collects a job's progress on the event loop, where the database cannot
+    be used, and saves it in one write per batch of Canvas requests.
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self.dirty = False
+
+    def progress_start(self, course_names):
+        self.job.progress = {name: "pending" for name in course_names}
+        self.dirty = True
+
+    def progress_update(self, course_name, state):
+        self.job.progress[course_name] = state
+        self.dirty = True
+
+    async def flush(self):
+        if self.dirty:
+            self.dirty = False
+            await sync_to_async(self.job.save)(update_fields=["progress"])
+
+
+async def arun_job(job_id):
+    """run_job for a claimed job on an event loop, through async_sync_canvas."""
+    job = await SyncJob.objects.select_related("user__userprofile").aget(pk=job_id)
+    try:
+        profile = job.user.userprofile
+        counts = await async_sync_canvas(
+            job.user, job.canvas_url, profile.canvas_token, progress=BufferedProgress(job), mode=profile.sync_mode
+        )
+    except Exception as e:
+        traceback.print_exc()
+        job.status = "failed"
+        job.error = str(e)
+    else:
+        job.status = "done"
+        job.counts = counts
+    await sync_to_async(_finish)(job)
+
+
+async def arun_sync_now(user, canvas_url):
+    """
+    run_sync_now for event loops. Returns the finished job, or the user's
+    in-flight job unfinished if another runner already has it.
+    """
+    job = await sync_to_async(_in_flight_job)(user, canvas_url)
+    if not await sync_to_async(claim)(job.pk):
+        return job
+    await arun_job(job.pk)
+    await job.arefresh_from_db()
+    return job
@@ -0,0 +1,113 @@
+import os
+import socket
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import timedelta
+from functools import partial
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+from home.canvas import client_metrics
+from home.jobs import claim_lease, release_lease, run_sync_now, stale_profiles
+from home.models import UserProfile
+
+
+def _init_worker(max_workers):
+    # Forked children must not share the parent's database connections
+    django.setup()
+    connections.close_all()
+    if max_workers:
+        settings.CANVAS_MAX_WORKERS = max_workers
+
+
+def sync_user(user_id, owner, lease, max_age):
+    """Leases one user's profile, syncs it and reports what it cost."""
+    close_old_connections()
+    if not claim_lease(user_id, owner, lease, max_age):
+        return {"user": user_id, "status": "skipped", "calls": 0, "rows": 0, "seconds": 0.0}
+    start = time.monotonic()
+    calls = client_metrics()["requests"]
+    try:
+        profile = UserProfile.objects.select_related("user").get(user_id=user_id)
+        job = run_sync_now(profile.user, profile.canvas_url)
+    finally:
+        release_lease(user_id, owner)
+    counts = (job.counts if job else None) or {}
+    return {
+        "user": user_id,
+        "status": job.status if job else "busy",
+        "error": job.error if job else "",
+        "calls": client_metrics()["requests"] - calls,
+        "rows": sum(c.get(a, 0) for c in counts.values() for a in ("inserted", "updated", "deleted")),
+        "seconds": time.monotonic() - start,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Syncs every profile whose last Canvas sync is older than --stale-minutes. "
+        "Users are leased one at a time, so several copies can run at once."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--stale-minutes", type=float, default=getattr(settings, "SYNC_STALE_MINUTES", 60))
+        parser.add_argument("--processes", type=int, default=4,
+                            help="Worker processes; 0 syncs in this process.")
+        parser.add_argument("--limit", type=int, default=None, help="Most users to sync in this run.")
+        parser.add_argument("--max-workers", type=int, default=None,
+                            help="Canvas request threads per sync, overriding CANVAS_MAX_WORKERS.")
+        parser.add_argument("--lease", type=float, default=900, help="Seconds a claimed user stays leased.")
+
+    def handle(self, *args, **options):
+        self.verbosity = options["verbosity"]
+        start = time.monotonic()
+        max_age = timedelta(minutes=options["stale_minutes"])
+        user_ids = stale_profiles(max_age, options["limit"])
+        if not user_ids:
+            self.stdout.write("No stale profiles")
+            return
+
+        owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        run = partial(sync_user, owner=owner, lease=timedelta(seconds=options["lease"]), max_age=max_age)
+        results = []
+        if options["processes"] <= 0:
+            if options["max_workers"]:
+                settings.CANVAS_MAX_WORKERS = options["max_workers"]
+            for user_id in user_ids:
+                results.append(self.report(run(user_id)))
+        else:
+            connections.close_all()
+            with ProcessPoolExecutor(
+                max_workers=min(options["processes"], len(user_ids)),
+                initializer=_init_worker, initargs=(options["max_workers"],),
+            ) as pool:
+                futures = [pool.submit(run, user_id) for user_id in user_ids]
+                for future in as_completed(futures):
+                    results.append(self.report(future.result()))
+
+        synced = [r for r in results if r["status"] == "done"]
+        failed = [r for r in results if r["status"] == "failed"]
+        skipped = len(results) - len(synced) - len(failed)
+        self.stdout.write(
+            f"Synced {len(synced)} of {len(results)} users ({len(failed)} failed, {skipped} skipped) "
+            f"in {time.monotonic() - start:.1f}s"
+        )
+        self.stdout.write(
+            f"Canvas calls: {sum(r['calls'] for r in results)}; "
+            f"rows changed: {sum(r['rows'] for r in results)}; "
+            f"sync time: {sum(r['seconds'] for r in results):.1f}s"
+        )
+
+    def report(self, result):
+        if result["status"] == "failed":
+            self.stderr.write(f"User {result['user']}: sync failed: {result['error']}")
+        elif self.verbosity >= 2:
+            self.stdout.write(
+                f"User {result['user']}: {result['status']}, {result['calls']} calls, "
+                f"{result['rows']} rows, {result['seconds']:.2f}s"
+            )
+        return result
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from home.jobs import claim_next, requeue_stale, run_job
+
+
+class Command(BaseCommand):
+    help = "Runs queued Canvas sync jobs. Use with SYNC_JOB_RUNNER = 'worker'."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Exit once the queue is empty.")
+        parser.add_argument("--poll", type=float, default=2.0, help="Seconds to wait when the queue is empty.")
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            requeued = requeue_stale()
+            if requeued:
+                self.stdout.write(f"Requeued {requeued} stale job(s)")
+            job_id = claim_next()
+            if job_id is None:
+                if options["once"]:
+                    return
+                time.sleep(options["poll"])
+                continue
+            self.stdout.write(f"Running sync job {job_id}")
+            run_job(job_id, claimed=True)
@@ -0,0 +1,70 @@
+# Generated by Django 4.2.20 on 2026-10-18 15:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0010_alter_userprofile_canvas_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='canvas_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='canvas_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='module',
+            name='canvas_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='module',
+            name='canvas_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='module',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='moduleitem',
+            name='canvas_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='moduleitem',
+            name='canvas_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='moduleitem',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddConstraint(
+            model_name='event',
+            constraint=models.UniqueConstraint(fields=('user', 'canvas_id'), name='unique_event_canvas_id_per_user'),
+        ),
+        migrations.AddConstraint(
+            model_name='module',
+            constraint=models.UniqueConstraint(fields=('user', 'canvas_id'), name='unique_module_canvas_id_per_user'),
+        ),
+        migrations.AddConstraint(
+            model_name='moduleitem',
+            constraint=models.UniqueConstraint(fields=('user', 'canvas_id'), name='unique_moduleitem_canvas_id_per_user'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.20 on 2026-10-18 16:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0012_syncjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='sync_mode',
+            field=models.CharField(choices=[('courses', 'Per course'), ('planner', 'Planner')], default='courses', max_length=10),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.20 on 2026-10-18 16:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0013_userprofile_sync_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='last_synced_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='sync_lease_owner',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='sync_lease_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.20 on 2026-10-18 16:43
+
+from django.db import migrations, models
+
+from home.sanitize import render_description
+
+
+def render_existing(apps, schema_editor):
+    Event = apps.get_model('home', 'Event')
+    batch = []
+    for event in Event.objects.only('pk', 'description').iterator(chunk_size=500):
+        event.description_html, event.description_excerpt = render_description(event.description)
+        batch.append(event)
+        if len(batch) == 500:
+            Event.objects.bulk_update(batch, ['description_html', 'description_excerpt'])
+            batch = []
+    if batch:
+        Event.objects.bulk_update(batch, ['description_html', 'description_excerpt'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0014_userprofile_sync_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='description_excerpt',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='description_html',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.RunPython(render_existing, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.20 on 2026-10-18 16:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0015_event_description_html'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['user', 'due_date'], name='event_user_due_date_idx'),
+        ),
+    ]
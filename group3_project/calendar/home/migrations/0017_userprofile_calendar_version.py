@@ -0,0 +1,18 @@
+# Generated by Django 4.2.20 on 2026-10-18 16:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0016_event_user_due_date_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='calendar_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.20 on 2026-10-18 17:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0017_userprofile_calendar_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='calendar_changed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='ics_token',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+    ]
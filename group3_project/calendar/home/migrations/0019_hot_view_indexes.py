@@ -0,0 +1,25 @@
+# Generated by Django 4.2.20 on 2026-10-18 17:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0018_userprofile_ics_token'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['user', 'event_type', 'due_date'], name='event_user_type_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['user', 'course_name', 'event_type', 'due_date'], name='event_user_course_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='module',
+            index=models.Index(fields=['user', 'course_name'], name='module_user_course_idx'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.20 on 2026-10-18 17:18
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('home', '0019_hot_view_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Course',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('term', models.CharField(blank=True, max_length=255)),
+                ('canvas_id', models.BigIntegerField(blank=True, null=True)),
+                ('canvas_updated_at', models.DateTimeField(blank=True, null=True)),
+                ('content_hash', models.CharField(blank=True, max_length=64)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='courses', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='course',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='home.course'),
+        ),
+        migrations.AddField(
+            model_name='module',
+            name='course',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='home.course'),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['user', 'name'], name='course_user_name_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='course',
+            constraint=models.UniqueConstraint(fields=('user', 'canvas_id'), name='unique_course_canvas_id_per_user'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+from django.db import migrations
+
+# What EventForm stored for events outside any course; those get no Course
+PERSONAL = 'Personal'
+
+
+def link_courses(apps, schema_editor):
+    Course = apps.get_model('home', 'Course')
+    Event = apps.get_model('home', 'Event')
+    Module = apps.get_model('home', 'Module')
+    names = set()
+    for model in (Event, Module):
+        names.update(
+            model.objects.exclude(user=None).exclude(course_name=None).exclude(course_name__in=['', PERSONAL])
+            .values_list('user_id', 'course_name').distinct()
+        )
+    # canvas_id stays null; the next sync matches these to Canvas courses by name
+    Course.objects.bulk_create([Course(user_id=user_id, name=name) for user_id, name in sorted(names)], batch_size=500)
+    for course in Course.objects.all().iterator():
+        for model in (Event, Module):
+            model.objects.filter(user_id=course.user_id, course_name=course.name).update(course=course)
+
+
+def unlink_courses(apps, schema_editor):
+    Event = apps.get_model('home', 'Event')
+    Module = apps.get_model('home', 'Module')
+    for model in (Event, Module):
+        for row in model.objects.exclude(course=None).select_related('course').iterator():
+            model.objects.filter(pk=row.pk).update(course_name=row.course.name)
+    Event.objects.filter(course=None, custom=True).update(course_name=PERSONAL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0020_course'),
+    ]
+
+    operations = [
+        migrations.RunPython(link_courses, unlink_courses),
+    ]
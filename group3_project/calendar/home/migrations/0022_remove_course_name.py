@@ -0,0 +1,39 @@
+# Generated by Django 4.2.20 on 2026-10-18 17:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0021_link_courses'),
+    ]
+
+    operations = [
+        # Gives the column back with a default when this is reversed; 0021 then refills it
+        migrations.AlterField(
+            model_name='module',
+            name='course_name',
+            field=models.CharField(default='', max_length=100),
+        ),
+        migrations.RemoveIndex(
+            model_name='event',
+            name='event_user_course_due_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='module',
+            name='module_user_course_idx',
+        ),
+        migrations.RemoveField(
+            model_name='event',
+            name='course_name',
+        ),
+        migrations.RemoveField(
+            model_name='module',
+            name='course_name',
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['course', 'event_type', 'due_date'], name='event_course_type_due_idx'),
+        ),
+    ]
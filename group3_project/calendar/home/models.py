@@ -1,7 +1,35 @@
 # models.py
+import secrets
+from typing import Any
+
 from django.db import models
 from django.contrib.auth.models import User
 
+from .recurrence import format_rule, last_occurrence, parse_rule
+from .sanitize import render_description
+
+
+# A Canvas course, or a course name carried over from before courses were stored
+class Course(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='courses')
+    name = models.CharField(max_length=255)
+    term = models.CharField(max_length=255, blank=True)  # Canvas enrollment term name
+    canvas_id = models.BigIntegerField(blank=True, null=True)  # Null until a sync matches it to Canvas
+    canvas_updated_at = models.DateTimeField(blank=True, null=True)
+    content_hash = models.CharField(max_length=64, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'canvas_id'], name='unique_course_canvas_id_per_user'),
+        ]
+        indexes = [
+            # courses_list and EventForm list the user's courses by name
+            models.Index(fields=['user', 'name'], name='course_user_name_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return self.name
+
 
 # Model for assignments, quizzes, and tests
 class Event(models.Model):
@@ -16,22 +44,70 @@ class Event(models.Model):
     description = models.TextField(blank=True, null=True)
     due_date = models.DateTimeField()
     event_type = models.CharField(max_length=10, choices=EVENT_TYPES)
-    course_name = models.CharField(max_length=100, null=True)
+    course = models.ForeignKey(Course, on_delete=models.SET_NULL, blank=True, null=True)  # Null for personal events
     custom = models.BooleanField(default=False)
+    canvas_id = models.BigIntegerField(blank=True, null=True)  # Canvas assignment id, null for custom events
+    canvas_updated_at = models.DateTimeField(blank=True, null=True)
+    content_hash = models.CharField(max_length=64, blank=True)  # Hash of the synced fields
+    # Derived from description when it is written; see home.sanitize
+    description_html = models.TextField(blank=True, default='')
+    description_excerpt = models.CharField(max_length=255, blank=True, default='')
+    # Custom events can repeat; due_date is the first occurrence, see home.recurrence
+    recurrence = models.CharField(max_length=100, blank=True, default='')  # RRULE, empty for one-off events
+    recurrence_end = models.DateTimeField(blank=True, null=True)  # Last occurrence, null if it never ends
+    recurrence_exceptions = models.JSONField(blank=True, default=list)  # Keys of skipped occurrences
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'canvas_id'], name='unique_event_canvas_id_per_user'),
+        ]
+        indexes = [
+            # The calendar feed reads one user's events in a due date window
+            models.Index(fields=['user', 'due_date'], name='event_user_due_date_idx'),
+            # index: upcoming assignments; course_detail: a course's assignments, both by due date
+            models.Index(fields=['user', 'event_type', 'due_date'], name='event_user_type_due_idx'),
+            models.Index(fields=['course', 'event_type', 'due_date'], name='event_course_type_due_idx'),
+            # The calendar feed's series query; only the few recurring events are indexed
+            models.Index(fields=['user', 'due_date'], condition=~models.Q(recurrence=''), name='event_user_series_idx'),
+        ]
 
     def __str__(self) -> str:
         return f"{self.title} ({self.get_event_type_display()})"
 
+    def save(self, *args: Any, **kwargs: Any) -> None:
+        # Canvas sync writes these in bulk itself; single saves (custom events) refresh them here
+        self.description_html, self.description_excerpt = render_description(self.description)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'description' in update_fields:
+            update_fields = kwargs['update_fields'] = {*update_fields, 'description_html', 'description_excerpt'}
+        if self.recurrence:
+            rule = parse_rule(self.recurrence)
+            self.recurrence = format_rule(rule)
+            self.recurrence_end = last_occurrence(self.due_date, rule)
+        else:
+            self.recurrence_end = None
+        if update_fields is not None and {'recurrence', 'due_date'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'recurrence', 'recurrence_end'}
+        super().save(*args, **kwargs)
+
 
 # Module model to store Canvas module information
 class Module(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True)
-    course_name = models.CharField(max_length=100)
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, null=True)
     title = models.CharField(max_length=255)
     description = models.TextField(blank=True, null=True)
+    canvas_id = models.BigIntegerField(blank=True, null=True)
+    canvas_updated_at = models.DateTimeField(blank=True, null=True)
+    content_hash = models.CharField(max_length=64, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'canvas_id'], name='unique_module_canvas_id_per_user'),
+        ]
 
     def __str__(self) -> str:
-        return f"{self.course_name} - {self.title}"
+        return f"{self.course.name} - {self.title}" if self.course else self.title
 
 
 # Stores individual items inside the module
@@ -42,6 +118,14 @@ class ModuleItem(models.Model):
     item_type = models.CharField(max_length=50, blank=True)  # e.g., "Page", "File", etc.
     file_url = models.URLField(blank=True, null=True)  # URL to a file hosted externally (Canvas)
     content = models.TextField(blank=True, null=True)  # Content field
+    canvas_id = models.BigIntegerField(blank=True, null=True)
+    canvas_updated_at = models.DateTimeField(blank=True, null=True)
+    content_hash = models.CharField(max_length=64, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'canvas_id'], name='unique_moduleitem_canvas_id_per_user'),
+        ]
 
     def __str__(self) -> str:
         return self.title
@@ -49,9 +133,62 @@ class ModuleItem(models.Model):
 
 # Model for user profile including the api access token
 class UserProfile(models.Model):
+    SYNC_MODES = [
+        ('courses', 'Per course'),
+        ('planner', 'Planner'),
+    ]
+
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     canvas_token = models.CharField(max_length=255, blank=True)
     canvas_url = models.CharField(max_length=255, blank=True)
+    sync_mode = models.CharField(max_length=10, choices=SYNC_MODES, default='courses')  # How assignments are read
+    last_synced_at = models.DateTimeField(blank=True, null=True)  # Last successful Canvas sync
+    sync_lease_until = models.DateTimeField(blank=True, null=True)  # Held by a `manage.py sync_canvas` worker
+    sync_lease_owner = models.CharField(max_length=64, blank=True)
+    calendar_version = models.PositiveIntegerField(default=0)  # Bumped whenever the user's events change
+    calendar_changed_at = models.DateTimeField(blank=True, null=True)  # When calendar_version last went up
+    ics_token = models.CharField(max_length=64, blank=True, null=True, unique=True)  # Secret in the .ics feed URL
 
     def __str__(self) -> str:
         return f"{self.user.username}'s Profile"
+
+    def reset_ics_token(self) -> str:
+        # Replacing the token retires any subscription made with the old URL
+        self.ics_token = secrets.token_urlsafe(32)
+        self.save(update_fields=["ics_token"])
+        return self.ics_token
+
+
+# A queued or finished Canvas sync, run outside the request that asked for it
+class SyncJob(models.Model):
+    STATUSES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sync_jobs')
+    canvas_url = models.CharField(max_length=255)
+    status = models.CharField(max_length=10, choices=STATUSES, default='queued')
+    progress = models.JSONField(default=dict)  # course name -> pending/fetched/done/failed
+    counts = models.JSONField(blank=True, null=True)  # inserted/updated/deleted/unchanged per model
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self) -> str:
+        return f"Sync {self.pk} for {self.user} ({self.status})"
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ('done', 'failed')
+
+    def progress_start(self, course_names: list[str]) -> None:
+        self.progress = {name: 'pending' for name in course_names}
+        self.save(update_fields=['progress'])
+
+    def progress_update(self, course_name: str, state: str) -> None:
+        self.progress[course_name] = state
+        self.save(update_fields=['progress'])
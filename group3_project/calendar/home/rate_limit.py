@@ -0,0 +1,184 @@
+"""
+Per-token pacing for Canvas API requests.
+
+Canvas meters every access token with a leaky bucket: each response reports
+the cost of the request (X-Request-Cost) and what is left in the bucket
+(X-Rate-Limit-Remaining), and a token that runs dry gets 403 "Rate Limit
+Exceeded" until the bucket refills. A RateLimiter tracks that budget for
+one token across every thread using it and holds requests back while the
+projected budget, after what is already in flight, would fall under
+CANVAS_RATE_LIMIT_RESERVE. Throttled responses block the token for the
+Retry-After period, or an exponential backoff with full jitter.
+"""
+import hashlib
+import math
+import random
+import threading
+import time
+
+from django.conf import settings
+
+# Nothing is known about a token until its first response comes back
+UNKNOWN = None
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def is_throttled(resp) -> bool:
+    if resp.status_code == 429:
+        return True
+    return resp.status_code == 403 and b"Rate Limit Exceeded" in resp.content
+
+
+def retry_after(resp):
+    """Seconds from a Retry-After header, or None if there is no usable one."""
+    value = resp.headers.get("Retry-After")
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+def backoff_delay(attempt, base=None, cap=None):
+    base = _setting("CANVAS_RATE_LIMIT_BACKOFF", 0.5) if base is None else base
+    cap = _setting("CANVAS_RATE_LIMIT_MAX_BACKOFF", 30.0) if cap is None else cap
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class RateLimiter:
+    def __init__(self, reserve, refill):
+        self.reserve = reserve
+        self.refill = refill  # budget units Canvas gives back per second
+        self.remaining = UNKNOWN
+        self.capacity = 0.0  # the bucket never refills past the most Canvas has reported
+        self.observed_at = 0.0
+        self.cost = 1.0  # moving average of X-Request-Cost
+        self.in_flight = 0
+        self.sent = 0
+        self.blocked_until = 0.0
+        self.throttled = 0
+        self.waited = 0.0
+        self._cond = threading.Condition()
+
+    def _delay(self, now):
+        """Seconds the next request has to wait, 0 if it can go now."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.remaining is UNKNOWN:
+            # Probe with a single request until Canvas reports the budget
+            return math.inf if self.in_flight else 0.0
+        projected = self._refilled(now) - self.in_flight * self.cost
+        shortfall = self.reserve + self.cost - projected
+        if shortfall <= 0:
+            return 0.0
+        if self.refill <= 0:
+            # No refill estimate: wait for in-flight responses to report the budget
+            return math.inf if self.in_flight else 0.0
+        return shortfall / self.refill
+
+    def _refilled(self, now):
+        refilled = min(self.capacity, self.remaining + self.refill * (now - self.observed_at))
+        return max(refilled, self.remaining)
+
+    def acquire(self) -> int:
+        """Waits until a request fits the budget; returns its send sequence for release()."""
+        with self._cond:
+            start = time.monotonic()
+            while True:
+                delay = self._delay(time.monotonic())
+                if delay <= 0:
+                    break
+                self._cond.wait(None if delay == math.inf else min(delay, 5.0))
+            self.waited += time.monotonic() - start
+            self.in_flight += 1
+            self.sent += 1
+            return self.sent
+
+    def try_acquire(self, waited=0.0):
+        """
+        acquire() for event loops, which must not block: returns (seq, 0) if
+        a request fits the budget now, else (None, seconds to wait first).
+        waited is added to the wait statistics when the request is let through.
+        """
+        with self._cond:
+            delay = self._delay(time.monotonic())
+            if delay > 0:
+                return None, delay
+            self.waited += waited
+            self.in_flight += 1
+            self.sent += 1
+            return self.sent, 0.0
+
+    def release(self, seq, resp=None):
+        with self._cond:
+            self.in_flight -= 1
+            if resp is not None:
+                self._observe(seq, resp)
+            self._cond.notify_all()
+
+    def _observe(self, seq, resp):
+        remaining = resp.headers.get("X-Rate-Limit-Remaining")
+        cost = resp.headers.get("X-Request-Cost")
+        try:
+            if cost is not None:
+                self.cost = 0.8 * self.cost + 0.2 * float(cost)
+            if remaining is not None:
+                reading = float(remaining)
+                now = time.monotonic()
+                if self.remaining is UNKNOWN or self.remaining == math.inf or (self.in_flight == 0 and seq == self.sent):
+                    self.remaining = reading
+                else:
+                    # Concurrent responses overtake each other, so a reading may predate
+                    # charges already made; only the lowest estimate is safe
+                    self.remaining = min(self._refilled(now), reading)
+                self.capacity = max(self.capacity, reading)
+                self.observed_at = now
+            elif self.remaining is UNKNOWN and not is_throttled(resp):
+                # This Canvas does not meter the token
+                self.remaining = math.inf
+        except ValueError:
+            pass
+
+    def back_off(self, attempt, resp):
+        """Blocks the token after a throttled response and returns the delay."""
+        delay = retry_after(resp)
+        if delay is None:
+            delay = backoff_delay(attempt)
+        with self._cond:
+            self.throttled += 1
+            # Re-learn the budget with a single probe once the block lifts
+            self.remaining = UNKNOWN
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+        return delay
+
+    def stats(self):
+        with self._cond:
+            return {
+                "remaining": self.remaining,
+                "cost": self.cost,
+                "throttled": self.throttled,
+                "waited": self.waited,
+            }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def rate_limiter(headers) -> RateLimiter:
+    """Returns the process-wide limiter for the token in headers' Authorization."""
+    key = hashlib.sha256(headers.get("Authorization", "").encode()).hexdigest()
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = RateLimiter(
+                _setting("CANVAS_RATE_LIMIT_RESERVE", 50.0), _setting("CANVAS_RATE_LIMIT_REFILL", 10.0)
+            )
+            _limiters[key] = limiter
+        return limiter
+
+
+def rate_limit_stats(headers):
+    return rate_limiter(headers).stats()
@@ -0,0 +1,106 @@
+"""
+Recurrence rules for custom events.
+
+A recurring Event keeps its first occurrence in due_date and an iCalendar
+RRULE in recurrence, limited to FREQ=DAILY or FREQ=WEEKLY with INTERVAL
+and at most one of UNTIL and COUNT. Occurrences are never stored:
+occurrences() works out the ones inside a window, starting from the first
+one in it, so the cost follows the window and not the length of the
+series. Skipped occurrences are listed by key in recurrence_exceptions.
+Times step in UTC, the site's time zone.
+"""
+import math
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+FREQUENCIES = {"DAILY": timedelta(days=1), "WEEKLY": timedelta(weeks=1)}
+MAX_INTERVAL = 366
+MAX_COUNT = 1000
+
+Rule = namedtuple("Rule", "freq interval until count")
+
+
+class InvalidRule(ValueError):
+    pass
+
+
+def occurrence_key(value):
+    """An occurrence's UTC start as iCalendar writes it; also the UNTIL format."""
+    return value.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def parse_key(text):
+    try:
+        return datetime.strptime(text, "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError):
+        raise InvalidRule(f"{text!r} is not a UTC time like 20260115T170000Z")
+
+
+def parse_rule(text):
+    parts = {}
+    for part in text.strip().upper().removeprefix("RRULE:").split(";"):
+        name, sep, value = part.partition("=")
+        if not sep or name in parts:
+            raise InvalidRule(f"Cannot read {part!r} in recurrence rule")
+        parts[name] = value
+    unsupported = set(parts) - {"FREQ", "INTERVAL", "UNTIL", "COUNT"}
+    if unsupported:
+        raise InvalidRule(f"Unsupported recurrence parts: {', '.join(sorted(unsupported))}")
+    if parts.get("FREQ") not in FREQUENCIES:
+        raise InvalidRule("Recurrence must repeat DAILY or WEEKLY")
+    if "UNTIL" in parts and "COUNT" in parts:
+        raise InvalidRule("Recurrence can end on a date or after a count, not both")
+    try:
+        interval = int(parts.get("INTERVAL", "1"))
+        count = int(parts["COUNT"]) if "COUNT" in parts else None
+    except ValueError:
+        raise InvalidRule("INTERVAL and COUNT must be whole numbers")
+    if not 1 <= interval <= MAX_INTERVAL:
+        raise InvalidRule(f"INTERVAL must be between 1 and {MAX_INTERVAL}")
+    if count is not None and not 1 <= count <= MAX_COUNT:
+        raise InvalidRule(f"COUNT must be between 1 and {MAX_COUNT}")
+    until = parse_key(parts["UNTIL"]) if "UNTIL" in parts else None
+    return Rule(parts["FREQ"], interval, until, count)
+
+
+def format_rule(rule):
+    parts = [f"FREQ={rule.freq}", f"INTERVAL={rule.interval}"]
+    if rule.until is not None:
+        parts.append(f"UNTIL={occurrence_key(rule.until)}")
+    if rule.count is not None:
+        parts.append(f"COUNT={rule.count}")
+    return ";".join(parts)
+
+
+def _step(rule):
+    return FREQUENCIES[rule.freq] * rule.interval
+
+
+def last_occurrence(start, rule):
+    """The series' final occurrence, or None if it never ends."""
+    if rule.count is not None:
+        return start + _step(rule) * (rule.count - 1)
+    if rule.until is not None:
+        if rule.until < start:
+            return start
+        return start + _step(rule) * ((rule.until - start) // _step(rule))
+    return None
+
+
+def occurrences(start, rule, window_start, window_end, exceptions=()):
+    """Yields the series' occurrences in [window_start, window_end), skipping exception keys."""
+    step = _step(rule)
+    last = last_occurrence(start, rule)
+    index = max(0, math.ceil((window_start - start) / step))
+    skipped = set(exceptions)
+    while True:
+        when = start + step * index
+        if when >= window_end or (last is not None and when > last):
+            return
+        if occurrence_key(when) not in skipped:
+            yield when
+        index += 1
+
+
+def is_occurrence(start, rule, when):
+    return any(occurrences(start, rule, when, when + timedelta(seconds=1)))
@@ -0,0 +1,122 @@
+"""
+Allowlist HTML sanitizing for Canvas descriptions.
+
+Canvas hands back whatever the instructor pasted into the rich content
+editor. sanitize_html keeps a small set of formatting tags and safe
+attributes and drops everything else, including the contents of script and
+style elements; excerpt shortens the remaining text for previews. Both run
+once when a description is stored rather than on every page load.
+"""
+from html import escape
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+
+ALLOWED_TAGS = {
+    "a", "b", "blockquote", "br", "code", "div", "em", "h1", "h2", "h3", "h4", "h5", "h6", "hr", "i",
+    "img", "li", "ol", "p", "pre", "s", "span", "strong", "sub", "sup", "table", "tbody", "td", "th",
+    "thead", "tr", "u", "ul",
+}
+ALLOWED_ATTRIBUTES = {
+    "a": {"href", "title"},
+    "img": {"src", "alt", "title", "width", "height"},
+    "td": {"colspan", "rowspan"},
+    "th": {"colspan", "rowspan"},
+}
+URL_ATTRIBUTES = {"href", "src"}
+ALLOWED_SCHEMES = {"http", "https", "mailto", ""}
+VOID_TAGS = {"br", "hr", "img"}
+# Dropped together with everything inside them
+SKIPPED_TAGS = {"script", "style", "iframe", "object", "embed", "template", "noscript"}
+BLOCK_TAGS = {
+    "blockquote", "br", "div", "h1", "h2", "h3", "h4", "h5", "h6", "hr", "li", "p", "pre", "table", "tr",
+}
+
+EXCERPT_LENGTH = 200
+
+
+class _Sanitizer(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.html = []
+        self.text = []
+        self.open_tags = []
+        self.skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self.skipping += 1
+            return
+        if self.skipping:
+            return
+        if tag in BLOCK_TAGS:
+            self.text.append("\n")
+        if tag not in ALLOWED_TAGS:
+            return
+        kept = []
+        for name, value in attrs:
+            if name not in ALLOWED_ATTRIBUTES.get(tag, ()) or value is None:
+                continue
+            if name in URL_ATTRIBUTES and urlsplit(value.strip()).scheme.lower() not in ALLOWED_SCHEMES:
+                continue
+            kept.append(f' {name}="{escape(value)}"')
+        if tag == "a":
+            kept.append(' rel="noopener noreferrer"')
+        self.html.append(f"<{tag}{''.join(kept)}>")
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag in self.open_tags and self.open_tags[-1] == tag:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self.skipping = max(0, self.skipping - 1)
+            return
+        if self.skipping or tag not in self.open_tags:
+            return
+        # Close anything left open inside this element so the output stays balanced
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.html.append(f"</{open_tag}>")
+            if open_tag == tag:
+                break
+        if tag in BLOCK_TAGS:
+            self.text.append("\n")
+
+    def handle_data(self, data):
+        if self.skipping:
+            return
+        self.html.append(escape(data, quote=False))
+        self.text.append(data)
+
+    def close(self):
+        super().close()
+        while self.open_tags:
+            self.html.append(f"</{self.open_tags.pop()}>")
+
+
+def _parse(html):
+    parser = _Sanitizer()
+    parser.feed(html or "")
+    parser.close()
+    return parser
+
+
+def sanitize_html(html):
+    return "".join(_parse(html).html)
+
+
+def excerpt(text, length=EXCERPT_LENGTH):
+    text = " ".join(text.split())
+    if len(text) <= length:
+        return text
+    return text[:length - 1].rsplit(" ", 1)[0].rstrip(" .,;:") + "…"
+
+
+def render_description(html):
+    """(sanitized HTML, plain-text excerpt) for a stored description."""
+    parser = _parse(html)
+    text = " ".join("".join(parser.text).split())
+    return "".join(parser.html), excerpt(text)
@@ -1,7 +1,8 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import UserProfile
+from .calendar_cache import bump_calendar_version
+from .models import Event, UserProfile
 from typing import Any
 from django.db.models import Model
 
@@ -17,3 +18,9 @@ def create_or_update_user_profile(
         UserProfile.objects.create(user=instance)
     else:
         instance.userprofile.save()
+
+
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+def bump_calendar_on_event_change(sender: type[Model], instance: Event, **kwargs: Any) -> None:
+    bump_calendar_version(instance.user_id)
@@ -0,0 +1,576 @@
+import hashlib
+import json
+import logging
+from collections import Counter, namedtuple
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+
+from asgiref.sync import sync_to_async
+from django.db import connection, models, transaction
+
+from .async_canvas import afetch_all, afetch_records, loop_client
+from .calendar_cache import calendar_changes
+from .canvas import cache_stats, fetch_all, iter_canvas_pages
+from .models import Course, Event, Module, ModuleItem
+from .rate_limit import rate_limit_stats
+from .sanitize import render_description
+
+logger = logging.getLogger(__name__)
+
+SYNC_ACTIONS = ("inserted", "updated", "deleted", "unchanged")
+
+
+def parse_date(date_str):
+    if not date_str:
+        return None
+    if date_str.endswith("Z"):
+        date_str = date_str[:-1]
+    try:
+        return datetime.fromisoformat(date_str)
+    except ValueError:
+        return None
+
+
+# Canvas timestamps are UTC; stored values come back aware, so compare aware
+def parse_canvas_time(date_str):
+    value = parse_date(date_str)
+    if value is not None and value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+# Reads every page of a Canvas listing
+def fetch_records(url, headers, shape=None):
+    """
+    shape(record), if given, is applied to each record as its page comes
+    in and records it maps to None are dropped, so a sync holds only the
+    fields it stores rather than every page of raw Canvas JSON.
+    """
+    records = iter_canvas_pages(url, headers)
+    if shape is None:
+        return list(records)
+    return [kept for kept in map(shape, records) if kept is not None]
+
+
+def courses_url(canvas_url):
+    return f"{canvas_url}/api/v1/courses?enrollment_state=active&include[]=term&per_page=100"
+
+
+def get_active_courses(canvas_url, api_token):
+    url = courses_url(canvas_url)
+    headers = {"Authorization": f"Bearer {api_token}"}
+    try:
+        return fetch_records(url, headers)
+    except Exception as e:
+        raise Exception(f"Error fetching courses: {e}")
+
+
+def planner_urls(canvas_url, year):
+    return [
+        f"{canvas_url}/api/v1/planner/items?" + urlencode(
+            {"start_date": f"{year}-01-01", "end_date": f"{year + 1}-01-01", "per_page": 100}
+        ),
+        f"{canvas_url}/api/v1/users/self/upcoming_events",
+    ]
+
+
+def planner_record(item):
+    """
+    A planner item as an assignment-shaped record with its course_id, or
+    None if it is not an assignment. Quizzes and graded discussions are
+    keyed on their assignment id, as the per-course listing keys them.
+    """
+    plannable = item.get("plannable") or {}
+    assignment_id = plannable.get("assignment_id")
+    if assignment_id is None and item.get("plannable_type") == "assignment":
+        assignment_id = item.get("plannable_id")
+    if assignment_id is None:
+        return None
+    return {
+        "id": assignment_id,
+        "course_id": item.get("course_id"),
+        "name": plannable.get("title", "Untitled Assignment"),
+        "due_at": plannable.get("due_at") or item.get("plannable_date"),
+        "updated_at": plannable.get("updated_at"),
+    }
+
+
+def upcoming_description(event):
+    """(assignment id, description) for an upcoming_events entry, or None if it is not an assignment."""
+    assignment = event.get("assignment")
+    return (assignment["id"], assignment.get("description") or "") if assignment else None
+
+
+def planner_assignments(planner_records, upcoming, course_ids):
+    """
+    Groups planner_record output into assignment-shaped records per course.
+
+    Returns (course id -> records, ids whose description is unknown).
+    Planner items carry no description, so descriptions come from
+    upcoming_events (as upcoming_description pairs) where Canvas lists the
+    assignment there.
+    """
+    descriptions = dict(upcoming or [])
+    by_course = {cid: [] for cid in course_ids}
+    unknown = set()
+    for record in planner_records:
+        if record["course_id"] not in by_course:
+            continue
+        if record["id"] not in descriptions:
+            unknown.add(record["id"])
+        by_course[record["course_id"]].append({**record, "description": descriptions.get(record["id"], "")})
+    return by_course, unknown
+
+
+def assignment_event(a, course_id, year):
+    """The upsert entry, (canvas id, (updated_at, values)), for an assignment due in year; None otherwise."""
+    due = parse_canvas_time(a.get("due_at") or "")
+    if not due or due.year != year:
+        return None
+    return a["id"], (parse_canvas_time(a.get("updated_at")), {
+        "title": a.get("name", "Untitled Assignment"),
+        "description": a.get("description") or "",
+        "due_date": due,
+        "event_type": "assignment",
+        "course": course_id,
+    })
+
+
+def module_entry(m, course_id):
+    """(canvas id, (None, values), item entries or None if Canvas left the items out) for a module."""
+    values = {"title": m.get("name", "Untitled Module"), "course": course_id, "description": m.get("description") or ""}
+    return m["id"], (None, values), [item_entry(it) for it in m["items"]] if "items" in m else None
+
+
+def item_entry(it):
+    return it["id"], {
+        "title": it.get("title", "Untitled Item"),
+        "item_type": it.get("type", ""),
+        "file_url": it.get("external_url") or "",
+        "content": it.get("content") or "",
+    }
+
+
+def content_hash(values):
+    # Related rows hash as their Canvas id so the digest is stable across pks
+    payload = json.dumps(
+        values, sort_keys=True,
+        default=lambda v: v.canvas_id if isinstance(v, models.Model) else str(v)
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def upsert(model, user, existing, incoming, keep, counts, derive=None):
+    """
+    Applies one model's Canvas snapshot to the user's rows.
+
+    existing maps canvas_id to the stored row and is consumed; incoming maps canvas_id to
+    (canvas updated_at, field values). Rows whose updated_at and content hash
+    both match are left alone; stored rows missing from incoming are stale
+    unless keep(row) says their source could not be read this time.
+    derive(values), if given, returns further field values computed from the
+    synced ones; it only runs for rows being written and is not hashed.
+    Returns (canvas_id -> row for everything now stored, stale pks). Stale
+    rows are left for the caller to delete so children go before parents.
+    """
+    rows = {}
+    to_create = []
+    to_update = []
+    changed_fields = set()
+
+    for canvas_id, (updated_at, values) in incoming.items():
+        digest = content_hash(values)
+        row = existing.pop(canvas_id, None)
+        if row is not None and row.content_hash == digest and row.canvas_updated_at == updated_at:
+            counts["unchanged"] += 1
+            rows[canvas_id] = row
+            continue
+        if derive is not None:
+            values = {**values, **derive(values)}
+        if row is None:
+            row = model(user=user, canvas_id=canvas_id, canvas_updated_at=updated_at, content_hash=digest, **values)
+            to_create.append(row)
+        else:
+            for field, value in values.items():
+                setattr(row, field, value)
+            row.canvas_updated_at = updated_at
+            row.content_hash = digest
+            changed_fields.update(values)
+            to_update.append(row)
+        rows[canvas_id] = row
+
+    stale = [row.pk for row in existing.values() if not keep(row)]
+    counts["unchanged"] += len(existing) - len(stale)
+    if to_update:
+        model.objects.bulk_update(
+            to_update, sorted(changed_fields) + ["canvas_updated_at", "content_hash"], batch_size=500
+        )
+    if to_create:
+        model.objects.bulk_create(to_create, batch_size=500)
+        if to_create[0].pk is None:
+            # Backends that cannot return ids from a bulk insert: one read maps them back
+            pks = dict(model.objects.filter(
+                user=user, canvas_id__in=[row.canvas_id for row in to_create]
+            ).values_list("canvas_id", "pk"))
+            for row in to_create:
+                row.pk = pks[row.canvas_id]
+
+    counts["inserted"] += len(to_create)
+    counts["updated"] += len(to_update)
+    counts["deleted"] += len(stale)
+    return rows, stale
+
+
+def _stored(queryset):
+    """
+    Splits stored rows into a canvas_id map and legacy rows from before
+    rows were keyed on Canvas ids; legacy rows are always replaced.
+    """
+    keyed = {}
+    legacy = {}
+    for row in queryset:
+        if row.canvas_id is None:
+            legacy[("legacy", row.pk)] = row
+        else:
+            keyed[row.canvas_id] = row
+    keyed.update(legacy)
+    return keyed
+
+
+def module_item_values(item_lists, module_rows, failed_modules):
+    """
+    Builds the incoming ModuleItem snapshot from (module canvas_id, item
+    entries) pairs, attaching each item to its Module row through
+    module_rows so no per-module lookups are needed. Modules whose items
+    could not be read are added to failed_modules.
+    """
+    items = {}
+    for mid, entries in item_lists:
+        if entries is None:
+            failed_modules.add(mid)
+            continue
+        for item_id, values in entries:
+            items[item_id] = (None, {"module": module_rows[mid], **values})
+    return items
+
+
+def adopt_courses(stored, incoming):
+    """
+    Gives stored courses that have no Canvas id yet, the ones carried over
+    from course names, the id of the incoming course with the same name, so
+    the events that point at them keep doing so.
+    """
+    by_name = {values["name"]: canvas_id for canvas_id, (_, values) in incoming.items()}
+    for key, row in list(stored.items()):
+        canvas_id = by_name.get(row.name)
+        if row.canvas_id is not None or canvas_id is None or canvas_id in stored:
+            continue
+        Course.objects.filter(pk=row.pk).update(canvas_id=canvas_id)
+        row.canvas_id = canvas_id
+        stored[canvas_id] = stored.pop(key)
+
+
+def with_courses(incoming, course_rows):
+    """incoming with each Canvas course id swapped for its Course row."""
+    return {
+        canvas_id: (updated_at, {**values, "course": course_rows[values["course"]]})
+        for canvas_id, (updated_at, values) in incoming.items()
+    }
+
+
+def description_fields(values):
+    html, text = render_description(values["description"])
+    return {"description_html": html, "description_excerpt": text}
+
+
+def reserve_writes():
+    """
+    Takes SQLite's write lock at the start of the transaction. A deferred
+    transaction that reads first and then tries to write fails at once if
+    another connection wrote in between, where a transaction that asks for
+    the write lock up front waits out the busy timeout like any writer.
+    Other databases lock rows as they go.
+    """
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            cursor.execute(f"UPDATE {Event._meta.db_table} SET id = id WHERE 0")
+
+
+# events and modules name their course by Canvas id; failed_courses holds Canvas course ids
+Snapshot = namedtuple("Snapshot", "courses events modules item_lists failed_courses unknown_descriptions")
+# Listings to read at once; shapes[i](record) is what is kept of each record of urls[i]
+Batch = namedtuple("Batch", "urls shapes on_result")
+
+
+def plan_sync(user, canvas_url, courses, progress=None, mode="courses"):
+    """
+    The Canvas side of a sync, independent of how requests are sent.
+
+    A generator that yields Batches and is sent back each batch's shaped
+    records in url order, None for a listing that could not be read, with
+    on_result(index, records) called as each one completes. It returns the
+    Snapshot for write_snapshot. sync_canvas drives it with threads and
+    async_sync_canvas on an event loop.
+    """
+    current_year = datetime.now().year
+    names = [c.get("name", "Unknown Course") for c in courses]
+    if progress is not None:
+        progress.progress_start(names)
+
+    planner = mode == "planner"
+    per_course = 1 if planner else 2
+    listings_left = [per_course] * len(courses)
+    course_failed = [False] * len(courses)
+
+    def listing_done(index, result):
+        course = index // per_course
+        if course >= len(courses):
+            return
+        listings_left[course] -= 1
+        course_failed[course] = course_failed[course] or result is None
+        if listings_left[course] == 0:
+            progress.progress_update(names[course], "failed" if course_failed[course] else "fetched")
+
+    def assignments_url(c):
+        return f"{canvas_url}/api/v1/courses/{c['id']}/assignments?per_page=100"
+
+    def events_of(c):
+        return lambda a: assignment_event(a, c["id"], current_year)
+
+    def modules_of(c):
+        return lambda m: module_entry(m, c["id"])
+
+    # Every course's listings, and the planner stream in planner mode, go out as one concurrent batch
+    urls = []
+    shapes = []
+    for c in courses:
+        if not planner:
+            urls.append(assignments_url(c))
+            shapes.append(events_of(c))
+        # Canvas folds module items into the listing when it can; see module_entry
+        urls.append(f"{canvas_url}/api/v1/courses/{c['id']}/modules?include[]=items&per_page=100")
+        shapes.append(modules_of(c))
+    listing_count = len(urls)
+    if planner:
+        urls += planner_urls(canvas_url, current_year)
+        shapes += [planner_record, upcoming_description]
+    results = yield Batch(urls, shapes, listing_done if progress is not None else None)
+
+    unknown_descriptions = set()
+    if not planner:
+        event_lists = results[0::2]
+        module_lists = results[1::2]
+    else:
+        module_lists = results[:listing_count]
+        planner_records, upcoming = results[listing_count:]
+        if planner_records is not None:
+            by_course, unknown_descriptions = planner_assignments(planner_records, upcoming, [c["id"] for c in courses])
+            event_lists = [
+                [entry for entry in map(events_of(c), by_course[c["id"]]) if entry is not None] for c in courses
+            ]
+        else:
+            logger.warning("Planner unavailable for user %s, listing assignments per course", user.pk)
+
+            # The module listings already reported these courses fetched; a missing listing fails them now
+            def fallback_done(index, result):
+                if result is None and not course_failed[index]:
+                    course_failed[index] = True
+                    if progress is not None:
+                        progress.progress_update(names[index], "failed")
+
+            event_lists = yield Batch([assignments_url(c) for c in courses], [events_of(c) for c in courses], fallback_done)
+
+    course_values = {
+        c["id"]: (None, {"name": c.get("name", "Unknown Course"), "term": (c.get("term") or {}).get("name", "")})
+        for c in courses
+    }
+    events = {}
+    modules = {}
+    inline_items = []
+    module_jobs = []
+    courses_by_job = []
+    items_left = [0] * len(courses)
+    failed_courses = set()
+
+    for i, c in enumerate(courses):
+        cid = c["id"]
+        if event_lists[i] is None or module_lists[i] is None:
+            failed_courses.add(cid)
+        events.update(event_lists[i] or [])
+        for mid, values, items in module_lists[i] or []:
+            modules[mid] = values
+            if items is not None:
+                inline_items.append((mid, items))
+            else:
+                module_jobs.append((cid, mid))
+                courses_by_job.append(i)
+                items_left[i] += 1
+
+    def items_done(index, result):
+        course = courses_by_job[index]
+        items_left[course] -= 1
+        course_failed[course] = course_failed[course] or result is None
+        if items_left[course] == 0:
+            progress.progress_update(names[course], "failed" if course_failed[course] else "done")
+
+    if progress is not None:
+        for i, name in enumerate(names):
+            if items_left[i] == 0 and not course_failed[i]:
+                progress.progress_update(name, "done")
+
+    item_urls = [
+        f"{canvas_url}/api/v1/courses/{cid}/modules/{mid}/items?per_page=100"
+        for cid, mid in module_jobs
+    ]
+    item_results = yield Batch(item_urls, [item_entry] * len(item_urls), items_done if progress is not None else None)
+
+    item_lists = inline_items + [(mid, entries) for (cid, mid), entries in zip(module_jobs, item_results)]
+    return Snapshot(course_values, events, modules, item_lists, failed_courses, unknown_descriptions)
+
+
+def batch_reader(fetch, batch):
+    """fetch(url, headers, shape) as the fetch(url, headers) fetch_all calls for each of batch's urls."""
+    shapes = dict(zip(batch.urls, batch.shapes))
+    return lambda url, headers: fetch(url, headers, shapes[url])
+
+
+def write_snapshot(user, snapshot):
+    """Diffs a Snapshot into the user's rows in one transaction and returns the counts."""
+    events = snapshot.events
+    failed_courses = snapshot.failed_courses
+    counts = {name: Counter({action: 0 for action in SYNC_ACTIONS}) for name in ("events", "modules", "items")}
+
+    with calendar_changes() as changed_calendars, transaction.atomic():
+        reserve_writes()
+        stored_courses = _stored(Course.objects.filter(user=user))
+        stored_events = _stored(Event.objects.filter(user=user, custom=False, event_type="assignment"))
+        stored_modules = _stored(Module.objects.filter(user=user))
+        stored_items = _stored(ModuleItem.objects.filter(module__user=user).select_related("module"))
+
+        adopt_courses(stored_courses, snapshot.courses)
+        # Courses are not reported in the counts; ones gone from Canvas are dropped below once nothing uses them
+        course_counts = Counter()
+        course_rows, stale_courses = upsert(Course, user, stored_courses, snapshot.courses, lambda row: False, course_counts)
+        failed_course_pks = {course_rows[cid].pk for cid in failed_courses}
+        failed_modules = {row.canvas_id for row in stored_modules.values() if row.course_id in failed_course_pks}
+        if snapshot.unknown_descriptions:
+            # Keep what the last sync stored rather than blanking descriptions the planner left out
+            for canvas_id in snapshot.unknown_descriptions & events.keys():
+                row = stored_events.get(canvas_id)
+                if row is not None:
+                    events[canvas_id][1]["description"] = row.description or ""
+
+        _, stale_events = upsert(
+            Event, user, stored_events, with_courses(events, course_rows),
+            lambda row: row.canvas_id is not None and row.course_id in failed_course_pks,
+            counts["events"], derive=description_fields
+        )
+        module_rows, stale_modules = upsert(
+            Module, user, stored_modules, with_courses(snapshot.modules, course_rows),
+            lambda row: row.canvas_id is not None and row.course_id in failed_course_pks,
+            counts["modules"]
+        )
+
+        items = module_item_values(snapshot.item_lists, module_rows, failed_modules)
+        _, stale_items = upsert(
+            ModuleItem, user, stored_items, items,
+            lambda row: row.canvas_id is not None and row.module.canvas_id in failed_modules,
+            counts["items"]
+        )
+
+        for model, stale in ((ModuleItem, stale_items), (Module, stale_modules), (Event, stale_events)):
+            if stale:
+                model.objects.filter(pk__in=stale).delete()
+        if stale_courses:
+            # Custom events can still point at a course Canvas no longer lists
+            Course.objects.filter(pk__in=stale_courses, event__isnull=True).delete()
+        # bulk_create and bulk_update send no signals; a renamed course changes its events' feed entries
+        if counts["events"]["inserted"] or counts["events"]["updated"] or course_counts["updated"]:
+            changed_calendars.add(user.pk)
+    return counts
+
+
+def sync_canvas(user, canvas_url, api_token, progress=None, mode="courses"):
+    """
+    Pulls the user's active courses from Canvas and diffs them into Event,
+    Module and ModuleItem.
+
+    In "courses" mode assignments are listed course by course; in "planner"
+    mode they come from the cross-course planner stream, and the sync falls
+    back to per-course listings if Canvas will not serve it.
+
+    Returns {"events": counts, "modules": counts, "items": counts} where each
+    counts maps inserted/updated/deleted/unchanged to a row count, or None
+    when Canvas reports no active courses. progress, if given, is told the
+    course names up front (progress_start) and each course's state as it
+    moves through fetched/done/failed (progress_update).
+    """
+    courses = get_active_courses(canvas_url, api_token)
+    if not courses:
+        return None
+
+    headers = {"Authorization": f"Bearer {api_token}"}
+    plan = plan_sync(user, canvas_url, courses, progress, mode)
+    results = None
+    try:
+        while True:
+            batch = plan.send(results)
+            results = fetch_all(batch_reader(fetch_records, batch), batch.urls, headers, on_result=batch.on_result)
+    except StopIteration as done:
+        snapshot = done.value
+    counts = write_snapshot(user, snapshot)
+
+    logger.info(
+        "Canvas sync for user %s: %s; http cache %s; rate limit %s",
+        user.pk, summarize(counts), cache_stats(), rate_limit_stats(headers)
+    )
+    return counts
+
+
+async def async_sync_canvas(user, canvas_url, api_token, progress=None, mode="courses"):
+    """
+    sync_canvas for event loops: Canvas requests go through the httpx
+    client in async_canvas, so a sync holds no thread while it waits on
+    Canvas, and the diff is written in one sync_to_async call at the end.
+    The loop's client is closed once no other sync on the loop needs it.
+    progress is used as in sync_canvas and, being called on the event loop,
+    must not touch the database there; if it has an async flush() that is
+    awaited after each batch of requests.
+    """
+    headers = {"Authorization": f"Bearer {api_token}"}
+    flush = getattr(progress, "flush", None)
+    async with loop_client():
+        try:
+            courses = await afetch_records(courses_url(canvas_url), headers)
+        except Exception as e:
+            raise Exception(f"Error fetching courses: {e}")
+        if not courses:
+            return None
+
+        plan = plan_sync(user, canvas_url, courses, progress, mode)
+        results = None
+        try:
+            while True:
+                if flush is not None:
+                    await flush()
+                batch = plan.send(results)
+                results = await afetch_all(
+                    batch_reader(afetch_records, batch), batch.urls, headers, on_result=batch.on_result
+                )
+        except StopIteration as done:
+            snapshot = done.value
+    if flush is not None:
+        await flush()
+    counts = await sync_to_async(write_snapshot)(user, snapshot)
+
+    logger.info(
+        "Async Canvas sync for user %s: %s; rate limit %s", user.pk, summarize(counts), rate_limit_stats(headers)
+    )
+    return counts
+
+
+def summarize(counts):
+    totals = Counter()
+    for model_counts in counts.values():
+        totals.update(model_counts)
+    return ", ".join(f"{totals[action]} {action}" for action in SYNC_ACTIONS)
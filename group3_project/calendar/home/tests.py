@@ -1,20 +1,60 @@
 # tests.py
+import asyncio
+import io
 import json
+import os
+import re
+import tempfile
+import threading
+import time
+import httpx
 import requests
-from django.test import TestCase, Client
+from urllib.parse import unquote, urlsplit
+from django.test import TestCase, TransactionTestCase, Client
 from django.urls import reverse
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone as dt_timezone
 from django.utils.timezone import now
-from home.models import Event, Module, ModuleItem, UserProfile
-from home.views import get_active_courses, parse_date
+from home.models import Course, Event, Module, ModuleItem, SyncJob, UserProfile
+from home.jobs import (
+    _in_flight_job as in_flight_job, claim_lease, enqueue_sync, release_lease, requeue_stale, run_job, stale_profiles,
+    user_sync_lock,
+)
+from home.sync import async_sync_canvas, fetch_records, get_active_courses, parse_date, summarize, sync_canvas
+from home.calendar_cache import calendar_cache_stats, calendar_version
+from home.canvas import (
+    cache_stats, client_metrics, fetch_all, fetch_json, hedge_delay, host_slot, iter_canvas_pages, with_per_page
+)
+from home.async_canvas import _LoopState, acanvas_get, afetch_records, loop_client
+from home.circuit import CircuitOpen, breaker_for
+from home.http_cache import ResponseCache
+from home.tests_support.query_plans import QueryPlanAssertions, explain, plan_problems
+from home.recurrence import InvalidRule, last_occurrence, occurrences, parse_rule
+from home.rate_limit import backoff_delay, rate_limit_stats
+from home.sanitize import excerpt, render_description, sanitize_html
+from home.tests_support.fake_canvas import FakeCanvas
 from django.contrib.auth.models import User
 from django.utils import timezone
+from django.test import override_settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
 from unittest.mock import patch
+from asgiref.sync import async_to_sync
+
+
+def run_async(fn, *args):
+    """Awaits fn(*args) on a fresh loop, closing that loop's Canvas client afterwards as async_sync_canvas does."""
+    async def scoped():
+        async with loop_client():
+            return await fn(*args)
+    return async_to_sync(scoped)()
 
 
 # Test for properly displaying academic work on calendar
 class CalendarViewTests(TestCase):
     def setUp(self):
+        cache.clear()
         self.username = 'testuser'
         self.password = 'testpass'
         self.user = User.objects.create_user(username=self.username, password=self.password)
@@ -42,6 +82,7 @@ class CalendarViewTests(TestCase):
 
         response = self.client.get(reverse('calendar_view'))
         self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse('calendar_events'), {'start': '2025-03-01', 'end': '2025-04-01'})
         self.assertContains(response, event_1.title)
         self.assertContains(response, event_2.title)
         self.assertContains(response, "2025-03-15")
@@ -80,7 +121,6 @@ class CalendarViewTests(TestCase):
             description="Belongs to testuser",
             due_date=datetime(2025, 3, 21),
             event_type="assignment",
-            course_name="TestCourse"
         )
         Event.objects.create(
             user=self.other,
@@ -88,7 +128,6 @@ class CalendarViewTests(TestCase):
             description="Belongs to other",
             due_date=datetime(2025, 3, 22),
             event_type="assignment",
-            course_name="OtherCourse"
         )
 
         response = self.client.post(reverse('clear_calendar'))
@@ -172,14 +211,14 @@ class UtilsTests(TestCase):
     def test_parse_date_invalid_string(self):
         self.assertIsNone(parse_date("not-a-date"))
 
-    @patch('home.views.fetch_json')
+    @patch('home.sync.iter_canvas_pages')
     def test_get_active_courses_success(self, mock_fetch):
         mock_fetch.return_value = [{'id': 99}]
         result = get_active_courses("https://canvas.test", "tok")
         self.assertEqual(result, [{'id': 99}])
         mock_fetch.assert_called_once()
 
-    @patch('home.views.fetch_json')
+    @patch('home.sync.iter_canvas_pages')
     def test_get_active_courses_failure(self, mock_fetch):
         mock_fetch.side_effect = requests.RequestException("fail")
         with self.assertRaises(Exception) as cm:
@@ -187,6 +226,168 @@ class UtilsTests(TestCase):
         self.assertIn("fail", str(cm.exception))
 
 
+# Concurrent Canvas fetch engine tests
+class FetchAllTests(TestCase):
+    def test_results_keep_url_order(self):
+        def fake_fetch(url, headers):
+            return url.rsplit("/", 1)[-1]
+
+        urls = [f"https://canvas.test/{i}" for i in range(20)]
+        self.assertEqual(fetch_all(fake_fetch, urls, {}), [str(i) for i in range(20)])
+
+    def test_failed_fetch_returns_default(self):
+        def fake_fetch(url, headers):
+            if url.endswith("bad"):
+                raise requests.RequestException("boom")
+            return ["ok"]
+
+        results = fetch_all(fake_fetch, ["https://canvas.test/good", "https://canvas.test/bad"], {}, default=[])
+        self.assertEqual(results, [["ok"], []])
+
+    def test_empty_urls(self):
+        self.assertEqual(fetch_all(fetch_json, [], {}), [])
+
+    @override_settings(CANVAS_PER_HOST_LIMIT=3)
+    def test_per_host_cap_against_fake_canvas(self):
+        with FakeCanvas(courses=12, latency=0.05) as canvas:
+            urls = [f"{canvas.url}/api/v1/courses/{c['id']}/assignments" for c in canvas.courses]
+            results = fetch_all(fetch_json, urls, {})
+        self.assertEqual([r[0]["id"] // 1000 for r in results], list(range(1, 13)))
+        self.assertLessEqual(canvas.max_in_flight, 3)
+        self.assertGreater(canvas.max_in_flight, 1)
+
+
+# Link-header pagination tests
+class CanvasPaginationTests(TestCase):
+    def test_with_per_page(self):
+        self.assertEqual(with_per_page("https://c.test/items"), "https://c.test/items?per_page=100")
+        self.assertEqual(
+            with_per_page("https://c.test/x?include[]=items&per_page=50"),
+            "https://c.test/x?include[]=items&per_page=50"
+        )
+
+    def test_follows_next_links(self):
+        with FakeCanvas(courses=1, assignments=250) as canvas:
+            url = f"{canvas.url}/api/v1/courses/1/assignments"
+            records = list(iter_canvas_pages(url, {}))
+        self.assertEqual(len(records), 250)
+        self.assertEqual(len({r["id"] for r in records}), 250)
+        self.assertEqual(len(canvas.requests), 3)
+        self.assertTrue(all("per_page=100" in path for path in canvas.requests))
+
+    def test_next_page_requested_while_current_page_is_consumed(self):
+        with FakeCanvas(courses=1, assignments=150) as canvas:
+            pages = iter_canvas_pages(f"{canvas.url}/api/v1/courses/1/assignments", {})
+            next(pages)
+            for _ in range(100):
+                if len(canvas.requests) == 2:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(len(canvas.requests), 2)
+            self.assertEqual(len(list(pages)), 149)
+
+    def test_single_page_listing(self):
+        with FakeCanvas(courses=3) as canvas:
+            records = list(iter_canvas_pages(f"{canvas.url}/api/v1/courses", {}))
+        self.assertEqual([c["id"] for c in records], [1, 2, 3])
+        self.assertEqual(len(canvas.requests), 1)
+
+    def test_http_error_raises(self):
+        with FakeCanvas(courses=1) as canvas:
+            with self.assertRaises(requests.HTTPError):
+                list(iter_canvas_pages(f"{canvas.url}/api/v1/courses/99/assignments", {}))
+
+    def test_records_are_shaped_as_pages_arrive(self):
+        with FakeCanvas(courses=1, assignments=250) as canvas:
+            url = f"{canvas.url}/api/v1/courses/1/assignments"
+            requested = []
+
+            def shape(record):
+                requested.append(len(canvas.requests))
+                return record["id"] if record["id"] % 2 else None
+
+            kept = fetch_records(url, {}, shape)
+            self.assertEqual(run_async(afetch_records, url, {}, shape), kept)
+        self.assertEqual(len(kept), 125)
+        self.assertTrue(all(isinstance(record_id, int) for record_id in kept))
+        # The first page is reduced before the third is even requested
+        self.assertLessEqual(requested[0], 2)
+
+    @override_settings(SYNC_JOB_RUNNER="inline")
+    def test_fetch_assignments_reads_every_page(self):
+        user = User.objects.create_user(username='pager', password='pass')
+        self.client.login(username='pager', password='pass')
+        with FakeCanvas(courses=2, assignments=120, modules=3, items=130) as canvas:
+            response = self.client.post(reverse('fetch_assignments'), {
+                'canvas_url': canvas.url,
+                'api_token': 'tok',
+            })
+        self.assertRedirects(response, reverse('calendar_view'))
+        self.assertEqual(Event.objects.filter(user=user).count(), 240)
+        self.assertEqual(Module.objects.filter(user=user).count(), 6)
+        self.assertEqual(ModuleItem.objects.count(), 6 * 130)
+
+
+# Conditional Canvas response cache tests
+class CanvasResponseCacheTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "cache.sqlite3")
+        self.canvas = FakeCanvas(courses=1, assignments=150).start()
+        self.addCleanup(self.canvas.stop)
+        self.url = f"{self.canvas.url}/api/v1/courses/1/assignments"
+
+    def test_revalidates_and_replays_every_page(self):
+        with self.settings(CANVAS_HTTP_CACHE_PATH=self.path):
+            first = list(iter_canvas_pages(self.url, {"Authorization": "Bearer a"}))
+            second = list(iter_canvas_pages(self.url, {"Authorization": "Bearer a"}))
+            stats = cache_stats()
+        self.assertEqual(first, second)
+        self.assertEqual(len(second), 150)
+        self.assertEqual(self.canvas.not_modified, 2)
+        self.assertEqual((stats["hits"], stats["misses"]), (2, 2))
+        self.assertGreater(stats["bytes_saved"], 0)
+
+    def test_entries_are_per_token(self):
+        with self.settings(CANVAS_HTTP_CACHE_PATH=self.path):
+            fetch_json(self.url, {"Authorization": "Bearer a"})
+            fetch_json(self.url, {"Authorization": "Bearer b"})
+        self.assertEqual(self.canvas.not_modified, 0)
+
+    def test_ttl_skips_the_request(self):
+        with self.settings(CANVAS_HTTP_CACHE_PATH=self.path, CANVAS_HTTP_CACHE_TTL=60):
+            first = fetch_json(self.url, {})
+            self.assertEqual(fetch_json(self.url, {}), first)
+        self.assertEqual(len(self.canvas.requests), 1)
+
+    def test_lru_eviction_keeps_size_bounded(self):
+        body = b"x" * 100
+
+        def response(etag):
+            resp = requests.Response()
+            resp.status_code = 200
+            resp.headers["ETag"] = etag
+            resp._content = body
+            return resp
+
+        cache = ResponseCache(self.path, max_bytes=250)
+        cache.store("https://c.test/1", {}, response('"1"'))
+        cache.store("https://c.test/2", {}, response('"2"'))
+        cache.touch(cache.lookup("https://c.test/1", {}))
+        cache.store("https://c.test/3", {}, response('"3"'))
+        self.assertIsNotNone(cache.lookup("https://c.test/1", {}))
+        self.assertIsNone(cache.lookup("https://c.test/2", {}))
+        self.assertIsNotNone(cache.lookup("https://c.test/3", {}))
+
+    def test_disabled_cache(self):
+        with self.settings(CANVAS_HTTP_CACHE_PATH=None):
+            fetch_json(self.url, {})
+            fetch_json(self.url, {})
+            self.assertEqual(cache_stats()["hits"], 0)
+        self.assertEqual(self.canvas.not_modified, 0)
+
+
 # Carson's View functions tests
 class ViewFunctionTests(TestCase):
     def setUp(self):
@@ -195,42 +396,45 @@ class ViewFunctionTests(TestCase):
         self.client.login(username='viewuser', password='pass')
 
     def test_courses_list(self):
-        Module.objects.create(
-            user=self.user,
-            course_name="CourseX",
-            title="M1",
-            description="D1")
-        Module.objects.create(
-            user=self.user,
-            course_name="CourseY",
-            title="M2",
-            description="D2")
+        Course.objects.create(user=self.user, name="CourseY", term="Spring")
+        Course.objects.create(user=self.user, name="CourseX")
+        Course.objects.create(user=User.objects.create_user(username='classmate'), name="CourseZ")
         response = self.client.get(reverse('courses_list'))
         self.assertEqual(response.status_code, 200)
-        self.assertIn("CourseX", response.context['courses'])
-        self.assertIn("CourseY", response.context['courses'])
+        self.assertEqual([course.name for course in response.context['courses']], ["CourseX", "CourseY"])
+        self.assertContains(response, reverse('course_detail', args=[Course.objects.get(name="CourseX").pk]))
 
     def test_course_detail(self):
+        course = Course.objects.create(user=self.user, name="C1")
         Event.objects.create(
             user=self.user,
             title="A1", description="D1",
             due_date=datetime(2025, 6, 1),
             event_type="assignment",
-            course_name="C1")
-        Module.objects.create(user=self.user, course_name="C1", title="Mod1", description="Desc")
-        response = self.client.get(reverse('course_detail', args=["C1"]))
+            course=course)
+        Module.objects.create(user=self.user, course=course, title="Mod1", description="Desc")
+        response = self.client.get(reverse('course_detail', args=[course.pk]))
         self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['course_name'], "C1")
         self.assertEqual(len(response.context['assignments']), 1)
         self.assertEqual(len(response.context['modules']), 1)
 
+    def test_module_str(self):
+        course = Course.objects.create(user=self.user, name="C1")
+        self.assertEqual(str(Module.objects.create(user=self.user, course=course, title="Mod1")), "C1 - Mod1")
+        self.assertEqual(str(Module.objects.create(user=self.user, title="Loose")), "Loose")
+
+    def test_course_detail_is_per_user(self):
+        course = Course.objects.create(user=User.objects.create_user(username='classmate'), name="C1")
+        self.assertEqual(self.client.get(reverse('course_detail', args=[course.pk])).status_code, 404)
+
     def test_assignment_detail(self):
         ev = Event.objects.create(
             user=self.user,
             title="A2",
             description="Desc2",
             due_date=datetime(2025, 7, 1),
-            event_type="test",
-            course_name="C2")
+            event_type="test")
         response = self.client.get(reverse('assignment_detail', args=[ev.id]))
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, "A2")
@@ -242,10 +446,11 @@ class ViewFunctionTests(TestCase):
             title="X",
             description="D",
             due_date=datetime(2025, 8, 1),
-            event_type="assignment",
-            course_name="C3")
-        Module.objects.create(user=self.user, course_name="C3", title="Mod3", description="Desc3")
+            event_type="assignment")
+        course = Course.objects.create(user=self.user, name="C3", canvas_id=3)
+        Module.objects.create(user=self.user, course=course, title="Mod3", description="Desc3")
         ModuleItem.objects.create(module=Module.objects.first(), title="Item3", item_type="T")
+        Course.objects.create(user=User.objects.create_user(username='classmate'), name="C3", canvas_id=3)
         response = self.client.post(reverse('clear_calendar'))
         response = self.client.post(reverse('wipe_saved'))
         self.assertRedirects(response, reverse('calendar_view'))
@@ -255,9 +460,12 @@ class ViewFunctionTests(TestCase):
             ModuleItem.objects.filter(module__user=self.user).count(),
             0
         )
+        self.assertFalse(Course.objects.filter(user=self.user).exists())
+        self.assertEqual(Course.objects.count(), 1)
 
 
 # fetch_assignments testing
+@override_settings(SYNC_JOB_RUNNER="inline")
 class FetchAssignmentsViewTests(TestCase):
     def setUp(self):
         self.client = Client()
@@ -269,12 +477,13 @@ class FetchAssignmentsViewTests(TestCase):
         self.client.login(username='user', password='pass')
         self.canvas_url = 'https://canvas.example.com'
         self.api_token = 'token123'
+        self.year = datetime.now().year
 
     def test_non_post_redirects(self):
         response = self.client.get(reverse('fetch_assignments'))
         self.assertRedirects(response, reverse('index'))
 
-    @patch('home.views.get_active_courses', return_value=[])
+    @patch('home.sync.get_active_courses', return_value=[])
     def test_no_courses_redirects(self, mock_courses):
         response = self.client.post(
             reverse('fetch_assignments'),
@@ -283,18 +492,18 @@ class FetchAssignmentsViewTests(TestCase):
         self.assertRedirects(response, reverse('index'))
         mock_courses.assert_called_once_with(self.canvas_url, self.api_token)
 
-    @patch('home.views.fetch_json')
-    @patch('home.views.get_active_courses')
+    @patch('home.sync.iter_canvas_pages')
+    @patch('home.sync.get_active_courses')
     def test_success_creates_events_modules_and_items(self, mock_courses, mock_fetch):
         mock_courses.return_value = [{'id': 1, 'name': 'Course1'}]
 
         def side_effect(url, headers):
             if 'assignments?' in url:
-                return [{'name': 'Assign', 'due_at': '2025-05-01T00:00:00Z', 'description': 'D'}]
+                return [{'id': 100, 'name': 'Assign', 'due_at': f'{self.year}-05-01T00:00:00Z', 'description': 'D'}]
             if 'modules?' in url:
                 return [{'id': 10, 'name': 'ModA', 'description': 'MD'}]
             if '/items' in url:
-                return [{'title': 'It1', 'type': 'Page', 'external_url': 'http://x', 'content': 'C1'}]
+                return [{'id': 1000, 'title': 'It1', 'type': 'Page', 'external_url': 'http://x', 'content': 'C1'}]
             return []
 
         mock_fetch.side_effect = side_effect
@@ -309,10 +518,10 @@ class FetchAssignmentsViewTests(TestCase):
         self.assertEqual(Module.objects.count(), 1)
         self.assertEqual(ModuleItem.objects.count(), 1)
 
-    @patch('home.views.fetch_json', side_effect=Exception("fail"))
-    @patch('home.views.get_active_courses')
+    @patch('home.sync.iter_canvas_pages', side_effect=Exception("fail"))
+    @patch('home.sync.get_active_courses')
     def test_fetch_json_errors(self, mock_courses, mock_fetch):
-        # fetch_json always throws — assignments/modules both empty, module_jobs empty
+        # iter_canvas_pages always throws — assignments/modules both empty, module_jobs empty
         mock_courses.return_value = [{'id': 2, 'name': 'Course2'}]
 
         response = self.client.post(
@@ -324,15 +533,15 @@ class FetchAssignmentsViewTests(TestCase):
         self.assertEqual(Module.objects.count(), 0)
         self.assertEqual(ModuleItem.objects.count(), 0)
 
-    @patch('home.views.fetch_json')
-    @patch('home.views.get_active_courses')
+    @patch('home.sync.iter_canvas_pages')
+    @patch('home.sync.get_active_courses')
     def test_old_assignments_filtered(self, mock_courses, mock_fetch):
         mock_courses.return_value = [{'id': 3, 'name': 'Course3'}]
 
         def side_effect(url, headers):
             if 'assignments?' in url:
                 # outside current year → should be ignored
-                return [{'name': 'Old', 'due_at': '2024-01-01T00:00:00Z', 'description': 'D'}]
+                return [{'id': 101, 'name': 'Old', 'due_at': f'{self.year - 1}-01-01T00:00:00Z', 'description': 'D'}]
             if 'modules?' in url:
                 return []
             return []
@@ -348,14 +557,14 @@ class FetchAssignmentsViewTests(TestCase):
         self.assertEqual(Module.objects.count(), 0)
         self.assertEqual(ModuleItem.objects.count(), 0)
 
-    @patch('home.views.fetch_json')
-    @patch('home.views.get_active_courses')
+    @patch('home.sync.iter_canvas_pages')
+    @patch('home.sync.get_active_courses')
     def test_no_modules_creates_only_events(self, mock_courses, mock_fetch):
         mock_courses.return_value = [{'id': 4, 'name': 'Course4'}]
 
         def side_effect(url, headers):
             if 'assignments?' in url:
-                return [{'name': 'AssignX', 'due_at': '2025-04-01T00:00:00Z', 'description': 'DX'}]
+                return [{'id': 102, 'name': 'AssignX', 'due_at': f'{self.year}-04-01T00:00:00Z', 'description': 'DX'}]
             if 'modules?' in url:
                 return []
             return []
@@ -372,17 +581,1264 @@ class FetchAssignmentsViewTests(TestCase):
         self.assertEqual(ModuleItem.objects.count(), 0)
 
 
+# Canvas rate limiting tests; each test uses its own token so limiters start fresh
+@override_settings(CANVAS_HTTP_CACHE_PATH=None, CANVAS_RATE_LIMIT_BACKOFF=0.01)
+class CanvasRateLimitTests(TestCase):
+    def fetch_many(self, canvas, token, n=40):
+        urls = [f"{canvas.url}/api/v1/courses/1/assignments?page={i}" for i in range(n)]
+        return fetch_all(fetch_json, urls, {"Authorization": f"Bearer {token}"})
+
+    @override_settings(CANVAS_RATE_LIMIT_RESERVE=1.0, CANVAS_RATE_LIMIT_REFILL=80.0)
+    def test_requests_are_paced_under_the_budget(self):
+        with FakeCanvas(courses=1, rate_limit=10, refill=100.0) as canvas:
+            results = self.fetch_many(canvas, 'paced')
+        self.assertNotIn(None, results)
+        self.assertEqual(canvas.throttled, 0)
+        self.assertEqual(rate_limit_stats({"Authorization": "Bearer paced"})["throttled"], 0)
+
+    @override_settings(CANVAS_RATE_LIMIT_RESERVE=0.0, CANVAS_RATE_LIMIT_REFILL=1000.0)
+    def test_throttled_requests_wait_for_retry_after(self):
+        with FakeCanvas(courses=1, rate_limit=2, refill=10.0, retry_after=0.3) as canvas:
+            start = time.monotonic()
+            results = self.fetch_many(canvas, 'overshoot', n=6)
+            elapsed = time.monotonic() - start
+        self.assertNotIn(None, results)
+        self.assertGreater(canvas.throttled, 0)
+        self.assertGreaterEqual(elapsed, 0.3)
+
+    @override_settings(CANVAS_RATE_LIMIT_RETRIES=2)
+    def test_gives_up_after_retries(self):
+        with FakeCanvas(courses=1, rate_limit=0) as canvas:
+            with self.assertRaises(requests.HTTPError):
+                fetch_json(f"{canvas.url}/api/v1/courses", {"Authorization": "Bearer exhausted"})
+        self.assertEqual(canvas.throttled, 3)
+
+    def test_backoff_is_jittered_and_capped(self):
+        for attempt in range(8):
+            delay = backoff_delay(attempt, base=0.5, cap=4.0)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(4.0, 0.5 * 2 ** attempt))
+
+
+# Timeouts, hedging and circuit breaker tests against a stalling fake Canvas
+@override_settings(CANVAS_HTTP_CACHE_PATH=None, CANVAS_HEDGE_MIN_DELAY=0.05, CANVAS_BREAKER_COOLDOWN=0.3)
+class CanvasResilienceTests(TestCase):
+    headers = {"Authorization": "Bearer resilience"}
+
+    def setUp(self):
+        self.canvas = FakeCanvas(courses=2).start()
+        self.addCleanup(self.canvas.stop)
+        self.url = f"{self.canvas.url}/api/v1/courses"
+
+    def warm_up(self, n=20):
+        for _ in range(n):
+            fetch_json(self.url, self.headers)
+
+    @override_settings(CANVAS_READ_TIMEOUT=0.2, CANVAS_HEDGE=False)
+    def test_stalled_read_times_out(self):
+        self.canvas.stall(1, 2.0)
+        start = time.monotonic()
+        with self.assertRaises(requests.Timeout):
+            fetch_json(self.url, self.headers)
+        self.assertLess(time.monotonic() - start, 1.0)
+
+    def test_slow_request_is_hedged(self):
+        self.warm_up()
+        self.assertIsNotNone(hedge_delay(urlsplit(self.canvas.url).netloc))
+        before = client_metrics()
+        self.canvas.stall(1, 1.5)
+        start = time.monotonic()
+        self.assertEqual(len(fetch_json(self.url, self.headers)), 2)
+        self.assertLess(time.monotonic() - start, 1.0)
+        after = client_metrics()
+        self.assertEqual(after["hedged"] - before["hedged"], 1)
+        self.assertEqual(after["hedge_wins"] - before["hedge_wins"], 1)
+
+    def test_request_queued_for_a_host_slot_is_not_hedged(self):
+        self.warm_up()
+        slot = host_slot(self.url)
+        for _ in range(8):
+            slot.acquire()
+
+        def free_slots():
+            for _ in range(8):
+                slot.release()
+
+        threading.Timer(0.6, free_slots).start()
+        before = client_metrics()
+        self.assertEqual(len(fetch_json(self.url, self.headers)), 2)
+        self.assertEqual(client_metrics()["hedged"] - before["hedged"], 0)
+
+    def test_no_hedging_before_enough_samples(self):
+        self.warm_up(5)
+        self.assertIsNone(hedge_delay(urlsplit(self.canvas.url).netloc))
+
+    @override_settings(CANVAS_READ_TIMEOUT=0.1, CANVAS_HEDGE=False, CANVAS_BREAKER_THRESHOLD=3)
+    def test_breaker_opens_fails_fast_and_recovers(self):
+        self.canvas.stall(3, 1.0)
+        for _ in range(3):
+            with self.assertRaises(requests.Timeout):
+                fetch_json(self.url, self.headers)
+        host = urlsplit(self.canvas.url).netloc
+        self.assertEqual(client_metrics()["breakers"][host]["state"], "open")
+
+        self.canvas.reset_log()
+        with self.assertRaises(CircuitOpen):
+            fetch_json(self.url, self.headers)
+        self.assertEqual(self.canvas.requests, [])
+
+        time.sleep(0.35)
+        self.assertEqual(len(fetch_json(self.url, self.headers)), 2)
+        self.assertEqual(client_metrics()["breakers"][host]["state"], "closed")
+
+    @override_settings(CANVAS_HEDGE=False, CANVAS_BREAKER_THRESHOLD=1)
+    def test_trial_that_raises_does_not_wedge_the_breaker(self):
+        host = urlsplit(self.canvas.url).netloc
+        breaker = breaker_for(host)
+
+        def cool_down():
+            breaker.opened_at -= breaker.cooldown
+
+        breaker.record_failure()
+        cool_down()
+        with patch("home.canvas._hedged_send", side_effect=requests.TooManyRedirects("loop")):
+            with self.assertRaises(requests.TooManyRedirects):
+                fetch_json(self.url, self.headers)
+        self.assertEqual(client_metrics()["breakers"][host]["state"], "open")
+
+        cool_down()
+        with patch("home.async_canvas._asend", side_effect=httpx.DecodingError("bad gzip")):
+            with self.assertRaises(httpx.DecodingError):
+                run_async(acanvas_get, self.url, self.headers)
+        self.assertEqual(client_metrics()["breakers"][host]["state"], "open")
+
+        cool_down()
+        self.assertEqual(len(fetch_json(self.url, self.headers)), 2)
+        self.assertEqual(client_metrics()["breakers"][host]["state"], "closed")
+
+    def test_metrics_endpoint_is_staff_only(self):
+        user = User.objects.create_user(username='ops', password='pass')
+        self.client.login(username='ops', password='pass')
+        self.assertEqual(self.client.get(reverse('canvas_metrics')).status_code, 403)
+        user.is_staff = True
+        user.save()
+        data = self.client.get(reverse('canvas_metrics')).json()
+        self.assertIn("breakers", data)
+        self.assertIn("hit_ratio", data["http_cache"])
+
+
+# Incremental Canvas sync tests
+class IncrementalSyncTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='syncer', password='pass')
+        self.canvas = FakeCanvas(courses=2, assignments=5, modules=2, items=3).start()
+        self.addCleanup(self.canvas.stop)
+
+    def sync(self):
+        return sync_canvas(self.user, self.canvas.url, 'tok')
+
+    def test_first_sync_inserts_everything(self):
+        counts = self.sync()
+        self.assertEqual(counts["events"]["inserted"], 10)
+        self.assertEqual(counts["modules"]["inserted"], 4)
+        self.assertEqual(counts["items"]["inserted"], 12)
+        self.assertEqual(Event.objects.filter(user=self.user).exclude(canvas_id=None).count(), 10)
+        self.assertEqual(ModuleItem.objects.filter(user=self.user).count(), 12)
+
+    def test_unchanged_resync_writes_nothing(self):
+        self.sync()
+        with CaptureQueriesContext(connection) as ctx:
+            counts = self.sync()
+        writes = [q["sql"] for q in ctx.captured_queries if q["sql"].split()[0] in ("INSERT", "UPDATE", "DELETE")]
+        # Only SQLite's write-lock reservation, which touches no rows
+        self.assertEqual([sql for sql in writes if not sql.endswith("WHERE 0")], [])
+        self.assertEqual(summarize(counts), "0 inserted, 0 updated, 0 deleted, 26 unchanged")
+
+    def test_changed_and_removed_rows(self):
+        self.sync()
+        first = Event.objects.get(user=self.user, canvas_id=1001)
+        self.canvas.assignments[1][0]["name"] = "Renamed"
+        self.canvas.assignments[1][0]["updated_at"] = f"{self.canvas.year}-02-01T00:00:00Z"
+        del self.canvas.assignments[2][0]
+        self.canvas.items[1001].pop()
+
+        counts = self.sync()
+        self.assertEqual(counts["events"]["updated"], 1)
+        self.assertEqual(counts["events"]["deleted"], 1)
+        self.assertEqual(counts["events"]["unchanged"], 8)
+        self.assertEqual(counts["items"]["deleted"], 1)
+        renamed = Event.objects.get(user=self.user, canvas_id=1001)
+        self.assertEqual(renamed.pk, first.pk)
+        self.assertEqual(renamed.title, "Renamed")
+        self.assertFalse(Event.objects.filter(user=self.user, canvas_id=2001).exists())
+
+    def test_legacy_duplicates_are_replaced_and_custom_events_kept(self):
+        Module.objects.create(user=self.user, title="Module 1.1")
+        Module.objects.create(user=self.user, title="Module 1.1")
+        Event.objects.create(user=self.user, title="Mine", due_date=timezone.now(), event_type="test", custom=True)
+        counts = self.sync()
+        self.assertEqual(counts["modules"]["deleted"], 2)
+        self.assertEqual(Module.objects.filter(user=self.user).count(), 4)
+        self.assertTrue(Event.objects.filter(user=self.user, custom=True).exists())
+
+    def test_failed_course_keeps_its_rows(self):
+        self.sync()
+        del self.canvas.assignments[2]
+        counts = self.sync()
+        self.assertEqual(counts["events"]["deleted"], 0)
+        self.assertEqual(Event.objects.filter(user=self.user, course__name="Course 2").count(), 5)
+
+    def test_courses_are_stored_and_linked(self):
+        self.sync()
+        course = Course.objects.get(user=self.user, canvas_id=2)
+        self.assertEqual((course.name, course.term), ("Course 2", f"Spring {self.canvas.year}"))
+        self.assertEqual(Event.objects.filter(course=course).count(), 5)
+        self.assertEqual(Module.objects.filter(course=course).count(), 2)
+
+    def test_courses_carried_over_from_names_are_adopted(self):
+        legacy = Course.objects.create(user=self.user, name="Course 1")
+        mine = Event.objects.create(user=self.user, title="Mine", due_date=timezone.now(), event_type="test",
+                                    custom=True, course=legacy)
+        self.sync()
+        legacy.refresh_from_db()
+        self.assertEqual(legacy.canvas_id, 1)
+        self.assertEqual(Course.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(Event.objects.filter(course=legacy).count(), 6)
+        mine.refresh_from_db()
+        self.assertEqual(mine.course, legacy)
+
+    def test_renamed_course_changes_the_calendar(self):
+        self.sync()
+        version = calendar_version(self.user.pk)
+        self.canvas.courses[0]["name"] = "Course One"
+        counts = self.sync()
+        self.assertEqual(summarize(counts), "0 inserted, 0 updated, 0 deleted, 26 unchanged")
+        self.assertEqual(Event.objects.filter(user=self.user, course__name="Course One").count(), 5)
+        self.assertEqual(calendar_version(self.user.pk), version + 1)
+
+    def test_dropped_course_is_kept_only_for_custom_events(self):
+        self.sync()
+        kept = Course.objects.get(user=self.user, canvas_id=1)
+        Event.objects.create(user=self.user, title="Mine", due_date=timezone.now(), event_type="test",
+                             custom=True, course=kept)
+        self.canvas.courses = [{"id": 3, "name": "Course 3"}]
+        self.canvas.assignments[3], self.canvas.modules[3] = [], []
+        self.sync()
+        self.assertEqual(
+            list(Course.objects.filter(user=self.user).order_by("name").values_list("name", flat=True)),
+            ["Course 1", "Course 3"],
+        )
+        self.assertEqual(Event.objects.get(user=self.user, custom=True).course, kept)
+
+    def test_rows_are_per_user(self):
+        other = User.objects.create_user(username='other-syncer', password='pass')
+        self.sync()
+        sync_canvas(other, self.canvas.url, 'tok')
+        self.assertEqual(Event.objects.filter(canvas_id=1001).count(), 2)
+
+    def item_listing_calls(self):
+        return [path for path in self.canvas.requests if "/items" in path]
+
+    def test_module_items_come_inline_with_modules(self):
+        self.sync()
+        self.assertEqual(self.item_listing_calls(), [])
+        self.assertEqual(ModuleItem.objects.filter(module__canvas_id=1001).count(), 3)
+
+    def test_modules_without_inline_items_fall_back_to_items_endpoint(self):
+        self.canvas.inline_items = 0
+        counts = self.sync()
+        self.assertEqual(len(self.item_listing_calls()), 4)
+        self.assertEqual(counts["items"]["inserted"], 12)
+
+    def test_query_count_does_not_grow_with_modules(self):
+        def first_sync_queries(modules):
+            user = User.objects.create_user(username=f'modules-{modules}', password='pass')
+            with FakeCanvas(courses=2, assignments=3, modules=modules, items=2) as canvas:
+                with CaptureQueriesContext(connection) as ctx:
+                    sync_canvas(user, canvas.url, 'tok')
+            return len(ctx.captured_queries)
+
+        small = first_sync_queries(2)
+        # 25 modules per course still fits every bulk write in one SQLite batch
+        self.assertEqual(small, first_sync_queries(25))
+        fresh = User.objects.create_user(username='modules-again', password='pass')
+        with self.assertNumQueries(small):
+            sync_canvas(fresh, self.canvas.url, 'tok')
+
+
+# Planner sync mode tests
+class PlannerSyncTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='planner', password='pass')
+        self.canvas = FakeCanvas(courses=3, assignments=6, modules=2, items=2).start()
+        self.addCleanup(self.canvas.stop)
+
+    def sync(self, mode):
+        return sync_canvas(self.user, self.canvas.url, 'tok', mode=mode)
+
+    def assignment_listing_calls(self):
+        return [path for path in self.canvas.requests if "/assignments" in path]
+
+    def test_planner_mode_skips_per_course_assignment_listings(self):
+        counts = self.sync("planner")
+        self.assertEqual(self.assignment_listing_calls(), [])
+        self.assertTrue(any(path.startswith("/api/v1/planner/items?") for path in self.canvas.requests))
+        self.assertEqual(counts["events"]["inserted"], 18)
+        self.assertEqual(counts["modules"]["inserted"], 6)
+        event = Event.objects.get(user=self.user, canvas_id=2003)
+        self.assertEqual((event.title, event.course.name), ("Assignment 2.3", "Course 2"))
+
+    def test_switching_modes_rewrites_nothing(self):
+        self.sync("courses")
+        counts = self.sync("planner")
+        self.assertEqual(summarize(counts), "0 inserted, 0 updated, 0 deleted, 36 unchanged")
+        self.assertEqual(
+            Event.objects.get(user=self.user, canvas_id=1001).description, "<p>Work for assignment 1.1</p>"
+        )
+
+    def test_falls_back_to_courses_without_planner(self):
+        self.canvas.planner = False
+        del self.canvas.assignments[2]
+        job = SyncJob.objects.create(user=self.user, canvas_url=self.canvas.url)
+        counts = sync_canvas(self.user, self.canvas.url, 'tok', progress=job, mode="planner")
+        self.assertEqual(len(self.assignment_listing_calls()), 3)
+        self.assertEqual(counts["events"]["inserted"], 12)
+        # Every course ends in a final state, the one whose fallback listing failed included
+        job.refresh_from_db()
+        self.assertEqual(job.progress, {"Course 1": "done", "Course 2": "failed", "Course 3": "done"})
+
+    def test_job_uses_profile_sync_mode(self):
+        self.user.userprofile.canvas_token = 'tok'
+        self.user.userprofile.sync_mode = 'planner'
+        self.user.userprofile.save()
+        with override_settings(SYNC_JOB_RUNNER="inline"):
+            job = enqueue_sync(self.user, self.canvas.url)
+        self.assertEqual(job.status, "done")
+        self.assertEqual(self.assignment_listing_calls(), [])
+
+    def test_settings_updates_sync_mode(self):
+        self.client.login(username='planner', password='pass')
+        response = self.client.post(reverse('user_settings'), {'sync_mode': 'planner'})
+        self.assertRedirects(response, reverse('user_settings'))
+        self.user.userprofile.refresh_from_db()
+        self.assertEqual(self.user.userprofile.sync_mode, 'planner')
+        self.client.post(reverse('user_settings'), {'sync_mode': 'bogus'})
+        self.user.userprofile.refresh_from_db()
+        self.assertEqual(self.user.userprofile.sync_mode, 'planner')
+
+
+# Windowed calendar feed tests
+class CalendarFeedTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='viewer', password='pass')
+        self.client.login(username='viewer', password='pass')
+        other = User.objects.create_user(username='other')
+        for user in (self.user, other):
+            course = Course.objects.create(user=user, name="C1")
+            Event.objects.bulk_create(
+                Event(user=user, title=f"Task {day}", description="<p>long</p>" * 50, description_excerpt="long",
+                      due_date=datetime(2025, 3, 1, 12, tzinfo=dt_timezone.utc) + timedelta(days=day),
+                      event_type="assignment", course=course)
+                for day in range(0, 90)
+            )
+
+    def feed(self, **params):
+        return self.client.get(reverse('calendar_events'), params)
+
+    def test_returns_only_the_window(self):
+        events = self.feed(start="2025-04-01T00:00:00+00:00", end="2025-04-08T00:00:00+00:00").json()
+        self.assertEqual([e["title"] for e in events], [f"Task {day}" for day in range(31, 38)])
+        self.assertEqual(
+            set(events[0]), {"id", "course_name", "title", "description_excerpt", "event_type", "due_date", "custom"}
+        )
+
+    def test_offsets_and_plain_dates(self):
+        self.assertEqual(len(self.feed(start="2025-03-01", end="2025-03-08").json()), 7)
+        # FullCalendar sends local midnights with the browser's offset
+        events = self.feed(start="2025-03-01T00:00:00-12:00", end="2025-03-02T00:00:00-12:00").json()
+        self.assertEqual([e["title"] for e in events], ["Task 0"])
+
+    def test_rejects_bad_ranges(self):
+        self.assertEqual(self.feed().status_code, 400)
+        self.assertEqual(self.feed(start="soon", end="2025-03-08").status_code, 400)
+        self.assertEqual(self.feed(start="2025-03-08", end="2025-03-01").status_code, 400)
+        self.assertEqual(self.feed(start="2025-02-30", end="2025-03-08").status_code, 400)
+        self.assertEqual(self.feed(start="2020-01-01", end="2025-01-01").status_code, 400)
+
+    def test_requires_login(self):
+        self.client.logout()
+        self.assertEqual(self.feed(start="2025-03-01", end="2025-03-08").status_code, 302)
+
+    def test_page_no_longer_embeds_events(self):
+        response = self.client.get(reverse('calendar_view'))
+        self.assertNotContains(response, "Task 1")
+        self.assertContains(response, reverse('calendar_events'))
+
+    def test_window_query_uses_user_due_date_index(self):
+        queryset = Event.objects.filter(
+            user=self.user, due_date__gte=datetime(2025, 4, 1, tzinfo=dt_timezone.utc),
+            due_date__lt=datetime(2025, 4, 8, tzinfo=dt_timezone.utc),
+        )
+        self.assertIn("event_user_due_date_idx", queryset.explain())
+
+
+# Versioned calendar cache tests
+class CalendarCacheTests(TestCase):
+    window = {'start': '2026-01-01', 'end': '2026-03-01'}
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='cached', password='pass')
+        self.client.login(username='cached', password='pass')
+
+    def version(self):
+        return calendar_version(self.user.pk)
+
+    def feed(self):
+        return self.client.get(reverse('calendar_events'), self.window).json()
+
+    def add_event(self, title="Quiz", day=10):
+        return Event.objects.create(user=self.user, title=title, due_date=datetime(2026, 1, day, tzinfo=dt_timezone.utc),
+                                    event_type="quiz", custom=True)
+
+    def test_unchanged_calendar_is_served_from_cache(self):
+        self.add_event()
+        self.assertEqual(len(self.feed()), 1)
+        before = calendar_cache_stats()
+        with self.assertNumQueries(3):  # session, user, version
+            self.assertEqual(len(self.feed()), 1)
+        after = calendar_cache_stats()
+        self.assertEqual((after["hits"] - before["hits"], after["misses"] - before["misses"]), (1, 0))
+
+    def test_save_and_delete_bump_the_version(self):
+        version = self.version()
+        event = self.add_event()
+        self.assertEqual(self.version(), version + 1)
+        self.assertEqual(len(self.feed()), 1)
+        event.title = "Renamed"
+        event.save()
+        self.assertEqual(self.feed()[0]["title"], "Renamed")
+        event.delete()
+        self.assertEqual(self.feed(), [])
+
+    def test_bulk_deletes_bump_once(self):
+        for day in range(1, 6):
+            self.add_event(day=day)
+        self.assertEqual(len(self.feed()), 5)
+        version = self.version()
+        response = self.client.post(reverse('wipe_saved'))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.version(), version + 1)
+        self.assertEqual(self.feed(), [])
+
+        self.add_event()
+        self.assertEqual(len(self.feed()), 1)
+        self.client.post(reverse('clear_calendar'))
+        self.assertEqual(self.feed(), [])
+
+    def test_other_users_changes_keep_the_cache(self):
+        self.add_event()
+        self.feed()
+        Event.objects.create(user=User.objects.create_user(username='someone'), title="Theirs",
+                             due_date=datetime(2026, 1, 3, tzinfo=dt_timezone.utc), event_type="quiz")
+        before = calendar_cache_stats()["hits"]
+        self.feed()
+        self.assertEqual(calendar_cache_stats()["hits"], before + 1)
+
+    @override_settings(CANVAS_HTTP_CACHE_PATH=None)
+    def test_sync_bulk_writes_invalidate(self):
+        year = datetime.now().year
+        self.window = {'start': f'{year}-01-01', 'end': f'{year + 1}-01-01'}
+        with FakeCanvas(courses=1, assignments=4, modules=1, items=1) as canvas:
+            sync_canvas(self.user, canvas.url, 'tok')
+            self.assertEqual(len(self.feed()), 4)
+            version = self.version()
+
+            sync_canvas(self.user, canvas.url, 'tok')
+            self.assertEqual(self.version(), version)
+
+            canvas.assignments[1] = canvas.assignments[1][:2]
+            canvas.assignments[1][0]["name"] = "Renamed"
+            canvas.assignments[1][0]["updated_at"] = "2099-01-01T00:00:00Z"
+            sync_canvas(self.user, canvas.url, 'tok')
+        self.assertEqual(self.version(), version + 1)
+        self.assertEqual(sorted(e["title"] for e in self.feed()), ["Assignment 1.2", "Renamed"])
+
+
+# Description sanitizing tests
+class ConditionalGetTests(TestCase):
+    window = {'start': '2026-01-01', 'end': '2026-03-01'}
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='revisit', password='pass')
+        self.client.login(username='revisit', password='pass')
+
+    def add_event(self):
+        return Event.objects.create(user=self.user, title="Quiz", due_date=datetime(2026, 1, 10, tzinfo=dt_timezone.utc),
+                                    event_type="quiz", custom=True)
+
+    def test_feed_answers_304_until_the_calendar_changes(self):
+        first = self.client.get(reverse('calendar_events'), self.window)
+        etag = first['ETag']
+        self.assertIn('no-cache', first['Cache-Control'])
+        self.assertIn('private', first['Cache-Control'])
+        with self.assertNumQueries(3):  # session, user, version
+            repeat = self.client.get(reverse('calendar_events'), self.window, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(repeat.status_code, 304)
+        self.assertEqual(repeat.content, b'')
+
+        self.add_event()
+        changed = self.client.get(reverse('calendar_events'), self.window, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(len(changed.json()), 1)
+        self.assertNotEqual(changed['ETag'], etag)
+
+    def test_feed_etag_depends_on_window_and_user(self):
+        etag = self.client.get(reverse('calendar_events'), self.window)['ETag']
+        other_window = self.client.get(reverse('calendar_events'), {'start': '2026-03-01', 'end': '2026-04-01'},
+                                       HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(other_window.status_code, 200)
+
+        User.objects.create_user(username='neighbour', password='pass')
+        self.client.login(username='neighbour', password='pass')
+        self.assertEqual(self.client.get(reverse('calendar_events'), self.window, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_bad_ranges_get_no_etag(self):
+        response = self.client.get(reverse('calendar_events'), {'start': 'soon', 'end': '2026-03-01'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_calendar_page_revalidates_without_rendering(self):
+        first = self.client.get(reverse('calendar_view'))
+        etag = first['ETag']
+        with patch('home.views.render') as render:
+            repeat = self.client.get(reverse('calendar_view'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(repeat.status_code, 304)
+        render.assert_not_called()
+        self.assertEqual(
+            self.client.get(reverse('calendar_view'), {'sync_job': 7}, HTTP_IF_NONE_MATCH=etag).status_code, 200
+        )
+
+    def test_calendar_page_tag_follows_the_csrf_cookie(self):
+        etag = self.client.get(reverse('calendar_view'))['ETag']
+        # Logging in again rotates the CSRF secret the cached page's form was built with
+        self.client.login(username='revisit', password='pass')
+        self.client.cookies.pop('csrftoken', None)
+        self.assertEqual(self.client.get(reverse('calendar_view'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_pending_messages_force_a_render(self):
+        etag = self.client.get(reverse('calendar_view'))['ETag']
+        self.client.get(reverse('clear_calendar'))  # queues "Invalid request."
+        self.assertEqual(self.client.get(reverse('calendar_view'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class CalendarSubscriptionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='subscriber', password='pass')
+        self.token = self.user.userprofile.reset_ics_token()
+        self.event = Event.objects.create(
+            user=self.user, title="Essay, draft; final", description="<p>Line one</p><p>Line two</p>",
+            due_date=datetime(2026, 2, 3, 23, 59, tzinfo=dt_timezone.utc), event_type="assignment",
+            course=Course.objects.create(user=self.user, name="ENGL 1010"),
+        )
+
+    def url(self, token=None):
+        return reverse('calendar_ics', args=[token or self.token])
+
+    def body(self, response):
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content)
+
+    def test_streams_the_users_events(self):
+        Event.objects.create(user=User.objects.create_user(username='stranger'), title="Not mine",
+                             due_date=datetime(2026, 2, 4, tzinfo=dt_timezone.utc), event_type="quiz")
+        response = self.client.get(self.url())
+        self.assertEqual(response['Content-Type'], 'text/calendar; charset=utf-8')
+        body = self.body(response).decode()
+        self.assertTrue(body.startswith("BEGIN:VCALENDAR\r\nVERSION:2.0\r\n"))
+        self.assertTrue(body.endswith("END:VCALENDAR\r\n"))
+        self.assertIn(f"UID:event-{self.event.pk}@calendai\r\n", body)
+        self.assertIn("DTSTART:20260203T235900Z\r\n", body)
+        self.assertIn("SUMMARY:ENGL 1010: Essay\\, draft\\; final\r\n", body)
+        self.assertIn("DESCRIPTION:Line one Line two\r\n", body)
+        self.assertNotIn("Not mine", body)
+
+    def test_long_lines_are_folded(self):
+        self.event.title = "é" * 100
+        self.event.save()
+        body = self.body(self.client.get(self.url()))
+        for line in body.split(b"\r\n"):
+            self.assertLessEqual(len(line), 75)
+            line.decode()  # no character split across a fold
+        self.assertIn("é" * 100, body.decode().replace("\r\n ", ""))
+
+    def test_unknown_token_is_404(self):
+        self.assertEqual(self.client.get(self.url("not-a-token")).status_code, 404)
+
+    def test_pollers_get_304_until_the_calendar_changes(self):
+        first = self.client.get(self.url())
+        self.body(first)
+        etag, last_modified = first['ETag'], first['Last-Modified']
+        self.assertFalse(etag.startswith('W/'))
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(self.url(), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(self.url(), HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+        self.event.title = "Essay, revised"
+        self.event.save()
+        changed = self.client.get(self.url(), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertIn(b"Essay\\, revised", self.body(changed))
+
+    def test_rendering_is_cached_per_version(self):
+        body = self.body(self.client.get(self.url()))
+        before = calendar_cache_stats()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.body(self.client.get(self.url())), body)
+        self.assertEqual(calendar_cache_stats()["hits"] - before["hits"], 1)
+
+    def test_abandoned_stream_is_not_cached(self):
+        Event.objects.bulk_create(
+            Event(user=self.user, title=f"Task {n}", due_date=datetime(2026, 3, 1, tzinfo=dt_timezone.utc),
+                  event_type="assignment")
+            for n in range(300)
+        )
+        response = self.client.get(self.url())
+        next(iter(response.streaming_content))
+        response.close()
+        before = calendar_cache_stats()
+        self.assertEqual(self.body(self.client.get(self.url())).count(b"BEGIN:VEVENT"), 301)
+        self.assertEqual(calendar_cache_stats()["misses"] - before["misses"], 1)
+
+    def test_settings_replaces_the_link(self):
+        self.client.login(username='subscriber', password='pass')
+        response = self.client.post(reverse('user_settings'), {'reset_ics_token': '1'}, follow=True)
+        new_token = UserProfile.objects.get(user=self.user).ics_token
+        self.assertNotEqual(new_token, self.token)
+        self.assertContains(response, self.url(new_token))
+        self.assertEqual(self.client.get(self.url()).status_code, 404)
+        self.assertEqual(self.client.get(self.url(new_token)).status_code, 200)
+
+
+# Recurring custom events
+class RecurrenceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='repeater', password='pass')
+        self.client.login(username='repeater', password='pass')
+        self.start = datetime(2026, 1, 5, 17, tzinfo=dt_timezone.utc)
+        self.series = Event.objects.create(
+            user=self.user, title="Lab", due_date=self.start, event_type="quiz", custom=True,
+            recurrence="FREQ=WEEKLY;INTERVAL=2",
+        )
+
+    def feed(self, start, end):
+        return self.client.get(reverse('calendar_events'), {'start': start, 'end': end}).json()
+
+    def test_rules_are_parsed_and_normalized(self):
+        rule = parse_rule("rrule:freq=daily;count=3")
+        self.assertEqual((rule.freq, rule.interval, rule.count, rule.until), ("DAILY", 1, 3, None))
+        for bad in ("FREQ=MONTHLY", "FREQ=DAILY;BYDAY=MO", "FREQ=DAILY;COUNT=2;UNTIL=20260101T000000Z",
+                    "FREQ=DAILY;INTERVAL=0", "FREQ=WEEKLY;UNTIL=tomorrow", "FREQ"):
+            with self.assertRaises(InvalidRule, msg=bad):
+                parse_rule(bad)
+        self.assertEqual(self.series.recurrence, "FREQ=WEEKLY;INTERVAL=2")
+        self.assertIsNone(self.series.recurrence_end)
+
+    def test_occurrences_start_inside_the_window(self):
+        rule = parse_rule("FREQ=DAILY;INTERVAL=3;UNTIL=20260120T170000Z")
+        window = occurrences(self.start, rule, datetime(2026, 1, 10, tzinfo=dt_timezone.utc),
+                             datetime(2026, 3, 1, tzinfo=dt_timezone.utc), ["20260114T170000Z"])
+        self.assertEqual([when.day for when in window], [11, 17, 20])
+        self.assertEqual(last_occurrence(self.start, rule), datetime(2026, 1, 20, 17, tzinfo=dt_timezone.utc))
+        self.assertEqual(last_occurrence(self.start, parse_rule("FREQ=WEEKLY;COUNT=3")).day, 19)
+        # A window years into an endless series still yields only its own occurrences
+        far = datetime(2036, 1, 1, tzinfo=dt_timezone.utc)
+        self.assertEqual(len(list(occurrences(self.start, parse_rule("FREQ=DAILY"), far, far + timedelta(days=7)))), 7)
+
+    def test_save_stores_the_last_occurrence(self):
+        self.series.recurrence = "FREQ=DAILY;COUNT=4"
+        self.series.save(update_fields=["recurrence"])
+        self.series.refresh_from_db()
+        self.assertEqual(self.series.recurrence, "FREQ=DAILY;INTERVAL=1;COUNT=4")
+        self.assertEqual(self.series.recurrence_end, self.start + timedelta(days=3))
+
+    def test_feed_expands_series_in_the_window(self):
+        Event.objects.create(user=self.user, title="Once", due_date=self.start + timedelta(days=1), event_type="test")
+        events = self.feed("2026-02-01", "2026-03-15")
+        self.assertEqual(
+            [(e["title"], e["due_date"], e["occurrence"]) for e in events],
+            [("Lab", "2026-02-02T17:00:00Z", "20260202T170000Z"), ("Lab", "2026-02-16T17:00:00Z", "20260216T170000Z"),
+             ("Lab", "2026-03-02T17:00:00Z", "20260302T170000Z")],
+        )
+        self.assertEqual([e["title"] for e in self.feed("2026-01-05", "2026-01-07")], ["Once", "Lab"])
+        self.assertEqual(self.feed("2025-12-01", "2026-01-05"), [])
+
+    def test_ended_series_are_not_read(self):
+        self.series.recurrence = "FREQ=WEEKLY;COUNT=2"
+        self.series.save()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.feed("2026-02-01", "2026-03-01"), [])
+        self.assertTrue(any("recurrence_end" in query["sql"] for query in queries.captured_queries))
+
+    def test_skip_an_occurrence(self):
+        url = reverse('skip_occurrence', args=[self.series.pk])
+        version = calendar_version(self.user.pk)
+        self.assertEqual(len(self.feed("2026-01-15", "2026-01-25")), 1)
+        response = self.client.post(url, {"occurrence": "20260119T170000Z"})
+        self.assertEqual(response.json()["recurrence_exceptions"], ["20260119T170000Z"])
+        self.assertGreater(calendar_version(self.user.pk), version)
+        self.assertEqual(self.feed("2026-01-15", "2026-01-25"), [])
+        self.assertEqual(len(self.feed("2026-01-25", "2026-02-05")), 1)
+
+    def test_skip_rejects_bad_requests(self):
+        url = reverse('skip_occurrence', args=[self.series.pk])
+        self.assertEqual(self.client.get(url).status_code, 405)
+        self.assertEqual(self.client.post(url, {"occurrence": "20260112T170000Z"}).status_code, 400)
+        self.assertEqual(self.client.post(url, {"occurrence": "soon"}).status_code, 400)
+        once = Event.objects.create(user=self.user, title="Once", due_date=self.start, event_type="test", custom=True)
+        self.assertEqual(
+            self.client.post(reverse('skip_occurrence', args=[once.pk]), {"occurrence": "20260105T170000Z"}).status_code, 400
+        )
+        self.client.logout()
+        User.objects.create_user(username='intruder', password='pass')
+        self.client.login(username='intruder', password='pass')
+        self.assertEqual(self.client.post(url, {"occurrence": "20260119T170000Z"}).status_code, 404)
+
+    def test_add_event_form_builds_the_rule(self):
+        response = self.client.post(reverse('add_event'), {
+            "title": "Standup", "description": "", "due_date": "2026-03-02T09:00", "event_type": "quiz",
+            "repeat": "DAILY", "repeat_interval": "2", "repeat_until": "2026-03-10",
+        })
+        self.assertEqual(response.status_code, 302)
+        event = Event.objects.get(title="Standup")
+        self.assertEqual(event.recurrence, "FREQ=DAILY;INTERVAL=2;UNTIL=20260310T235959Z")
+        self.assertEqual(event.recurrence_end, datetime(2026, 3, 10, 9, tzinfo=dt_timezone.utc))
+        self.client.post(reverse('add_event'), {
+            "title": "Both", "due_date": "2026-03-02T09:00", "event_type": "quiz",
+            "repeat": "WEEKLY", "repeat_until": "2026-03-10", "repeat_count": "3",
+        })
+        self.assertFalse(Event.objects.filter(title="Both").exists())
+
+    def test_ics_writes_the_rule_once(self):
+        self.series.recurrence_exceptions = ["20260119T170000Z", "20260202T170000Z"]
+        self.series.save()
+        token = self.user.userprofile.reset_ics_token()
+        body = b"".join(self.client.get(reverse('calendar_ics', args=[token])).streaming_content).decode()
+        self.assertEqual(body.count("BEGIN:VEVENT"), 1)
+        self.assertIn("RRULE:FREQ=WEEKLY;INTERVAL=2\r\n", body)
+        self.assertIn("EXDATE:20260119T170000Z,20260202T170000Z\r\n", body)
+
+
+class QueryPlanTests(QueryPlanAssertions, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='planner', password='pass')
+        UserProfile.objects.filter(user=self.user).update(canvas_token='token')
+        self.client.login(username='planner', password='pass')
+        other = User.objects.create_user(username='neighbour')
+        start = now() - timedelta(days=60)
+        for user in (self.user, other):
+            courses = Course.objects.bulk_create(Course(user=user, name=f"Course {n}") for n in range(3))
+            Event.objects.bulk_create(
+                Event(user=user, title=f"Task {n}", due_date=start + timedelta(days=n), course=courses[n % 3],
+                      event_type=("assignment", "quiz", "test")[n % 3], custom=n % 5 == 0)
+                for n in range(120)
+            )
+            Module.objects.bulk_create(
+                Module(user=user, course=courses[n % 3], title=f"Week {n}") for n in range(12)
+            )
+
+    def test_index_reads_upcoming_assignments_by_index(self):
+        with self.assertIndexedQueries() as plans:
+            self.client.get(reverse('index'))
+        self.assertUsesIndex(plans, 'home_event', 'event_user_type_due_idx')
+
+    def test_courses_list_reads_courses_by_index(self):
+        with self.assertIndexedQueries() as plans:
+            self.client.get(reverse('courses_list'))
+        self.assertUsesIndex(plans, 'home_course', 'course_user_name_idx')
+
+    def test_course_detail_is_indexed(self):
+        course = Course.objects.get(user=self.user, name='Course 1')
+        with self.assertIndexedQueries() as plans:
+            response = self.client.get(reverse('course_detail', args=[course.pk]))
+            list(response.context['modules'])
+        self.assertUsesIndex(plans, 'home_event', 'event_course_type_due_idx')
+
+    def test_event_form_lists_courses_by_index(self):
+        with self.assertIndexedQueries() as plans:
+            self.client.get(reverse('add_event'))
+        self.assertUsesIndex(plans, 'home_course', 'course_user_name_idx')
+
+    def test_calendar_feeds_are_indexed(self):
+        token = self.user.userprofile.reset_ics_token()
+        with self.assertIndexedQueries() as plans:
+            self.client.get(reverse('calendar_events'), {'start': '2026-01-01', 'end': '2026-03-01'})
+            b"".join(self.client.get(reverse('calendar_ics', args=[token])).streaming_content)
+        self.assertUsesIndex(plans, 'home_event', 'event_user_due_date_idx')
+
+    def test_calendar_feed_reads_series_by_partial_index(self):
+        Event.objects.create(user=self.user, title="Weekly", due_date=now(), event_type="quiz", custom=True,
+                             recurrence="FREQ=WEEKLY")
+        with self.assertIndexedQueries() as plans:
+            self.client.get(reverse('calendar_events'), {'start': '2026-01-01', 'end': '2026-03-01'})
+        self.assertUsesIndex(plans, 'home_event', 'event_user_series_idx')
+
+    def test_settings_is_indexed(self):
+        with self.assertIndexedQueries():
+            self.client.get(reverse('user_settings'))
+
+    def test_full_scans_and_sorts_are_reported(self):
+        def problems(queryset):
+            return plan_problems(explain(*queryset.query.sql_with_params()))
+
+        self.assertTrue(problems(Event.objects.filter(title="Task 1")))
+        self.assertTrue(problems(Event.objects.filter(user=self.user).order_by('title')))
+        self.assertFalse(problems(Event.objects.filter(user=self.user).order_by('due_date')))
+
+
+class DescriptionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='reader', password='pass')
+        self.client.login(username='reader', password='pass')
+
+    def test_sanitize_keeps_formatting_and_drops_active_content(self):
+        html = (
+            '<p onclick="steal()">Read <a href="javascript:alert(1)">this</a> and '
+            '<a href="https://canvas.example/files/1" target="_blank">that</a></p>'
+            '<script>alert(1)</script><style>p {}</style><iframe src="https://x"></iframe><b>done'
+        )
+        self.assertEqual(
+            sanitize_html(html),
+            '<p>Read <a rel="noopener noreferrer">this</a> and '
+            '<a href="https://canvas.example/files/1" rel="noopener noreferrer">that</a></p><b>done</b>'
+        )
+        self.assertEqual(sanitize_html('<img src="data:image/png;base64,xx" alt="a&quot;b">'), '<img alt="a&quot;b">')
+        self.assertEqual(sanitize_html('5 &lt; 6 & <unknown>kept</unknown>'), '5 &lt; 6 &amp; kept')
+
+    def test_excerpt(self):
+        html, text = render_description("<h2>Intro</h2><p>First   paragraph.</p><ul><li>one</li><li>two</li></ul>")
+        self.assertEqual(text, "Intro First paragraph. one two")
+        long_text = excerpt("word " * 100)
+        self.assertLessEqual(len(long_text), 200)
+        self.assertTrue(long_text.endswith("word…"))
+
+    def test_custom_event_save_renders_description(self):
+        event = Event.objects.create(user=self.user, title="Essay", description="<p>Draft <em>due</em></p>",
+                                     due_date=datetime(2025, 3, 15), event_type="assignment", custom=True)
+        self.assertEqual((event.description_html, event.description_excerpt), ("<p>Draft <em>due</em></p>", "Draft due"))
+        event.description = "<p>Final</p>"
+        event.save(update_fields=["description"])
+        event.refresh_from_db()
+        self.assertEqual(event.description_excerpt, "Final")
+
+    def test_calendar_feed_carries_only_the_excerpt(self):
+        body = "<p>" + "Long instructions. " * 300 + "</p>"
+        event = Event.objects.create(user=self.user, title="Lab", description=body,
+                                     due_date=datetime(2025, 3, 15), event_type="assignment")
+        response = self.client.get(reverse('calendar_events'), {'start': '2025-03-01', 'end': '2025-04-01'})
+        events = response.json()
+        self.assertEqual(events[0]["id"], event.pk)
+        self.assertNotIn("description", events[0])
+        self.assertLessEqual(len(events[0]["description_excerpt"]), 200)
+        self.assertNotContains(response, body)
+
+        data = self.client.get(reverse('event_description', args=[event.pk])).json()
+        self.assertEqual(data["description_html"], body)
+
+    def test_calendar_page_fetches_the_events_description(self):
+        event = Event.objects.create(user=self.user, title="Lab", description="<p>Steps</p>",
+                                     due_date=datetime(2025, 3, 15), event_type="assignment")
+        page = self.client.get(reverse('calendar_view')).content.decode()
+        base = re.search(r'id="eventDescription"[^>]*data-url="([^"]+)"', page).group(1)
+        # Build the URL the way the modal script does: a regex replaced by a concatenation with eventId
+        pattern, replacement = re.search(r'descriptionEl\.dataset\.url\.replace\(/(.+?)/, (.+?)\)', page).groups()
+        parts = [str(event.pk) if part == "eventId" else part.strip('"') for part in replacement.split(" + ")]
+        url = re.sub(pattern, "".join(parts), base)
+        self.assertEqual(url, reverse('event_description', args=[event.pk]))
+        self.assertEqual(self.client.get(url).json()["description_html"], "<p>Steps</p>")
+
+    def test_description_endpoint_is_per_user(self):
+        other = User.objects.create_user(username='other')
+        event = Event.objects.create(user=other, title="Lab", description="<p>secret</p>",
+                                     due_date=datetime(2025, 3, 15), event_type="assignment")
+        self.assertEqual(self.client.get(reverse('event_description', args=[event.pk])).status_code, 404)
+
+    def test_sync_stores_rendered_descriptions_once(self):
+        with FakeCanvas(courses=1, assignments=3, modules=1, items=1) as canvas:
+            sync_canvas(self.user, canvas.url, 'tok')
+            event = Event.objects.get(user=self.user, canvas_id=1001)
+            self.assertEqual(event.description_html, "<p>Work for assignment 1.1</p>")
+            self.assertEqual(event.description_excerpt, "Work for assignment 1.1")
+            with patch("home.sync.render_description") as render:
+                counts = sync_canvas(self.user, canvas.url, 'tok')
+            render.assert_not_called()
+            self.assertEqual(counts["events"]["unchanged"], 3)
+
+
+# Async Canvas client tests
+class AsyncSyncTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='async', password='pass')
+        self.canvas = FakeCanvas(courses=3, assignments=12, modules=2, items=2, inline_items=1).start()
+        self.addCleanup(self.canvas.stop)
+        # Every loop async_to_sync starts must have closed its client by the end of the test
+        self.loop_states = []
+
+        def tracked_state():
+            state = _LoopState()
+            self.loop_states.append(state)
+            return state
+
+        patcher = patch('home.async_canvas._LoopState', side_effect=tracked_state)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.assertTrue(all(state.client.is_closed for state in self.loop_states))
+
+    def test_async_sync_matches_threaded_sync(self):
+        counts = async_to_sync(async_sync_canvas)(self.user, self.canvas.url, 'tok')
+        self.assertEqual(summarize(counts), "54 inserted, 0 updated, 0 deleted, 0 unchanged")
+        # requests percent-encodes include[] and httpx does not
+        async_calls = sorted(map(unquote, self.canvas.requests))
+        self.canvas.reset_log()
+        counts = sync_canvas(self.user, self.canvas.url, 'tok')
+        self.assertEqual(summarize(counts), "0 inserted, 0 updated, 0 deleted, 54 unchanged")
+        self.assertEqual(async_calls, sorted(map(unquote, self.canvas.requests)))
+
+    def test_concurrent_syncs_share_one_loop(self):
+        users = [self.user] + [User.objects.create_user(username=f'async{i}') for i in range(3)]
+
+        async def sync_all():
+            return await asyncio.gather(*(async_sync_canvas(u, self.canvas.url, f'tok{u.pk}') for u in users))
+
+        for counts in async_to_sync(sync_all)():
+            self.assertEqual(counts["events"]["inserted"], 36)
+        for user in users:
+            self.assertEqual(Event.objects.filter(user=user).count(), 36)
+
+    def test_planner_mode_falls_back(self):
+        self.canvas.planner = False
+        counts = async_to_sync(async_sync_canvas)(self.user, self.canvas.url, 'tok', mode="planner")
+        self.assertEqual(counts["events"]["inserted"], 36)
+
+    def test_async_view_runs_job(self):
+        self.client.login(username='async', password='pass')
+        response = self.client.post(reverse('fetch_assignments_async'), {
+            'canvas_url': self.canvas.url, 'api_token': 'tok'
+        })
+        self.assertRedirects(response, reverse('calendar_view'), fetch_redirect_response=False)
+        job = SyncJob.objects.get(user=self.user)
+        self.assertEqual(job.status, "done")
+        self.assertEqual(set(job.progress.values()), {"done"})
+        self.assertEqual(Event.objects.filter(user=self.user).count(), 36)
+        self.assertIsNotNone(UserProfile.objects.get(user=self.user).last_synced_at)
+
+    def test_async_view_attaches_to_running_job(self):
+        job = SyncJob.objects.create(user=self.user, canvas_url=self.canvas.url, status="running",
+                                     started_at=timezone.now())
+        self.client.login(username='async', password='pass')
+        response = self.client.post(reverse('fetch_assignments_async'), {
+            'canvas_url': self.canvas.url, 'api_token': 'tok'
+        })
+        self.assertRedirects(
+            response, f"{reverse('calendar_view')}?sync_job={job.pk}", fetch_redirect_response=False
+        )
+        self.assertEqual(self.canvas.requests, [])
+
+    def test_async_view_requires_login(self):
+        response = self.client.post(reverse('fetch_assignments_async'))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(reverse('login'), response.url)
+
+
+# Fleet-wide sync command tests
+@override_settings(SYNC_JOB_RUNNER="worker")
+class FleetSyncTests(TestCase):
+    def setUp(self):
+        self.canvas = FakeCanvas(courses=2, assignments=3, modules=1, items=1).start()
+        self.addCleanup(self.canvas.stop)
+        self.stale = [self.make_user(f'stale{i}') for i in range(2)]
+        self.fresh = self.make_user('fresh', last_synced_at=timezone.now())
+        self.tokenless = self.make_user('tokenless', token='')
+
+    def make_user(self, username, token='tok', **profile_fields):
+        user = User.objects.create_user(username=username, password='pass')
+        UserProfile.objects.filter(user=user).update(canvas_token=token, canvas_url=self.canvas.url, **profile_fields)
+        return user
+
+    def run_command(self, *args):
+        out = io.StringIO()
+        call_command('sync_canvas', '--processes', '0', *args, stdout=out, stderr=io.StringIO())
+        return out.getvalue()
+
+    def test_stale_profiles(self):
+        self.assertEqual(stale_profiles(timedelta(minutes=60)), [u.pk for u in self.stale])
+        self.assertEqual(stale_profiles(timedelta(minutes=60), limit=1), [self.stale[0].pk])
+
+    def claim(self, user, owner):
+        return claim_lease(user.pk, owner, timedelta(minutes=5), timedelta(minutes=60))
+
+    def test_leases_are_exclusive(self):
+        user = self.stale[0]
+        self.assertTrue(self.claim(user, 'a'))
+        self.assertFalse(self.claim(user, 'b'))
+        self.assertNotIn(user.pk, stale_profiles(timedelta(minutes=60)))
+        release_lease(user.pk, 'b')
+        self.assertFalse(self.claim(user, 'b'))
+        release_lease(user.pk, 'a')
+        self.assertTrue(self.claim(user, 'b'))
+
+    def test_expired_lease_can_be_claimed(self):
+        UserProfile.objects.filter(user=self.stale[0]).update(
+            sync_lease_until=timezone.now() - timedelta(seconds=1), sync_lease_owner='crashed'
+        )
+        self.assertTrue(self.claim(self.stale[0], 'b'))
+
+    def test_freshly_synced_user_cannot_be_claimed(self):
+        self.assertFalse(self.claim(self.fresh, 'a'))
+
+    def test_command_syncs_stale_users(self):
+        output = self.run_command()
+        self.assertIn("Synced 2 of 2 users (0 failed, 0 skipped)", output)
+        self.assertIn("rows changed: 20", output)
+        for user in self.stale:
+            profile = UserProfile.objects.get(user=user)
+            self.assertIsNotNone(profile.last_synced_at)
+            self.assertIsNone(profile.sync_lease_until)
+            self.assertEqual(Event.objects.filter(user=user).count(), 6)
+        self.assertFalse(Event.objects.filter(user=self.fresh).exists())
+        self.assertEqual(self.run_command(), "No stale profiles\n")
+
+    def test_user_with_a_running_job_is_left_alone(self):
+        SyncJob.objects.create(user=self.stale[0], canvas_url=self.canvas.url, status="running",
+                               started_at=timezone.now())
+        output = self.run_command()
+        self.assertIn("Synced 1 of 2 users (0 failed, 1 skipped)", output)
+        self.assertFalse(Event.objects.filter(user=self.stale[0]).exists())
+
+
+# Background sync job tests
+@override_settings(SYNC_JOB_RUNNER="worker")
+class SyncJobTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='jobber', password='pass')
+        self.client.login(username='jobber', password='pass')
+        self.canvas = FakeCanvas(courses=3, assignments=4, modules=2, items=2).start()
+        self.addCleanup(self.canvas.stop)
+
+    def post_fetch(self):
+        return self.client.post(reverse('fetch_assignments'), {'canvas_url': self.canvas.url, 'api_token': 'tok'})
+
+    def test_post_returns_before_syncing(self):
+        response = self.post_fetch()
+        job = SyncJob.objects.get(user=self.user)
+        self.assertRedirects(response, f"{reverse('calendar_view')}?sync_job={job.pk}")
+        self.assertEqual(job.status, "queued")
+        self.assertEqual(self.canvas.requests, [])
+        self.assertEqual(Event.objects.filter(user=self.user).count(), 0)
+
+    def test_worker_runs_job_and_reports_progress(self):
+        self.post_fetch()
+        job = SyncJob.objects.get(user=self.user)
+        call_command('sync_worker', '--once', stdout=io.StringIO())
+
+        response = self.client.get(reverse('sync_status', args=[job.pk]))
+        body = response.json()
+        self.assertEqual(body["status"], "done")
+        self.assertTrue(body["finished"])
+        self.assertEqual(body["courses"], {"Course 1": "done", "Course 2": "done", "Course 3": "done"})
+        self.assertEqual(body["counts"]["events"]["inserted"], 12)
+        self.assertEqual(Event.objects.filter(user=self.user).count(), 12)
+
+    def test_failed_course_progress(self):
+        del self.canvas.modules[2]
+        self.post_fetch()
+        job_id = SyncJob.objects.get(user=self.user).pk
+        run_job(job_id)
+        job = SyncJob.objects.get(pk=job_id)
+        self.assertEqual(job.progress["Course 2"], "failed")
+        self.assertEqual(job.progress["Course 1"], "done")
+
+    def test_failed_job_records_error(self):
+        self.client.post(reverse('fetch_assignments'), {'canvas_url': 'http://127.0.0.1:9', 'api_token': 'tok'})
+        job = SyncJob.objects.get(user=self.user)
+        run_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, "failed")
+        self.assertIn("Error fetching courses", job.error)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_job_runs_once(self):
+        self.post_fetch()
+        job_id = SyncJob.objects.get(user=self.user).pk
+        run_job(job_id)
+        self.canvas.reset_log()
+        run_job(job_id)
+        self.assertEqual(self.canvas.requests, [])
+
+    def test_status_is_private(self):
+        other = User.objects.create_user(username='nosy', password='pass')
+        job = SyncJob.objects.create(user=other, canvas_url=self.canvas.url)
+        response = self.client.get(reverse('sync_status', args=[job.pk]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_stale_running_jobs_are_requeued(self):
+        job = SyncJob.objects.create(
+            user=self.user, canvas_url=self.canvas.url, status="running",
+            started_at=timezone.now() - timedelta(hours=1)
+        )
+        self.assertEqual(requeue_stale(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, "queued")
+
+    @override_settings(SYNC_JOB_RUNNER="thread")
+    def test_thread_runner_starts_after_commit(self):
+        with patch('home.jobs.start_thread') as start:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.post_fetch()
+        start.assert_called_once_with(SyncJob.objects.get(user=self.user).pk)
+
+    def test_calendar_polls_pending_job(self):
+        self.post_fetch()
+        job = SyncJob.objects.get(user=self.user)
+        response = self.client.get(f"{reverse('calendar_view')}?sync_job={job.pk}")
+        self.assertContains(response, reverse('sync_status', args=[job.pk]))
+
+
+# Single-flight sync tests; these need real commits so other threads see the job rows
+class SingleFlightSyncTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='clicker', password='pass')
+        self.user.userprofile.canvas_token = 'tok'
+        self.user.userprofile.save()
+        self.canvas = FakeCanvas(courses=3, assignments=4, modules=2, items=2).start()
+        self.addCleanup(self.canvas.stop)
+
+    def fire_concurrent_posts(self, n, hold_lock=False):
+        """
+        Posts fetch_assignments from n threads at once and checks that no
+        two were inside the locked bookkeeping together. With hold_lock the
+        test holds the user's sync lock until every thread has been let go,
+        so none of them can get ahead of the others.
+        """
+        barrier = threading.Barrier(n + 1, timeout=10)
+        responses = []
+        clients = []
+        for _ in range(n):
+            client = Client()
+            client.force_login(self.user)
+            clients.append(client)
+
+        def post(client):
+            try:
+                barrier.wait()
+                responses.append(client.post(
+                    reverse('fetch_assignments'), {'canvas_url': self.canvas.url, 'api_token': 'tok'}
+                ))
+            finally:
+                connection.close()
+
+        inside = []
+        overlaps = []
+        guard = threading.Lock()
+
+        def checked_requeue(*args, **kwargs):
+            with guard:
+                inside.append(threading.get_ident())
+                overlaps.append(len(inside))
+            try:
+                return requeue_stale(*args, **kwargs)
+            finally:
+                with guard:
+                    inside.remove(threading.get_ident())
+
+        threads = [threading.Thread(target=post, args=(client,)) for client in clients]
+        with patch('home.jobs.requeue_stale', side_effect=checked_requeue):
+            for t in threads:
+                t.start()
+            if hold_lock:
+                with user_sync_lock(self.user.pk):
+                    barrier.wait()
+                    self.assertEqual(SyncJob.objects.count(), 0)
+            else:
+                barrier.wait()
+            for t in threads:
+                t.join()
+        self.assertEqual(max(overlaps), 1)
+        return responses
+
+    def course_listing_calls(self):
+        return [path for path in self.canvas.requests if path.startswith("/api/v1/courses?")]
+
+    @override_settings(SYNC_JOB_RUNNER="worker")
+    def test_concurrent_requests_share_one_job(self):
+        responses = self.fire_concurrent_posts(8, hold_lock=True)
+        self.assertEqual(SyncJob.objects.count(), 1)
+        job = SyncJob.objects.get()
+        self.assertEqual({r.url for r in responses}, {f"{reverse('calendar_view')}?sync_job={job.pk}"})
+
+        call_command('sync_worker', '--once', stdout=io.StringIO())
+        self.assertEqual(len(self.course_listing_calls()), 1)
+        # Module items arrive inline with the module listings
+        self.assertEqual(len(self.canvas.requests), 1 + 3 * 2)
+
+    @override_settings(SYNC_JOB_RUNNER="inline")
+    def test_concurrent_inline_syncs_fetch_once(self):
+        callers = 6
+        attached = []
+        everyone_attached = threading.Event()
+        guard = threading.Lock()
+
+        def counted_in_flight_job(*args, **kwargs):
+            job = in_flight_job(*args, **kwargs)
+            with guard:
+                attached.append(job.pk)
+                if len(attached) == callers:
+                    everyone_attached.set()
+            return job
+
+        # The sync that claimed the job waits until every caller has found it in flight
+        def held_sync(*args, **kwargs):
+            self.assertTrue(everyone_attached.wait(10))
+            return sync_canvas(*args, **kwargs)
+
+        with patch('home.jobs._in_flight_job', side_effect=counted_in_flight_job), \
+                patch('home.jobs.sync_canvas', side_effect=held_sync):
+            self.fire_concurrent_posts(callers)
+        self.assertEqual(len(set(attached)), 1)
+        self.assertEqual(SyncJob.objects.count(), 1)
+        self.assertEqual(SyncJob.objects.get().status, "done")
+        self.assertEqual(len(self.course_listing_calls()), 1)
+        self.assertEqual(Event.objects.filter(user=self.user).count(), 12)
+
+    @override_settings(SYNC_JOB_RUNNER="worker")
+    def test_new_job_after_previous_finished(self):
+        self.fire_concurrent_posts(1)
+        call_command('sync_worker', '--once', stdout=io.StringIO())
+        self.fire_concurrent_posts(1)
+        self.assertEqual(SyncJob.objects.count(), 2)
+
+
 # Test for assignment creation and displaying custom assignments properly in calendar view
 class CustomAssignmentTests(TestCase):
     def setUp(self):
+        cache.clear()
         self.user = User.objects.create_user(username="test", password="secret123")
+        self.course = Course.objects.create(user=self.user, name="Test Course")
         Event.objects.create(
             user=self.user,
             title="placeholder",
             description="",
             due_date=datetime.now() + timedelta(days=2),
             event_type="assignment",
-            course_name="Test Course"
+            course=self.course,
         )
         self.client.login(username="test", password="secret123")
 
@@ -394,13 +1850,14 @@ class CustomAssignmentTests(TestCase):
             "description": "A special one-off",
             "due_date": due,
             "event_type": "assignment",
-            "course_name": "Test Course",
+            "course": self.course.pk,
         }
         response = self.client.post(url, data)
         self.assertEqual(response.status_code, 302)
 
         ev = Event.objects.get(user=self.user, title="My Custom Task")
         self.assertTrue(ev.custom, "custom flag must be set to True for hand‑added events")
+        self.assertEqual(ev.course, self.course)
         self.assertEqual(ev.description, "A special one-off")
 
     def test_calendar_view_includes_custom_flag(self):
@@ -408,16 +1865,17 @@ class CustomAssignmentTests(TestCase):
         now = timezone.now() + timezone.timedelta(days=1)
         Event.objects.create(
             user=self.user, title="Canvas Task", description="",
-            due_date=now, event_type="assignment", course_name="C1", custom=False)
+            due_date=now, event_type="assignment", custom=False)
         Event.objects.create(
             user=self.user, title="Manual Task", description="foo",
-            due_date=now, event_type="assignment", course_name="C2", custom=True)
+            due_date=now, event_type="assignment", custom=True)
 
-        url = reverse("calendar_view")
-        resp = self.client.get(url)
+        url = reverse("calendar_events")
+        resp = self.client.get(url, {"start": (now - timedelta(days=1)).isoformat(),
+                                     "end": (now + timedelta(days=1)).isoformat()})
         self.assertEqual(resp.status_code, 200)
 
-        js = json.loads(resp.context["events_json"])
+        js = resp.json()
 
         # find custom event
         manual = next(e for e in js if e["title"].endswith("Manual Task"))
@@ -441,7 +1899,6 @@ class IndexViewTests(TestCase):
             title="Past Assignment",
             event_type="assignment",
             due_date=now() - timedelta(days=2),
-            course_name="Old Class"
         )
 
         Event.objects.create(
@@ -449,7 +1906,7 @@ class IndexViewTests(TestCase):
             title="Upcoming Assignment",
             event_type="assignment",
             due_date=now() + timedelta(days=3),
-            course_name="New Class"
+            course=Course.objects.create(user=self.user, name="New Class"),
         )
 
     def test_no_login(self):
@@ -0,0 +1,279 @@
+"""
+A small local stand-in for the Canvas REST API.
+
+Used by the tests and the benchmarks in scripts/ so that the sync code can be
+exercised over real sockets, with injected latency, without a Canvas account.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+ROUTES = [
+    (re.compile(r"^/api/v1/courses$"), "courses"),
+    (re.compile(r"^/api/v1/courses/(?P<cid>\d+)/assignments$"), "assignments"),
+    (re.compile(r"^/api/v1/courses/(?P<cid>\d+)/modules$"), "modules"),
+    (re.compile(r"^/api/v1/courses/(?P<cid>\d+)/modules/(?P<mid>\d+)/items$"), "items"),
+    (re.compile(r"^/api/v1/planner/items$"), "planner"),
+    (re.compile(r"^/api/v1/users/self/upcoming_events$"), "upcoming"),
+]
+
+
+class _Server(ThreadingHTTPServer):
+    # The default listen backlog of 5 drops connections under concurrent load,
+    # which then wait out a one second SYN retransmit
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class FakeCanvas:
+    def __init__(self, courses=7, assignments=20, modules=12, items=5, latency=0.0, year=None, per_page=10,
+                 inline_items=10, planner=True, rate_limit=None, refill=10.0, cost=1.0, retry_after=None):
+        self.latency = latency
+        # Canvas-style leaky bucket per server: rate_limit units, refilled at refill units/s
+        self.rate_limit = rate_limit
+        self.refill = refill
+        self.cost = cost
+        self.retry_after = retry_after
+        self.bucket = rate_limit
+        self.bucket_at = time.monotonic()
+        self.throttled = 0
+        self.stall_next = 0  # the next stall_next requests hang for stall_seconds before answering
+        self.stall_seconds = 0.0
+        self.inline_items = inline_items  # include[]=items is honoured for modules up to this size
+        self.planner = planner  # False answers the planner endpoints with 404, like older Canvas
+        self.default_per_page = per_page
+        self.year = year or time.gmtime().tm_year
+        self.requests = []
+        self.not_modified = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+        self.courses = [
+            {"id": c, "name": f"Course {c}", "term": {"name": f"Spring {self.year}"}} for c in range(1, courses + 1)
+        ]
+        self.assignments = {}
+        self.modules = {}
+        self.items = {}
+        for course in self.courses:
+            cid = course["id"]
+            self.assignments[cid] = [
+                {
+                    "id": cid * 1000 + a,
+                    "name": f"Assignment {cid}.{a}",
+                    "description": f"<p>Work for assignment {cid}.{a}</p>",
+                    "due_at": f"{self.year}-{(a % 12) + 1:02d}-15T23:59:00Z",
+                    "updated_at": f"{self.year}-01-01T00:00:00Z",
+                }
+                for a in range(1, assignments + 1)
+            ]
+            self.modules[cid] = []
+            for m in range(1, modules + 1):
+                mid = cid * 1000 + m
+                self.modules[cid].append({"id": mid, "name": f"Module {cid}.{m}", "position": m})
+                self.items[mid] = [
+                    {
+                        "id": mid * 1000 + i,
+                        "title": f"Item {mid}.{i}",
+                        "type": "Page",
+                        "external_url": f"https://example.com/{mid}/{i}",
+                    }
+                    for i in range(1, items + 1)
+                ]
+
+    def start(self):
+        self._server = _Server(("127.0.0.1", 0), self._handler_class())
+        # Kept after stop() so stalled handlers still finishing can build links
+        host, port = self._server.server_address[:2]
+        self.url = f"http://{host}:{port}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def reset_log(self):
+        with self._lock:
+            self.requests = []
+            self.not_modified = 0
+            self.max_in_flight = 0
+            self.throttled = 0
+
+    def stall(self, requests, seconds):
+        with self._lock:
+            self.stall_next = requests
+            self.stall_seconds = seconds
+
+    def charge(self):
+        """Takes one request's cost from the bucket; None if it is exhausted."""
+        with self._lock:
+            now = time.monotonic()
+            self.bucket = min(self.rate_limit, self.bucket + (now - self.bucket_at) * self.refill)
+            self.bucket_at = now
+            if self.bucket < self.cost:
+                self.throttled += 1
+                return None
+            self.bucket -= self.cost
+            return self.bucket
+
+    def resolve(self, path, query):
+        for pattern, name in ROUTES:
+            match = pattern.match(path)
+            if not match:
+                continue
+            args = match.groupdict()
+            if name == "courses":
+                return self.courses
+            if name == "assignments":
+                return self.assignments.get(int(args["cid"]))
+            if name == "modules":
+                modules = self.modules.get(int(args["cid"]))
+                if modules is None or "items" not in query.get("include[]", []):
+                    return modules
+                return [
+                    {**m, "items": self.items[m["id"]]} if len(self.items[m["id"]]) <= self.inline_items else m
+                    for m in modules
+                ]
+            if name == "items":
+                return self.items.get(int(args["mid"]))
+            if not self.planner:
+                return None
+            if name == "planner":
+                return self.planner_items(query)
+            if name == "upcoming":
+                return self.upcoming_events()
+        return None
+
+    def planner_items(self, query):
+        start = query.get("start_date", [""])[0]
+        end = query.get("end_date", ["9999"])[0]
+        items = []
+        for course in self.courses:
+            for a in self.assignments[course["id"]]:
+                if start <= a["due_at"] < end:
+                    items.append({
+                        "course_id": course["id"],
+                        "context_name": course["name"],
+                        "plannable_id": a["id"],
+                        "plannable_type": "assignment",
+                        "plannable_date": a["due_at"],
+                        "plannable": {
+                            "id": a["id"],
+                            "title": a["name"],
+                            "due_at": a["due_at"],
+                            "updated_at": a["updated_at"],
+                        },
+                    })
+        return sorted(items, key=lambda item: item["plannable_date"])
+
+    def upcoming_events(self):
+        # Canvas lists at most ten upcoming items, each with its full assignment
+        now = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        upcoming = sorted(
+            (a for course in self.courses for a in self.assignments[course["id"]] if a["due_at"] >= now),
+            key=lambda a: a["due_at"],
+        )
+        return [
+            {"type": "assignment", "title": a["name"], "start_at": a["due_at"], "assignment": a}
+            for a in upcoming[:10]
+        ]
+
+    def paginate(self, path, query, records):
+        # Canvas caps per_page at 100 and defaults to 10
+        per_page = min(int(query.get("per_page", [self.default_per_page])[0]), 100)
+        page = int(query.get("page", ["1"])[0])
+        last = max(1, -(-len(records) // per_page))
+        params = {k: v[0] for k, v in query.items() if k not in ("page", "per_page")}
+
+        def page_url(n):
+            return f"{self.url}{path}?{urlencode({**params, 'page': n, 'per_page': per_page})}"
+
+        links = [f'<{page_url(page)}>; rel="current"']
+        if page < last:
+            links.append(f'<{page_url(page + 1)}>; rel="next"')
+        if page > 1:
+            links.append(f'<{page_url(page - 1)}>; rel="prev"')
+        links.append(f'<{page_url(1)}>; rel="first"')
+        links.append(f'<{page_url(last)}>; rel="last"')
+        return records[(page - 1) * per_page:page * per_page], ",".join(links)
+
+    def _handler_class(self):
+        canvas = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                with canvas._lock:
+                    canvas.requests.append(self.path)
+                    canvas.in_flight += 1
+                    canvas.max_in_flight = max(canvas.max_in_flight, canvas.in_flight)
+                    stall = canvas.stall_seconds if canvas.stall_next > 0 else 0
+                    canvas.stall_next = max(0, canvas.stall_next - 1)
+                try:
+                    if canvas.latency or stall:
+                        time.sleep(canvas.latency + stall)
+                    rate_headers = {}
+                    if canvas.rate_limit is not None:
+                        remaining = canvas.charge()
+                        if remaining is None:
+                            self.send_response(403)
+                            if canvas.retry_after is not None:
+                                self.send_header("Retry-After", str(canvas.retry_after))
+                            self.send_header("X-Rate-Limit-Remaining", "0.0")
+                            self.end_headers()
+                            self.wfile.write(b"403 Forbidden (Rate Limit Exceeded)")
+                            return
+                        rate_headers = {"X-Request-Cost": str(canvas.cost), "X-Rate-Limit-Remaining": str(remaining)}
+                    query = parse_qs(parts.query)
+                    body = canvas.resolve(parts.path, query)
+                    if body is None:
+                        self.send_error(404)
+                        return
+                    body, link = canvas.paginate(parts.path, query, body)
+                    payload = json.dumps(body).encode()
+                    etag = '"%s"' % hashlib.sha1(payload + link.encode()).hexdigest()
+                    if self.headers.get("If-None-Match") == etag:
+                        with canvas._lock:
+                            canvas.not_modified += 1
+                        self.send_response(304)
+                        self.send_header("ETag", etag)
+                        for name, value in rate_headers.items():
+                            self.send_header(name, value)
+                        self.end_headers()
+                        return
+                    self.send_response(200)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(payload)))
+                    if link:
+                        self.send_header("Link", link)
+                    for name, value in rate_headers.items():
+                        self.send_header(name, value)
+                    self.end_headers()
+                    self.wfile.write(payload)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client timed out or took a hedged answer and hung up
+                finally:
+                    with canvas._lock:
+                        canvas.in_flight -= 1
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
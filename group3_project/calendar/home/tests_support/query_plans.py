@@ -0,0 +1,62 @@
+"""
+EXPLAIN QUERY PLAN checks for the hot views' queries.
+
+assertIndexedQueries() records the SELECTs sent inside its block, asks
+SQLite for each one's plan and fails the test when a plan scans a whole
+table or sorts rows in a temporary B-tree for ORDER BY; either means a
+query is no longer served by an index and will slow down as the tables
+grow. Only SQLite's plan format is understood, so on other databases the
+test is skipped.
+"""
+import re
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+# "SCAN home_event", "SCAN U0 USING COVERING INDEX ..."; not the constant row
+# of a FROM-less SELECT, a pass over a materialized subquery's rows or a
+# virtual table (full-text index) read with constraints ("INDEX 32:M2")
+FULL_SCAN = re.compile(r"^SCAN (?!CONSTANT ROW|\(|\S+ VIRTUAL TABLE INDEX \d+:\S)")
+ORDER_BY_SORT = re.compile(r"^USE TEMP B-TREE FOR .*ORDER BY")
+
+
+def explain(sql, params=()):
+    """The detail column of SQLite's EXPLAIN QUERY PLAN for sql."""
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def plan_problems(plan):
+    return [step for step in plan if FULL_SCAN.match(step) or ORDER_BY_SORT.match(step)]
+
+
+class QueryPlanAssertions:
+    """TestCase mixin."""
+
+    @contextmanager
+    def assertIndexedQueries(self):
+        """
+        Fails if any SELECT run in the block has a full scan or ORDER BY
+        sort in its plan. Yields a list that is filled with (sql, plan)
+        pairs when the block exits, for checks on which index was used.
+        """
+        if connection.vendor != "sqlite":
+            self.skipTest("query plan checks read SQLite's EXPLAIN QUERY PLAN")
+        plans = []
+        with CaptureQueriesContext(connection) as queries:
+            yield plans
+        for query in queries.captured_queries:
+            sql = query["sql"]
+            if not sql.startswith("SELECT"):
+                continue
+            plan = explain(sql)
+            plans.append((sql, plan))
+            problems = plan_problems(plan)
+            if problems:
+                self.fail(f"Query is not served by an index ({'; '.join(problems)}):\n{sql}")
+
+    def assertUsesIndex(self, plans, table, index):
+        used = [step for _, plan in plans for step in plan if f" {table} USING " in step and f" {index} " in step]
+        self.assertTrue(used, f"No query read {table} through {index}")
@@ -1,10 +1,16 @@
+from django.conf import settings
 from django.urls import path
 from django.contrib.auth import views as auth_views
 from .views import (
     index,
     register,
     fetch_assignments,
+    fetch_assignments_async,
     calendar_view,
+    calendar_events,
+    calendar_ics,
+    event_description,
+    skip_occurrence,
     clear_calendar,
     courses_list,
     course_detail,
@@ -12,6 +18,8 @@ from .views import (
     wipe_saved,
     add_event,
     user_settings,
+    sync_status,
+    canvas_metrics,
 )
 
 urlpatterns = [
@@ -19,11 +27,23 @@ urlpatterns = [
     path('login/', auth_views.LoginView.as_view(template_name='home/login.html'), name='login'),
     path('logout/', auth_views.LogoutView.as_view(), name='logout'),
     path('register/', register, name='register'),
-    path('fetch-assignments/', fetch_assignments, name='fetch_assignments'),
+    # CANVAS_ASYNC_FETCH serves the Canvas sync form from the async view under ASGI
+    path(
+        'fetch-assignments/',
+        fetch_assignments_async if getattr(settings, 'CANVAS_ASYNC_FETCH', False) else fetch_assignments,
+        name='fetch_assignments'
+    ),
+    path('fetch-assignments/async/', fetch_assignments_async, name='fetch_assignments_async'),
+    path('sync-status/<int:job_id>/', sync_status, name='sync_status'),
+    path('canvas-metrics/', canvas_metrics, name='canvas_metrics'),
     path('calendar_app/', calendar_view, name='calendar_view'),
+    path('calendar/events.json', calendar_events, name='calendar_events'),
+    path('calendar/<str:token>.ics', calendar_ics, name='calendar_ics'),
+    path('events/<int:event_id>/description/', event_description, name='event_description'),
+    path('events/<int:event_id>/skip/', skip_occurrence, name='skip_occurrence'),
     path('clear-calendar/', clear_calendar, name='clear_calendar'),
     path('modules/', courses_list, name='courses_list'),  # List of courses (modules page)
-    path("course/<path:course_name>/", course_detail, name="course_detail"),
+    path("course/<int:course_id>/", course_detail, name="course_detail"),
     path('assignment/<int:assignment_id>/', assignment_detail, name='assignment_detail'),
     path('wipe_saved/', wipe_saved, name='wipe_saved'),
     path('add_event/', add_event, name='add_event'),
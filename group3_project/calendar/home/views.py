@@ -1,80 +1,211 @@
 import logging
 import json
 import traceback
-from datetime import datetime
-from urllib.parse import unquote
-import requests
+from datetime import datetime, timedelta
+from asgiref.sync import sync_to_async
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
 from django.contrib.auth.forms import UserCreationForm
 from django.core.serializers.json import DjangoJSONEncoder
-from django.db import transaction
+from django.db.models import F, Q
+from django.http import (
+    Http404, HttpResponse, HttpResponseForbidden, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+)
 from django.shortcuts import get_object_or_404, redirect, render
-from django.utils.html import strip_tags
-from django.utils.timezone import now
+from django.urls import reverse
+from django.utils import dateparse
+from django.utils.timezone import is_naive, make_aware, now
 from django.views.decorators.csrf import csrf_exempt
-from requests.adapters import HTTPAdapter
 
+from . import ics, recurrence
+from .calendar_cache import cached_payload, cached_stream, calendar_cache_stats, calendar_changes, calendar_version
+from .canvas import cache_stats, client_metrics
+from .conditional import page_etag, revalidated, stamp_etag, user_etag
 from .forms import EventForm
-from .models import Event, Module, ModuleItem
+from .jobs import arun_sync_now, enqueue_sync
+from .models import Course, Event, Module, ModuleItem, SyncJob, UserProfile
+from .sync import summarize
 
 logger = logging.getLogger(__name__)
 
-# Set up a shared session
-session = requests.Session()
-adapter = HTTPAdapter(pool_connections=50, pool_maxsize=50, max_retries=3)
-session.mount("https://", adapter)
-session.mount("http://", adapter)
-
-
-# Fetches JSON data
-def fetch_json(url, headers):
-    resp = session.get(url, headers=headers)
-    resp.raise_for_status()
-    return resp.json()
+# Longest range calendar_events serves; a month view asks for six weeks
+CALENDAR_FEED_MAX_DAYS = 400
+# Rows calendar_ics reads from the database at a time
+ICS_CHUNK_SIZE = 500
+# The event fields calendar_events sends, plus course_name
+FEED_FIELDS = ("id", "title", "description_excerpt", "event_type", "due_date", "custom")
 
 
 @csrf_exempt
 def clear_calendar(request):
     if request.method == "POST":
-        Event.objects.filter(user=request.user).delete()
+        with calendar_changes():
+            Event.objects.filter(user=request.user).delete()
         messages.success(request, "All events have been cleared.")
     else:
         messages.error(request, "Invalid request.")
     return redirect('calendar_view')
 
 
+def _sync_job_param(request):
+    sync_job = request.GET.get("sync_job", "")
+    return int(sync_job) if sync_job.isdigit() else None
+
+
+def _calendar_page_etag(request):
+    return page_etag(request, _sync_job_param(request))
+
+
 @login_required
+@revalidated(_calendar_page_etag)
 def calendar_view(request):
-    events = list(Event.objects.filter(user=request.user).values(
-        "course_name", "title", "description", "event_type", "due_date", "custom"
-    ))
-    for ev in events:
-        ev["description"] = strip_tags(ev["description"] or "")
-    events_json = json.dumps(events, cls=DjangoJSONEncoder)
-    return render(request, "home/calendar.html", {"events_json": events_json})
+    # Events are loaded a visible range at a time from calendar_events
+    return render(request, "home/calendar.html", {"sync_job": _sync_job_param(request)})
 
 
-@csrf_exempt
-def parse_date(date_str):
-    if not date_str:
-        return None
-    if date_str.endswith("Z"):
-        date_str = date_str[:-1]
+def _feed_bound(value):
+    parsed = dateparse.parse_datetime(value)
+    if parsed is None:
+        day = dateparse.parse_date(value)
+        if day is None:
+            return None
+        parsed = datetime.combine(day, datetime.min.time())
+    return make_aware(parsed) if is_naive(parsed) else parsed
+
+
+def _feed_window(request):
+    """(start, end, error) for a calendar_events request."""
     try:
-        return datetime.fromisoformat(date_str)
+        start = _feed_bound(request.GET.get("start", ""))
+        end = _feed_bound(request.GET.get("end", ""))
     except ValueError:
+        start = end = None
+    if start is None or end is None or end <= start:
+        return None, None, "start and end must be ISO dates with start before end"
+    if end - start > timedelta(days=CALENDAR_FEED_MAX_DAYS):
+        return None, None, f"ranges are limited to {CALENDAR_FEED_MAX_DAYS} days"
+    return start, end, None
+
+
+def _request_calendar_version(request):
+    # Read once per request; the ETag and the cache key both need it
+    if not hasattr(request, "_calendar_version"):
+        request._calendar_version = calendar_version(request.user.pk)
+    return request._calendar_version
+
+
+def _calendar_events_etag(request):
+    start, end, error = _feed_window(request)
+    if error:
         return None
+    return user_etag(request, _request_calendar_version(request), start.isoformat(), end.isoformat())
 
 
-@csrf_exempt
-def get_active_courses(canvas_url, api_token):
-    url = f"{canvas_url}/api/v1/courses?enrollment_state=active&per_page=100"
-    headers = {"Authorization": f"Bearer {api_token}"}
+def _series_occurrences(events, start, end):
+    """Feed records for the occurrences of the recurring events in [start, end)."""
+    series = events.exclude(recurrence="").filter(due_date__lt=end).filter(
+        Q(recurrence_end__isnull=True) | Q(recurrence_end__gte=start)
+    ).values(*FEED_FIELDS, "recurrence", "recurrence_exceptions", course_name=F("course__name"))
+    for event in series:
+        rule = recurrence.parse_rule(event.pop("recurrence"))
+        skipped = event.pop("recurrence_exceptions")
+        for when in recurrence.occurrences(event["due_date"], rule, start, end, skipped):
+            # occurrence tells the calendar which one to skip
+            yield {**event, "due_date": when, "occurrence": recurrence.occurrence_key(when)}
+
+
+# JSON event source for FullCalendar: the events due in [start, end), only the fields it renders
+@login_required
+@revalidated(_calendar_events_etag)
+def calendar_events(request):
+    start, end, error = _feed_window(request)
+    if error:
+        return JsonResponse({"error": error}, status=400)
+
+    def build():
+        mine = Event.objects.filter(user=request.user)
+        events = list(mine.filter(recurrence="", due_date__gte=start, due_date__lt=end).values(
+            *FEED_FIELDS, course_name=F("course__name")
+        ))
+        events.extend(_series_occurrences(mine, start, end))
+        return json.dumps(events, cls=DjangoJSONEncoder).encode()
+
+    version = _request_calendar_version(request)
+    payload = cached_payload(request.user.pk, version, f"events:{start.isoformat()}:{end.isoformat()}", build)
+    return HttpResponse(payload, content_type="application/json")
+
+
+def _ics_profile(request, token):
+    # Read once per request; the validators and the view all need it
+    if not hasattr(request, "_ics_profile"):
+        request._ics_profile = UserProfile.objects.filter(ics_token=token).values(
+            "user_id", "user__username", "calendar_version", "calendar_changed_at"
+        ).first()
+    return request._ics_profile
+
+
+def _ics_etag(request, token):
+    profile = _ics_profile(request, token)
+    if profile is None:
+        return None
+    return stamp_etag(profile["user_id"], profile["calendar_version"], ics.RENDER_VERSION)
+
+
+def _ics_last_modified(request, token):
+    profile = _ics_profile(request, token)
+    return profile["calendar_changed_at"] if profile else None
+
+
+# Subscription feed for calendar apps; the token in the URL stands in for a login
+@revalidated(_ics_etag, _ics_last_modified)
+def calendar_ics(request, token):
+    profile = _ics_profile(request, token)
+    if profile is None:
+        raise Http404("Unknown calendar")
+
+    def render():
+        events = Event.objects.filter(user_id=profile["user_id"]).order_by("due_date", "pk")
+        return ics.render_calendar(
+            events.values(*ics.EVENT_FIELDS, course_name=F("course__name")).iterator(chunk_size=ICS_CHUNK_SIZE),
+            f"CalendAI ({profile['user__username']})",
+            profile["calendar_changed_at"] or now(),
+        )
+
+    key = f"ics:{ics.RENDER_VERSION}"
+    response = StreamingHttpResponse(
+        cached_stream(profile["user_id"], profile["calendar_version"], key, render),
+        content_type="text/calendar; charset=utf-8",
+    )
+    response["Content-Disposition"] = 'inline; filename="calendai.ics"'
+    return response
+
+
+@login_required
+def event_description(request, event_id):
+    event = get_object_or_404(Event.objects.only("description_html"), pk=event_id, user=request.user)
+    return JsonResponse({"id": event_id, "description_html": event.description_html})
+
+
+# Drops one occurrence of a recurring custom event; the rest of the series stays
+@login_required
+def skip_occurrence(request, event_id):
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+    event = get_object_or_404(Event, pk=event_id, user=request.user, custom=True)
+    if not event.recurrence:
+        return JsonResponse({"error": "This event does not repeat"}, status=400)
     try:
-        return fetch_json(url, headers)
-    except Exception as e:
-        raise Exception(f"Error fetching courses: {e}")
+        when = recurrence.parse_key(request.POST.get("occurrence", ""))
+    except recurrence.InvalidRule as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    key = recurrence.occurrence_key(when)
+    if not recurrence.is_occurrence(event.due_date, recurrence.parse_rule(event.recurrence), when):
+        return JsonResponse({"error": f"{key} is not an occurrence of this event"}, status=400)
+    if key not in event.recurrence_exceptions:
+        event.recurrence_exceptions = sorted([*event.recurrence_exceptions, key])
+        event.save(update_fields=["recurrence_exceptions"])
+    return JsonResponse({"id": event.pk, "recurrence_exceptions": event.recurrence_exceptions})
 
 
 @csrf_exempt
@@ -87,111 +218,94 @@ def fetch_assignments(request):
         canvas_url = request.POST.get('canvas_url')
         api_token = request.POST.get('api_token')
 
-        profile = request.user.userprofile
+        save_canvas_credentials(request.user, canvas_url, api_token)
+        job = enqueue_sync(request.user, canvas_url)
+        # The runner may finish before we return (SYNC_JOB_RUNNER = "inline")
+        return _sync_job_redirect(request, job)
+
+    except Exception:
+        traceback.print_exc()
+        return redirect('index')
+
+
+def save_canvas_credentials(user, canvas_url, api_token):
+    profile = user.userprofile
+    if profile.canvas_token != api_token or (canvas_url and profile.canvas_url != canvas_url):
+        # The URL is saved so `manage.py sync_canvas` can keep this calendar fresh
         profile.canvas_token = api_token
+        profile.canvas_url = canvas_url or profile.canvas_url
         profile.save()
 
-        courses = get_active_courses(canvas_url, api_token)
-        if not courses:
-            return redirect('index')
-
-        headers = {"Authorization": f"Bearer {api_token}"}
-        current_year = datetime.now().year
-
-        event_objs = []
-        module_objs = []
-        module_jobs = []
-
-        for c in courses:
-            cid = c["id"]
-            cname = c.get("name", "Unknown Course")
-
-            try:
-                assns = fetch_json(f"{canvas_url}/api/v1/courses/{cid}/assignments?per_page=100", headers)
-            except Exception:
-                assns = []
-
-            for a in assns:
-                due = parse_date(a.get("due_at") or "")
-                if due and due.year == current_year:
-                    event_objs.append(Event(
-                        user=request.user,
-                        title=a.get("name", "Untitled Assignment"),
-                        description=a.get("description") or "",
-                        due_date=due,
-                        event_type="assignment",
-                        course_name=cname
-                    ))
-
-            try:
-                mods = fetch_json(f"{canvas_url}/api/v1/courses/{cid}/modules?per_page=100", headers)
-            except Exception:
-                mods = []
-
-            for m in mods:
-                mod_title = m.get("name", "Untitled Module")
-                module_objs.append(Module(
-                    user=request.user,
-                    title=mod_title,
-                    course_name=cname,
-                    description=m.get("description") or "",
-                ))
-                module_jobs.append((cid, cname, m["id"], mod_title))
-
-        with transaction.atomic():
-            Event.objects.filter(user=request.user, event_type="assignment").delete()
-            Event.objects.bulk_create(event_objs)
-            Module.objects.bulk_create(module_objs)
-
-        item_objs = []
-        for cid, cname, mid, title in module_jobs:
-            try:
-                items = fetch_json(f"{canvas_url}/api/v1/courses/{cid}/modules/{mid}/items", headers)
-            except Exception:
-                continue
-
-            try:
-                module_instance = Module.objects.get(course_name=cname, title=title)
-            except Module.DoesNotExist:
-                continue
-
-            for it in items:
-                item_objs.append(ModuleItem(
-                    module=module_instance,
-                    title=it.get("title", "Untitled Item"),
-                    item_type=it.get("type", ""),
-                    file_url=it.get("external_url") or "",
-                    content=it.get("content") or ""
-                ))
-
-        if item_objs:
-            ModuleItem.objects.bulk_create(item_objs)
 
-        return redirect('calendar_view')
+def _sync_job_redirect(request, job):
+    if not job.finished:
+        return redirect(f"{reverse('calendar_view')}?sync_job={job.pk}")
+    if job.status == "failed" or job.counts is None:
+        return redirect('index')
+    messages.success(request, f"Canvas sync finished: {summarize(job.counts)}.")
+    return redirect('calendar_view')
+
+
+async def fetch_assignments_async(request):
+    """
+    fetch_assignments for ASGI servers. The sync runs on the event loop
+    inside the request through the httpx client, so one worker holds many
+    users' in-flight syncs at once instead of a thread apiece. A user whose
+    sync is already running elsewhere is sent to its progress page.
+    """
+    user = await sync_to_async(lambda: request.user if request.user.is_authenticated else None)()
+    if user is None:
+        return redirect_to_login(request.get_full_path())
+    if request.method != "POST":
+        return redirect('index')
+
+    try:
+        canvas_url = request.POST.get('canvas_url')
+        await sync_to_async(save_canvas_credentials)(user, canvas_url, request.POST.get('api_token'))
+        job = await arun_sync_now(user, canvas_url)
+        return _sync_job_redirect(request, job)
 
     except Exception:
         traceback.print_exc()
         return redirect('index')
 
 
+@login_required
+def sync_status(request, job_id):
+    job = get_object_or_404(SyncJob, pk=job_id, user=request.user)
+    return JsonResponse({
+        "id": job.pk,
+        "status": job.status,
+        "finished": job.finished,
+        "courses": job.progress,
+        "counts": job.counts,
+        "error": job.error,
+    })
+
+
+# Canvas client health for operators: breaker states, hedging and cache counters
+@login_required
+def canvas_metrics(request):
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+    return JsonResponse({**client_metrics(), "http_cache": cache_stats(), "calendar_cache": calendar_cache_stats()})
+
+
 @csrf_exempt
 def courses_list(request):
-    courses = Module.objects.filter(user=request.user).values_list('course_name', flat=True).distinct()
+    courses = Course.objects.filter(user=request.user).order_by('name')
     return render(request, "home/courses_list.html", {"courses": courses})
 
 
 @csrf_exempt
-def course_detail(request, course_name):
-    course_name = unquote(course_name)
-
-    assignments = Event.objects.filter(
-        course_name=course_name,
-        event_type="assignment",
-        user=request.user
-    ).order_by('due_date')
-    modules = Module.objects.filter(course_name=course_name, user=request.user)
+@login_required
+def course_detail(request, course_id):
+    course = get_object_or_404(Course, pk=course_id, user=request.user)
+    assignments = Event.objects.filter(course=course, event_type="assignment").order_by('due_date')
+    modules = Module.objects.filter(course=course)
     return render(request, "home/course_detail.html", {
-        "course_name": course_name,
+        "course": course,
+        "course_name": course.name,
         "assignments": assignments,
         "modules": modules,
     })
@@ -206,10 +320,13 @@ def assignment_detail(request, assignment_id):
 @csrf_exempt
 def wipe_saved(request):
     if request.method == "POST":
-        Event.objects.filter(user=request.user).delete()
+        with calendar_changes():
+            Event.objects.filter(user=request.user).delete()
         Module.objects.filter(user=request.user).delete()
         ModuleItem.objects.filter(module__user=request.user).delete()
-        messages.success(request, "All saved events and modules have been wiped.")
+        # Every course comes from Canvas or from the old course names; the next sync brings them back
+        Course.objects.filter(user=request.user).delete()
+        messages.success(request, "All saved events, courses and modules have been wiped.")
     else:
         messages.error(request, "Invalid request.")
     return redirect('calendar_view')
@@ -241,7 +358,7 @@ def index(request):
                 user=request.user,
                 event_type="assignment",
                 due_date__gte=now()
-            ).order_by('due_date')
+            ).select_related('course').order_by('due_date')
 
     return render(request, "home/index.html", {
         "token_present": token_present,
@@ -284,6 +401,21 @@ def user_settings(request):
                 messages.error(request, "Couldn’t find that assignment.")
             return redirect("user_settings")
 
+        sync_mode = request.POST.get("sync_mode")
+        if sync_mode:
+            if sync_mode in dict(UserProfile.SYNC_MODES):
+                profile.sync_mode = sync_mode
+                profile.save(update_fields=["sync_mode"])
+                messages.success(request, "Canvas sync mode updated.")
+            else:
+                messages.error(request, "Unknown sync mode.")
+            return redirect("user_settings")
+
+        if request.POST.get("reset_ics_token"):
+            profile.reset_ics_token()
+            messages.success(request, "New calendar subscription link created. Links made before it no longer work.")
+            return redirect("user_settings")
+
         canvas_url = request.POST.get("canvas_url")
         canvas_token = request.POST.get("canvas_token")
         if canvas_url and canvas_token:
@@ -295,5 +427,8 @@ def user_settings(request):
 
     return render(request, "home/settings.html", {
         "custom_events": custom_events,
-        "profile": profile
+        "profile": profile,
+        "sync_modes": UserProfile.SYNC_MODES,
+        "ics_url": request.build_absolute_uri(reverse("calendar_ics", args=[profile.ics_token]))
+        if profile.ics_token else None,
     })
@@ -1,6 +1,18 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def _restore_search_triggers(using, **kwargs):
+    from django.db import connections
+    from .search import restore_triggers
+    restore_triggers(connections[using])
 
 
 class NotepageConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'notepage'
+
+    def ready(self):
+        import notepage.signals
+        # Migrations that rebuild notepage_note on SQLite drop the search triggers
+        post_migrate.connect(_restore_search_triggers, sender=self)
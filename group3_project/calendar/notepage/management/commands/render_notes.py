@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from notepage.models import Note
+from notepage.rendering import render_key, render_markdown
+
+
+class Command(BaseCommand):
+    help = "Re-renders the stored HTML of notes rendered by an older renderer or never rendered."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Render every note, stale or not.")
+        parser.add_argument("--batch-size", type=int, default=500, help="Notes written per UPDATE batch.")
+
+    def handle(self, *args, **options):
+        checked = 0
+        stale = []
+        rendered = 0
+        notes = Note.objects.only("id", "content", "content_html_key").order_by("pk")
+        for note in notes.iterator(chunk_size=options["batch_size"]):
+            checked += 1
+            key = render_key(note.content)
+            if key == note.content_html_key and not options["all"]:
+                continue
+            note.content_html = render_markdown(note.content)
+            note.content_html_key = key
+            stale.append(note)
+            if len(stale) == options["batch_size"]:
+                rendered += self.write(stale)
+        rendered += self.write(stale)
+        self.stdout.write(f"Rendered {rendered} of {checked} note(s)")
+
+    def write(self, notes):
+        # bulk_update leaves updated_at alone; a re-render is not an edit
+        Note.objects.bulk_update(notes, ["content_html", "content_html_key"])
+        count = len(notes)
+        notes.clear()
+        return count
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.20 on 2026-10-18 17:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notepage', '0005_note_summary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(fields=['user', '-updated_at'], name='note_user_updated_idx'),
+        ),
+    ]
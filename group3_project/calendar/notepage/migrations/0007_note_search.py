@@ -0,0 +1,22 @@
+from django.db import migrations
+
+from notepage import search
+
+
+def install(apps, schema_editor):
+    search.install(schema_editor.connection)
+
+
+def uninstall(apps, schema_editor):
+    search.uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notepage', '0006_note_user_updated_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.20 on 2026-10-18 17:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notepage', '0007_note_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='content_html',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='content_html_key',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
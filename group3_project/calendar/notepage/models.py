@@ -1,8 +1,8 @@
 from django.db import models
-import markdown
 from taggit.managers import TaggableManager
 from django.utils import timezone
 from django.contrib.auth.models import User
+from .rendering import render_key, render_markdown
 
 
 class Note(models.Model):
@@ -13,22 +13,94 @@ class Note(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     tags = TaggableManager(blank=True)
+    # Rendered content and the render_key it was rendered for; see notepage.rendering
+    content_html = models.TextField(blank=True, default='')
+    content_html_key = models.CharField(max_length=64, blank=True, default='')
+
+    class Meta:
+        indexes = [
+            # note_list shows the user's notes most recently updated first
+            models.Index(fields=['user', '-updated_at'], name='note_user_updated_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        note = super().from_db(db, field_names, values)
+        # What was read, so save() can tell what changed without reading it again
+        note._loaded_values = dict(zip(field_names, values))
+        return note
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using, fields)
+        self._remember_values(fields)
+
+    def _remember_values(self, attnames=None):
+        loaded = getattr(self, '_loaded_values', {})
+        for field in self._meta.concrete_fields:
+            if field.attname in self.__dict__ and (attnames is None or field.attname in attnames):
+                loaded[field.attname] = self.__dict__[field.attname]
+        self._loaded_values = loaded
+
+    def changed_fields(self):
+        """
+        Names of the fields set to something other than what was last read
+        or saved; None for a note that did not come from the database.
+        """
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return None
+        current = self.__dict__
+        return {
+            field.name for field in self._meta.concrete_fields
+            # A deferred field that was assigned without being read counts as changed
+            if field.attname in current and loaded.get(field.attname, models.NOT_PROVIDED) != current[field.attname]
+        }
+
+    def refresh_html(self):
+        """Renders content_html again if the content or the renderer changed; returns whether it did."""
+        key = render_key(self.content)
+        if key == self.content_html_key:
+            return False
+        self.content_html = render_markdown(self.content)
+        self.content_html_key = key
+        return True
+
     def get_html_content(self):
-        return markdown.markdown(self.content, extensions=['extra', 'codehilite'])
+        # Stale after a renderer upgrade until render_notes reaches this note; store it on first view
+        if self.pk and self.refresh_html():
+            Note.objects.filter(pk=self.pk).update(content_html=self.content_html, content_html_key=self.content_html_key)
+            self._remember_values(['content_html', 'content_html_key'])
+        return self.content_html
 
     def save(self, *args, **kwargs):
         self.updated_at = timezone.now()
 
-        if self.pk:
-            old_note = Note.objects.get(pk=self.pk).content
-            if old_note != self.content:
-                self.summary = None
+        changed = self.changed_fields()
+        if changed is not None:
+            content_changed = 'content' in changed
+        elif self.pk:
+            # Built with a pk rather than read; only the database knows the old content
+            old_content = Note.objects.filter(pk=self.pk).values_list('content', flat=True).first()
+            content_changed = old_content is not None and old_content != self.content
+        else:
+            content_changed = False
+        if content_changed:
+            self.summary = None
 
+        self.refresh_html()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'content' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'content_html', 'content_html_key'}
+        elif update_fields is None and changed is not None and not kwargs.get('force_insert'):
+            # Write only what changed, summary and rendered HTML included
+            kwargs['update_fields'] = self.changed_fields() | {'updated_at'}
         super(Note, self).save(*args, **kwargs)
+        self._remember_values(None if update_fields is None else [
+            self._meta.get_field(name).attname for name in kwargs['update_fields']
+        ])
 
     @property
     def filename(self):
@@ -0,0 +1,121 @@
+"""
+Incremental Markdown preview for the note editor.
+
+split_blocks cuts a document at the blank lines between top-level
+blocks, keeping together what Markdown would join across them: fenced
+code, list items and their indented continuations, consecutive block
+quotes and definition lists. Each block is rendered on its own with the
+note renderer and cached by key in a per-process LRU, so an edit only
+renders the blocks it touched. Reference link and abbreviation
+definitions are added to every block, and are part of the keys. Footnotes and
+raw HTML can tie distant blocks together, so documents with them are
+rendered as one block.
+"""
+import re
+import threading
+from collections import OrderedDict
+
+from .rendering import render_key, render_markdown
+
+PREVIEW_CACHE_BLOCKS = 4096
+# Largest document previewed, in characters
+MAX_PREVIEW_CHARS = 1_000_000
+
+FENCE = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+LIST_ITEM = re.compile(r"^ {0,3}([*+-]|\d+[.)])[ \t]")
+# [id]: url and *[ABBR]: text; they render to nothing but change other blocks
+DEFINITION = re.compile(r"^ {0,3}\*?\[[^\]^][^\]]*\]:.*$", re.M)
+WHOLE_DOCUMENT = re.compile(r"^ {0,3}<[A-Za-z!/]|\[\^[^\]]+\]", re.M)
+
+_blocks = OrderedDict()
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+
+def _kind(block):
+    if LIST_ITEM.match(block):
+        return "list"
+    if block.lstrip(" ").startswith(">"):
+        return "quote"
+    return None
+
+
+def _continues(block, previous):
+    """Whether block, after a blank line, is still part of previous."""
+    if block[0] in " \t":
+        return _kind(previous) == "list" or previous[0] in " \t"
+    if block.startswith(":"):
+        return True
+    kind = _kind(block)
+    return kind is not None and kind == _kind(previous)
+
+
+def split_blocks(text):
+    chunks = []
+    lines = []
+    fence = None
+    for line in text.replace("\r\n", "\n").replace("\r", "\n").split("\n"):
+        if fence:
+            lines.append(line)
+            if line.strip().startswith(fence) and not line.strip().strip(fence[0]):
+                fence = None
+            continue
+        opening = FENCE.match(line)
+        if opening:
+            fence = opening.group(1)
+        if line.strip():
+            lines.append(line)
+        elif lines:
+            chunks.append("\n".join(lines))
+            lines = []
+    if lines:
+        chunks.append("\n".join(lines))
+    blocks = []
+    for chunk in chunks:
+        if blocks and _continues(chunk, blocks[-1]):
+            blocks[-1] += "\n\n" + chunk
+        else:
+            blocks.append(chunk)
+    return blocks
+
+
+def _render(key, source):
+    with _lock:
+        html = _blocks.get(key)
+        if html is not None:
+            _blocks.move_to_end(key)
+            _stats["hits"] += 1
+            return html
+        _stats["misses"] += 1
+    html = render_markdown(source)
+    with _lock:
+        _blocks[key] = html
+        while len(_blocks) > PREVIEW_CACHE_BLOCKS:
+            _blocks.popitem(last=False)
+    return html
+
+
+def render_blocks(text, known=()):
+    """
+    (keys, html): the key of each block of text in order, and the HTML of
+    the blocks whose keys are not in known, the ones the editor already has.
+    """
+    if WHOLE_DOCUMENT.search(text):
+        blocks = [text] if text.strip() else []
+        definitions = ""
+    else:
+        blocks = split_blocks(text)
+        definitions = "\n".join(DEFINITION.findall(text))
+    keys = []
+    html = {}
+    for block in blocks:
+        key = render_key(definitions + "\x00" + block)[:24]
+        keys.append(key)
+        if key not in known and key not in html:
+            html[key] = _render(key, f"{block}\n\n{definitions}" if definitions else block)
+    return keys, html
+
+
+def preview_cache_stats():
+    with _lock:
+        return {**_stats, "blocks": len(_blocks)}
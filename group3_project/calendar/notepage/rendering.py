@@ -0,0 +1,27 @@
+"""
+Markdown rendering for notes.
+
+Note.content_html holds the rendered content and content_html_key the
+render_key it was made for: a hash of the content, RENDERER_VERSION and
+the installed Markdown and Pygments versions. A note is rendered again
+only when one of those changes, so showing it is a plain read. After an
+upgrade, `manage.py render_notes` re-renders the stale notes in bulk;
+notes it has not reached yet are rendered on their first view.
+"""
+import hashlib
+
+import markdown
+import pygments
+
+# Bump when the output changes, e.g. a new extension or extension setting
+RENDERER_VERSION = 1
+MARKDOWN_EXTENSIONS = ['extra', 'codehilite']
+
+
+def render_markdown(text):
+    return markdown.markdown(text, extensions=MARKDOWN_EXTENSIONS)
+
+
+def render_key(content):
+    stamp = f"{RENDERER_VERSION}:{markdown.__version__}:{pygments.__version__}:"
+    return hashlib.sha256((stamp + content).encode()).hexdigest()
@@ -0,0 +1,169 @@
+"""
+Full-text search over note titles and content.
+
+On SQLite the notes are indexed in notepage_note_fts, an FTS5 table that
+reads its text from notepage_note (external content) and is kept in step
+by triggers, so bulk writes and queryset.update() are indexed too. On
+PostgreSQL a generated tsvector column with a GIN index does the same
+job. Both rank matches, title hits above content hits, and return a
+highlighted snippet of the content. Other databases fall back to the
+icontains scan this replaced.
+
+The user's words are matched as prefixes ("algo" finds "algorithms"),
+all of them required, and are never passed through as query syntax.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import Note
+
+FTS_TABLE = "notepage_note_fts"
+# Most matches shown, best first
+RESULT_LIMIT = 200
+MAX_TERMS = 8
+SNIPPET_TOKENS = 24
+# Marks around matched words in snippets; replaced with <mark> after escaping
+START_MARK, STOP_MARK = "\x02", "\x03"
+TERM = re.compile(r"\w+")
+
+SQLITE_TRIGGERS = {
+    f"{FTS_TABLE}_insert": f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON notepage_note BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, title, content) VALUES (new.id, new.title, new.content);
+        END""",
+    f"{FTS_TABLE}_delete": f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON notepage_note BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+        END""",
+    f"{FTS_TABLE}_update": f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE OF title, content ON notepage_note BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+            INSERT INTO {FTS_TABLE}(rowid, title, content) VALUES (new.id, new.title, new.content);
+        END""",
+}
+
+POSTGRES_INSTALL = [
+    """ALTER TABLE notepage_note ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A')
+        || setweight(to_tsvector('english', coalesce(content, '')), 'B')
+    ) STORED""",
+    "CREATE INDEX notepage_note_search_idx ON notepage_note USING GIN (search_vector)",
+]
+
+
+def _table_exists(conn, name):
+    return name in conn.introspection.table_names()
+
+
+def install(conn):
+    """Creates the search index and fills it from the existing notes."""
+    with conn.cursor() as cursor:
+        if conn.vendor == "sqlite":
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+                "title, content, content='notepage_note', content_rowid='id', tokenize='porter unicode61')"
+            )
+            # rank orders matches by bm25, lower is better; a title hit counts ten times a content hit
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rank) VALUES ('rank', 'bm25(10.0, 1.0)')")
+            for sql in SQLITE_TRIGGERS.values():
+                cursor.execute(sql)
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        elif conn.vendor == "postgresql":
+            for sql in POSTGRES_INSTALL:
+                cursor.execute(sql)
+
+
+def uninstall(conn):
+    with conn.cursor() as cursor:
+        if conn.vendor == "sqlite":
+            for name in SQLITE_TRIGGERS:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+        elif conn.vendor == "postgresql":
+            cursor.execute("ALTER TABLE notepage_note DROP COLUMN IF EXISTS search_vector")
+
+
+def restore_triggers(conn):
+    """
+    SQLite migrations that rebuild notepage_note drop its triggers with the
+    old table; puts them back and reindexes whatever changed meanwhile.
+    """
+    if conn.vendor != "sqlite" or not _table_exists(conn, FTS_TABLE):
+        return
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'notepage_note'")
+        missing = set(SQLITE_TRIGGERS) - {row[0] for row in cursor.fetchall()}
+        if not missing:
+            return
+        for name in missing:
+            cursor.execute(SQLITE_TRIGGERS[name])
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def search_terms(text):
+    return TERM.findall(text.lower())[:MAX_TERMS]
+
+
+def _highlight(snippet):
+    return mark_safe(escape(snippet or "").replace(START_MARK, "<mark>").replace(STOP_MARK, "</mark>"))
+
+
+def _sqlite_matches(user, terms, limit):
+    query = " ".join(f'"{term}"*' for term in terms)
+    with connection.cursor() as cursor:
+        # Ordering by rank lets FTS5 return matches best first instead of sorting them afterwards
+        cursor.execute(
+            f"SELECT {FTS_TABLE}.rowid, {FTS_TABLE}.rank, snippet({FTS_TABLE}, 1, %s, %s, '…', %s)"
+            f" FROM {FTS_TABLE} JOIN notepage_note ON notepage_note.id = {FTS_TABLE}.rowid"
+            f" WHERE {FTS_TABLE} MATCH %s AND notepage_note.user_id = %s"
+            f" ORDER BY {FTS_TABLE}.rank LIMIT %s",
+            [START_MARK, STOP_MARK, SNIPPET_TOKENS, query, user.pk, limit],
+        )
+        return cursor.fetchall()
+
+
+def _postgres_matches(user, terms, limit):
+    query = " & ".join(f"{term}:*" for term in terms)
+    options = f"StartSel={START_MARK}, StopSel={STOP_MARK}, MaxWords={SNIPPET_TOKENS}, MinWords=8"
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT id, ts_rank_cd(search_vector, query) AS score, ts_headline('english', content, query, %s)"
+            " FROM notepage_note, to_tsquery('english', %s) query"
+            " WHERE user_id = %s AND search_vector @@ query"
+            " ORDER BY score DESC LIMIT %s",
+            [options, query, user.pk, limit],
+        )
+        return cursor.fetchall()
+
+
+def search_notes(user, text, limit=RESULT_LIMIT):
+    """
+    The user's notes matching text, best first, as a list of Notes with
+    search_rank and search_snippet (safe HTML) set.
+    """
+    terms = search_terms(text)
+    if not terms:
+        return []
+    if connection.vendor == "sqlite":
+        matches = _sqlite_matches(user, terms, limit)
+    elif connection.vendor == "postgresql":
+        matches = _postgres_matches(user, terms, limit)
+    else:
+        notes = Note.objects.filter(user=user)
+        for term in terms:
+            notes = notes.filter(Q(title__icontains=term) | Q(content__icontains=term))
+        return list(notes.order_by('-updated_at')[:limit])
+    notes = Note.objects.in_bulk([pk for pk, _, _ in matches])
+    results = []
+    for pk, score, snippet in matches:
+        note = notes.get(pk)
+        if note is None:  # deleted since the match
+            continue
+        note.search_rank = score
+        note.search_snippet = _highlight(snippet)
+        results.append(note)
+    return results
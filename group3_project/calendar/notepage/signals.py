@@ -0,0 +1,20 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Note
+from .suggest import invalidate
+
+
+@receiver(post_save, sender=Note)
+@receiver(post_delete, sender=Note)
+def drop_suggestions_on_note_change(sender, instance, update_fields=None, **kwargs):
+    # Saves of other columns, like a new summary, leave the titles as they were
+    if update_fields is not None and 'title' not in update_fields:
+        return
+    invalidate(instance.user_id)
+
+
+@receiver(m2m_changed, sender=Note.tags.through)
+def drop_suggestions_on_tag_change(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear') and isinstance(instance, Note):
+        invalidate(instance.user_id)
@@ -0,0 +1,162 @@
+"""
+Title autocomplete and typo-tolerant matching for notes.
+
+Each user's note titles and tags are held in memory as a NoteIndex: a
+sorted list of word-start keys that a prefix finds by bisection, and a
+trigram index (each word padded as "  word ", like pg_trgm) for matching
+misspelled words. An index is built from one query the first time a
+user asks, then reused until one of their notes or tags changes.
+
+Indexes live in this process, the most recently used SUGGEST_CACHE_USERS
+of them. Changes bump the user's version in the default cache (see
+signals.py); with a cache shared between workers every process drops its
+copy at once, otherwise copies built by other workers are also dropped
+after SUGGEST_TTL seconds.
+"""
+import math
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+
+from django.core.cache import cache
+
+from .models import Note
+
+SUGGEST_CACHE_USERS = 256
+SUGGEST_TTL = 60  # seconds
+SUGGEST_LIMIT = 8
+# Share of the typed text's trigrams a title or tag must contain to count as a match
+SIMILARITY_THRESHOLD = 0.5
+# Shorter text has too few trigrams to tell a typo from a different word
+FUZZY_MIN_LENGTH = 3
+
+WORD = re.compile(r"\w+")
+
+_indexes = OrderedDict()
+_lock = threading.Lock()
+
+
+def normalize(text):
+    return " ".join(WORD.findall(text.casefold()))
+
+
+def trigrams(text):
+    grams = set()
+    for word in WORD.findall(text.casefold()):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class NoteIndex:
+    def __init__(self, notes):
+        """notes: (note id, title, tag names) for each of a user's notes."""
+        self.titles = {}
+        entries = set()
+        self._postings = {}
+        for note_id, title, tags in notes:
+            self.titles[note_id] = title
+            for kind, label in [("note", title)] + [("tag", tag) for tag in tags]:
+                words = normalize(label).split()
+                # Every word start, so "alg" finds "Sorting algorithms"
+                entries.update((" ".join(words[i:]), kind, label, note_id) for i in range(len(words)))
+                for gram in trigrams(label):
+                    self._postings.setdefault(gram, set()).add(note_id)
+        self._entries = sorted(entries)
+        self._keys = [entry[0] for entry in self._entries]
+
+    def complete(self, text, limit=SUGGEST_LIMIT):
+        """(kind, label, note id) for titles and tags with a word starting with text."""
+        prefix = normalize(text)
+        if not prefix:
+            return []
+        found = []
+        seen = set()
+        for position in range(bisect_left(self._keys, prefix), len(self._entries)):
+            key, kind, label, note_id = self._entries[position]
+            if not key.startswith(prefix) or len(found) == limit:
+                break
+            # A tag is suggested once however many notes carry it
+            if (kind, label if kind == "tag" else note_id) not in seen:
+                seen.add((kind, label if kind == "tag" else note_id))
+                found.append((kind, label, note_id))
+        return found
+
+    def similar(self, text, limit=SUGGEST_LIMIT):
+        """Ids of the notes whose title or tags best match text, typos allowed."""
+        if len(normalize(text)) < FUZZY_MIN_LENGTH:
+            return []
+        postings = [self._postings.get(gram, frozenset()) for gram in trigrams(text)]
+        postings.sort(key=len)
+        needed = math.ceil(SIMILARITY_THRESHOLD * len(postings))
+        # A note sharing `needed` trigrams shares at least one of the rarest len - needed + 1,
+        # so only those lists are read for candidates
+        candidates = set().union(*postings[:len(postings) - needed + 1])
+        shared = {note_id: sum(note_id in notes for notes in postings) for note_id in candidates}
+        matches = sorted(
+            (note_id for note_id, count in shared.items() if count >= needed),
+            key=lambda note_id: (-shared[note_id], self.titles[note_id].casefold()),
+        )
+        return matches[:limit]
+
+
+def _version_key(user_id):
+    return f"notes-suggest:{user_id}"
+
+
+def invalidate(user_id):
+    key = _version_key(user_id)
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:  # evicted between add and incr
+        cache.set(key, 1, None)
+    with _lock:
+        _indexes.pop(user_id, None)
+
+
+def _build(user_id):
+    notes = {}
+    for note_id, title, tag in Note.objects.filter(user_id=user_id).values_list("id", "title", "tags__name"):
+        notes.setdefault(note_id, (title, []))[1].extend([tag] if tag else [])
+    return NoteIndex((note_id, title, tags) for note_id, (title, tags) in notes.items())
+
+
+def note_index(user_id):
+    version = cache.get(_version_key(user_id), 0)
+    with _lock:
+        cached = _indexes.get(user_id)
+        if cached and cached[0] == version and time.monotonic() - cached[1] < SUGGEST_TTL:
+            _indexes.move_to_end(user_id)
+            return cached[2]
+    index = _build(user_id)
+    with _lock:
+        _indexes[user_id] = (version, time.monotonic(), index)
+        _indexes.move_to_end(user_id)
+        while len(_indexes) > SUGGEST_CACHE_USERS:
+            _indexes.popitem(last=False)
+    return index
+
+
+def suggest(user_id, text, limit=SUGGEST_LIMIT):
+    """Prefix matches first, then close matches for a possibly misspelled title."""
+    index = note_index(user_id)
+    found = index.complete(text, limit)
+    if len(found) == limit:
+        return found
+    listed = {note_id for kind, _, note_id in found if kind == "note"}
+    for note_id in index.similar(text, limit):
+        if len(found) == limit:
+            break
+        if note_id not in listed:
+            found.append(("note", index.titles[note_id], note_id))
+    return found
+
+
+def similar_notes(user, text, limit=SUGGEST_LIMIT):
+    """The user's notes closest to a misspelled search, best first."""
+    ids = note_index(user.pk).similar(text, limit)
+    notes = Note.objects.in_bulk(ids)
+    return [notes[note_id] for note_id in ids if note_id in notes]
@@ -7,6 +7,17 @@ from .forms import NoteForm
 from .forms import FileImportForm
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.contrib.auth.models import User
+from django.db import connection
+from home.tests_support.query_plans import QueryPlanAssertions, explain, plan_problems
+from .search import restore_triggers, search_notes
+from . import suggest
+from .rendering import render_key, render_markdown
+from . import preview
+import re
+from django.core.management import call_command
+import io
+from django.core.cache import cache
+from django.test.utils import CaptureQueriesContext
 
 
 class NoteTestCase(TestCase):
@@ -280,3 +291,441 @@ class MultiNoteQuizTests(TestCase):
         self.assertEqual(response.status_code, 500)
         self.assertIn('quiz', response.json())
         self.assertTrue(response.json()['quiz'].startswith("Error"))
+
+
+class ConditionalGetTestCase(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.login(username='testuser', password='testpass')
+        self.note = Note.objects.create(title="Cached note", content="Unchanged content", user=self.user)
+        self.note.tags.add("revisit")
+
+    def get(self, name, etag, **params):
+        return self.client.get(reverse(name, **params), HTTP_IF_NONE_MATCH=etag)
+
+    def test_note_content_answers_304_until_the_note_changes(self):
+        url_args = {'args': [self.note.pk]}
+        etag = self.client.get(reverse('get_note_content', **url_args))['ETag']
+        self.assertEqual(self.get('get_note_content', etag, **url_args).status_code, 304)
+
+        self.note.content = "Edited content"
+        self.note.save()
+        response = self.get('get_note_content', etag, **url_args)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['content'], "Edited content")
+
+    def test_missing_note_gets_no_etag(self):
+        response = self.client.get(reverse('get_note_content', args=[self.note.pk + 100]))
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_note_list_revalidates_without_rendering(self):
+        etag = self.client.get(reverse('note_list'))['ETag']
+        with patch('notepage.views.render') as render:
+            self.assertEqual(self.get('note_list', etag).status_code, 304)
+        render.assert_not_called()
+
+    def test_note_list_tag_changes_with_notes_tags_and_summaries(self):
+        etag = self.client.get(reverse('note_list'))['ETag']
+        self.note.tags.clear()
+        response = self.get('note_list', etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+        Note.objects.filter(pk=self.note.pk).update(summary="Short summary")
+        response = self.get('note_list', etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+        Note.objects.create(title="Another", content="More", user=self.user)
+        self.assertEqual(self.get('note_list', etag).status_code, 200)
+
+    def test_note_list_tag_depends_on_the_search(self):
+        etag = self.client.get(reverse('note_list'))['ETag']
+        response = self.client.get(reverse('note_list') + '?search=Cached', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class QueryPlanTestCase(QueryPlanAssertions, TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.login(username='testuser', password='testpass')
+        other = User.objects.create_user(username='otheruser')
+        for user in (self.user, other):
+            for n in range(20):
+                note = Note.objects.create(title=f"Note {n}", content=f"Content {n}", user=user)
+                note.tags.add(f"tag{n % 4}")
+
+    def test_note_list_is_indexed(self):
+        with self.assertIndexedQueries() as plans:
+            self.client.get(reverse('note_list'))
+            self.client.get(reverse('note_list') + '?search=Content')
+            self.client.get(reverse('note_list') + '?tag=tag1')
+        self.assertUsesIndex(plans, 'notepage_note', 'note_user_updated_idx')
+
+    def test_note_content_is_indexed(self):
+        note = Note.objects.filter(user=self.user).first()
+        with self.assertIndexedQueries():
+            self.client.get(reverse('get_note_content', args=[note.pk]))
+
+
+class NoteSearchTestCase(QueryPlanAssertions, TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.login(username='testuser', password='testpass')
+        self.title_hit = Note.objects.create(title="Sorting algorithms", content="Merge and quick sort.", user=self.user)
+        self.body_hit = Note.objects.create(
+            title="Week 3", content="We compared <b>algorithms</b> for graphs and ran them twice.", user=self.user
+        )
+        Note.objects.create(title="Groceries", content="Eggs and milk", user=self.user)
+        Note.objects.create(title="Algorithms", content="Someone else's", user=User.objects.create_user(username='other'))
+
+    def titles(self, text):
+        return [note.title for note in search_notes(self.user, text)]
+
+    def test_ranks_title_matches_first(self):
+        self.assertEqual(self.titles("algorithms"), ["Sorting algorithms", "Week 3"])
+
+    def test_matches_prefixes_and_word_forms(self):
+        self.assertEqual(self.titles("algo"), ["Sorting algorithms", "Week 3"])
+        self.assertEqual(self.titles("compare graph"), ["Week 3"])
+        self.assertEqual(self.titles("comparing"), ["Week 3"])
+        self.assertEqual(self.titles("graphs milk"), [])
+
+    def test_query_syntax_is_not_interpreted(self):
+        for text in ('"algo', 'algo AND', 'NEAR(', '*', 'title:eggs', '-'):
+            search_notes(self.user, text)
+        self.assertEqual(self.titles('"eggs" OR'), [])
+
+    def test_snippets_are_escaped_and_highlighted(self):
+        response = self.client.get(reverse('note_list') + '?search=algorithms')
+        self.assertContains(response, "&lt;b&gt;<mark>algorithms</mark>&lt;/b&gt;", html=False)
+        self.assertNotContains(response, "Someone else")
+
+    def test_index_follows_updates_and_deletes(self):
+        Note.objects.filter(pk=self.body_hit.pk).update(content="Nothing relevant")
+        self.assertEqual(self.titles("graphs"), [])
+        self.title_hit.title = "Sorting"
+        self.title_hit.save()
+        self.assertEqual(self.titles("sorting"), ["Sorting"])
+        self.title_hit.delete()
+        self.assertEqual(self.titles("sort"), [])
+
+    def test_missing_triggers_are_restored(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest("triggers are only used on SQLite")
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TRIGGER notepage_note_fts_update")
+        Note.objects.filter(pk=self.body_hit.pk).update(content="Dynamic programming")
+        restore_triggers(connection)
+        self.assertEqual(self.titles("dynamic"), ["Week 3"])
+        self.assertEqual(self.titles("graphs"), [])
+
+    def test_search_is_served_by_the_index(self):
+        with self.assertIndexedQueries() as plans:
+            self.client.get(reverse('note_list') + '?search=algorithms')
+        self.assertUsesIndex(plans, 'notepage_note', 'INTEGER')
+        self.assertTrue(any('notepage_note_fts VIRTUAL TABLE' in step for _, plan in plans for step in plan))
+        self.assertTrue(plan_problems(explain("SELECT rowid FROM notepage_note_fts")))
+
+
+class NoteSuggestTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        suggest._indexes.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.login(username='testuser', password='testpass')
+        self.sorting = Note.objects.create(title="Sorting algorithms", content="Merge sort", user=self.user)
+        self.sorting.tags.add("algebra-review")
+        self.graphs = Note.objects.create(title="Graph algorithms", content="BFS", user=self.user)
+        self.graphs.tags.add("algebra-review")
+        Note.objects.create(
+            title="Algebra homework", content="Someone else's", user=User.objects.create_user(username='other')
+        )
+
+    def labels(self, text):
+        return [item['label'] for item in self.client.get(reverse('suggest_notes'), {'q': text}).json()['suggestions']]
+
+    def test_trigrams_are_padded_per_word(self):
+        self.assertEqual(suggest.trigrams("Ab c"), {"  a", " ab", "ab ", "  c", " c "})
+
+    def test_completes_word_starts_in_titles_and_tags(self):
+        self.assertEqual(self.labels("alg"), ["algebra-review", "Graph algorithms", "Sorting algorithms"])
+        self.assertEqual(self.labels("sorting al"), ["Sorting algorithms"])
+        self.assertEqual(self.labels("  "), [])
+        response = self.client.get(reverse('suggest_notes'), {'q': 'algebra'})
+        self.assertEqual(response.json()['suggestions'][0]['url'], reverse('note_list') + '?tag=algebra-review')
+
+    def test_tolerates_typos(self):
+        self.assertEqual(self.labels("sortnig"), ["Sorting algorithms"])
+        self.assertEqual(self.labels("grpah algoritms"), ["Graph algorithms", "Sorting algorithms"])
+        self.assertEqual(self.labels("xyz"), [])
+
+    def test_cached_lookups_do_not_query_notes(self):
+        self.labels("alg")
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(len(self.labels("sor")), 1)
+        self.assertFalse([q for q in queries.captured_queries if 'notepage_note' in q['sql']])
+
+    def test_changes_to_titles_and_tags_are_seen(self):
+        self.labels("alg")
+        self.sorting.title = "Searching"
+        self.sorting.save()
+        self.assertEqual(self.labels("sea"), ["Searching"])
+        self.graphs.tags.add("bfs")
+        self.assertEqual(self.labels("bf"), ["bfs"])
+        self.graphs.delete()
+        self.assertEqual(self.labels("gra"), [])
+
+    def test_summary_saves_keep_the_index(self):
+        self.labels("alg")
+        index = suggest._indexes[self.user.pk][2]
+        self.sorting.summary = "About sorting"
+        self.sorting.save(update_fields=['summary'])
+        self.labels("alg")
+        self.assertIs(suggest._indexes[self.user.pk][2], index)
+
+    def test_search_falls_back_to_close_matches(self):
+        response = self.client.get(reverse('note_list') + '?search=sortnig')
+        self.assertContains(response, "Showing the closest titles and tags")
+        self.assertContains(response, "Sorting algorithms")
+        self.assertNotContains(response, "Graph algorithms")
+
+
+class NoteRenderingTestCase(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.login(username='testuser', password='testpass')
+        self.note = Note.objects.create(
+            title="Code", content="# Heading\n\n```python\nprint('hi')\n```", user=self.user
+        )
+
+    def test_html_is_stored_on_save(self):
+        self.assertIn("<h1>Heading</h1>", self.note.content_html)
+        self.assertIn('class="codehilite"', self.note.content_html)
+        self.assertEqual(self.note.content_html_key, render_key(self.note.content))
+
+    def test_detail_view_does_not_render(self):
+        with patch('notepage.models.render_markdown') as render:
+            response = self.client.get(reverse('note_detail', args=[self.note.pk]))
+        render.assert_not_called()
+        self.assertContains(response, "<h1>Heading</h1>", html=False)
+
+    def test_content_changes_render_again(self):
+        self.note.content = "*changed*"
+        self.note.save(update_fields=['content'])
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.content_html, "<p><em>changed</em></p>")
+        with patch('notepage.models.render_markdown') as render:
+            self.note.title = "Renamed"
+            self.note.save()
+        render.assert_not_called()
+
+    def test_renderer_upgrade_renders_on_first_view(self):
+        with patch('notepage.rendering.RENDERER_VERSION', 2):
+            note = Note.objects.get(pk=self.note.pk)
+            self.assertIn("<h1>Heading</h1>", note.get_html_content())
+            with patch('notepage.models.render_markdown') as render:
+                Note.objects.get(pk=self.note.pk).get_html_content()
+            render.assert_not_called()
+
+    def test_render_notes_command_updates_stale_notes(self):
+        Note.objects.filter(pk=self.note.pk).update(content_html='', content_html_key='')
+        Note.objects.create(title="Plain", content="text", user=self.user)
+        updated_at = Note.objects.get(pk=self.note.pk).updated_at
+        out = io.StringIO()
+        call_command('render_notes', stdout=out)
+        self.assertIn("Rendered 1 of 2", out.getvalue())
+        note = Note.objects.get(pk=self.note.pk)
+        self.assertIn("<h1>Heading</h1>", note.content_html)
+        self.assertEqual(note.updated_at, updated_at)
+
+        with patch('notepage.rendering.RENDERER_VERSION', 2):
+            call_command('render_notes', stdout=out)
+            self.assertIn("Rendered 2 of 2", out.getvalue())
+            call_command('render_notes', '--batch-size', '1', stdout=out)
+            self.assertIn("Rendered 0 of 2", out.getvalue())
+
+
+PREVIEW_DOCUMENT = """# Title
+
+Some *text* with a [link][ref] and an HTML abbreviation.
+
+- one
+- two
+
+- three, after a blank line
+
+    continued paragraph
+
+> quote one
+
+> quote two
+
+```python
+def f():
+
+    return 1
+```
+
+| a | b |
+|---|---|
+| 1 | 2 |
+
+Term
+: definition
+
+[ref]: https://example.com
+*[HTML]: Hyper Text Markup Language
+"""
+
+
+class NotePreviewTestCase(TestCase):
+
+    def setUp(self):
+        preview._blocks.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.login(username='testuser', password='testpass')
+
+    def post(self, content, known=()):
+        return self.client.post(
+            reverse('preview_note'), json.dumps({'content': content, 'known': list(known)}), content_type='application/json'
+        )
+
+    def squash(self, html):
+        return re.sub(r">\s+<", "><", html)
+
+    def test_blocks_keep_multi_paragraph_constructs_together(self):
+        blocks = preview.split_blocks(PREVIEW_DOCUMENT)
+        self.assertEqual(blocks[0], "# Title")
+        self.assertTrue(blocks[2].startswith("- one") and blocks[2].endswith("    continued paragraph"))
+        self.assertEqual(blocks[3], "> quote one\n\n> quote two")
+        self.assertIn("\n\n    return 1\n```", blocks[4])
+        self.assertEqual(blocks[6], "Term\n: definition")
+
+    def test_blocks_render_like_the_whole_document(self):
+        keys, html = preview.render_blocks(PREVIEW_DOCUMENT)
+        self.assertEqual(
+            self.squash("".join(html[key] for key in keys)), self.squash(render_markdown(PREVIEW_DOCUMENT))
+        )
+        self.assertIn('<a href="https://example.com">link</a>', html[keys[1]])
+        self.assertIn('<abbr title="Hyper Text Markup Language">HTML</abbr>', html[keys[1]])
+
+    def test_an_edit_renders_only_its_block(self):
+        keys, _ = preview.render_blocks(PREVIEW_DOCUMENT)
+        edited = PREVIEW_DOCUMENT.replace("quote two", "quote 2")
+        with patch('notepage.preview.render_markdown', wraps=render_markdown) as render:
+            new_keys, html = preview.render_blocks(edited, known=keys)
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual([key for key in new_keys if key not in keys], list(html))
+        self.assertIn("quote 2", html[new_keys[3]])
+
+    def test_definitions_are_part_of_every_key(self):
+        keys, _ = preview.render_blocks(PREVIEW_DOCUMENT)
+        new_keys, html = preview.render_blocks(PREVIEW_DOCUMENT.replace("https://example.com", "https://example.org"))
+        self.assertFalse(set(keys) & set(new_keys))
+        self.assertIn("https://example.org", html[new_keys[1]])
+
+    def test_footnotes_and_raw_html_render_as_one_block(self):
+        for text in ("Text[^1]\n\n[^1]: Note", "<div>\n\ninside\n\n</div>"):
+            keys, html = preview.render_blocks(text)
+            self.assertEqual(len(keys), 1)
+            self.assertEqual(html[keys[0]], render_markdown(text))
+
+    def test_endpoint_returns_a_patch(self):
+        data = self.post(PREVIEW_DOCUMENT).json()
+        self.assertEqual(len(data['blocks']), 8)
+        self.assertEqual(set(data['html']), set(data['blocks']))
+        data = self.post(PREVIEW_DOCUMENT + "\nNew paragraph\n", known=data['blocks']).json()
+        self.assertEqual(list(data['html'].values()), ["<p>New paragraph</p>"])
+
+    def test_endpoint_rejects_bad_requests(self):
+        self.assertEqual(self.client.get(reverse('preview_note')).status_code, 405)
+        self.assertEqual(
+            self.client.post(reverse('preview_note'), "nope", content_type='application/json').status_code, 400
+        )
+        self.assertEqual(self.post("x" * (preview.MAX_PREVIEW_CHARS + 1)).status_code, 400)
+        self.client.logout()
+        self.assertEqual(self.post("text").status_code, 302)
+
+
+class NoteChangeTrackingTestCase(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.login(username='testuser', password='testpass')
+        self.note = Note.objects.create(title="Draft", content="First words", user=self.user, summary="Old summary")
+        Note.objects.filter(pk=self.note.pk).update(summary="Old summary")
+
+    def autosave(self, **changes):
+        data = {'note_id': self.note.pk, 'title': "Draft", 'content': "First words", **changes}
+        return self.client.post(reverse('autosave_note'), json.dumps(data), content_type='application/json')
+
+    def note_queries(self, queries):
+        return [q['sql'] for q in queries.captured_queries if 'notepage_note' in q['sql']]
+
+    def test_autosave_reads_the_note_once_and_writes_what_changed(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(self.autosave(content="First words, then more").json()['success'])
+        reads, write = self.note_queries(queries)
+        self.assertTrue(reads.startswith('SELECT'))
+        self.assertTrue(write.startswith('UPDATE'))
+        for column in ('"content"', '"content_html"', '"summary"', '"updated_at"'):
+            self.assertIn(column, write)
+        self.assertNotIn('"title"', write)
+        self.assertEqual(len(queries), 4)  # session, user, note, update
+        note = Note.objects.get(pk=self.note.pk)
+        self.assertIsNone(note.summary)
+        self.assertIn("then more", note.content_html)
+
+    def test_unchanged_autosave_only_touches_updated_at(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.autosave()
+        write = self.note_queries(queries)[-1]
+        self.assertRegex(write, r'^UPDATE "notepage_note" SET "updated_at" = [^,]+ WHERE')
+        self.assertEqual(Note.objects.get(pk=self.note.pk).summary, "Old summary")
+
+    def test_autosave_cannot_write_other_users_notes(self):
+        other = Note.objects.create(title="Theirs", content="Private", user=User.objects.create_user(username='other'))
+        data = {'note_id': other.pk, 'title': "Mine now", 'content': "Overwritten"}
+        response = self.client.post(reverse('autosave_note'), json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(Note.objects.get(pk=other.pk).content, "Private")
+
+    def test_changed_fields_follow_reads_and_saves(self):
+        note = Note.objects.get(pk=self.note.pk)
+        self.assertEqual(note.changed_fields(), set())
+        note.title = "Final"
+        self.assertEqual(note.changed_fields(), {'title'})
+        note.save()
+        self.assertEqual(note.changed_fields(), set())
+        self.assertIsNone(Note(title="New").changed_fields())
+
+    def test_deferred_content_is_tracked(self):
+        note = Note.objects.only('title').get(pk=self.note.pk)
+        note.content = "Rewritten"
+        note.save()
+        note = Note.objects.get(pk=self.note.pk)
+        self.assertEqual(note.content, "Rewritten")
+        self.assertIsNone(note.summary)
+
+    def test_notes_built_with_a_pk_compare_with_the_database(self):
+        note = Note(pk=self.note.pk, title="Draft", content="First words", user=self.user, summary="Old summary",
+                    created_at=self.note.created_at)
+        note.save()
+        self.assertEqual(Note.objects.get(pk=self.note.pk).summary, "Old summary")
+        note.content = "Other words"
+        note.save()
+        self.assertIsNone(Note.objects.get(pk=self.note.pk).summary)
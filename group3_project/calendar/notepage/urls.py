@@ -12,6 +12,8 @@ urlpatterns = [
     path('import/', views.import_file, name='import_file'),
     path('api/notes/<int:pk>/content/', views.get_note_content, name='get_note_content'),
     path('api/summarize/', views.summarize_note, name='summarize_note'),
+    path('api/suggest/', views.suggest_notes, name='suggest_notes'),
+    path('api/preview/', views.preview_note, name='preview_note'),
     path('quiz/', views.multi_note_quiz_page, name='multi_note_quiz_page'),
     path('api/generate_multi_note_quiz/', views.generate_multi_note_quiz, name='generate_multi_note_quiz'),
 ]
@@ -1,9 +1,14 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.http import JsonResponse
-from django.db.models import Q
+from django.db.models import Count, Max, Q
 from .models import Note
 from .forms import NoteForm
 from .forms import FileImportForm
+from .preview import MAX_PREVIEW_CHARS, render_blocks
+from .search import search_notes
+from .suggest import similar_notes, suggest
+from django.urls import reverse
+from urllib.parse import urlencode
 from taggit.models import Tag
 import json
 from openai import OpenAI
@@ -11,10 +16,25 @@ import os
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
 import docx
+from home.conditional import page_etag, revalidated, user_etag
+
+
+def _note_list_etag(request):
+    if not request.user.is_authenticated:
+        return None
+    # The list shows each note's summary and tags; neither change touches updated_at
+    stamps = Note.objects.filter(user=request.user).aggregate(
+        notes=Count('id', distinct=True),
+        updated=Max('updated_at'),
+        summaries=Count('id', distinct=True, filter=Q(summary__isnull=False)),
+        tags=Count('tags'),
+    )
+    return page_etag(request, *stamps.values(), request.GET.get('search', ''), request.GET.get('tag', ''))
 
 
 @csrf_exempt
 @login_required
+@revalidated(_note_list_etag)
 def note_list(request):
 
     user_notes = Note.objects.filter(user=request.user)
@@ -22,16 +42,51 @@ def note_list(request):
     search_query = request.GET.get('search', '')
     tag_query = request.GET.get('tag', '')
 
+    close_matches = False
     if search_query:
-        notes = Note.objects.filter(user=request.user).filter(
-            Q(title__icontains=search_query) | Q(content__icontains=search_query)
-        ).order_by('-updated_at')
+        notes = search_notes(request.user, search_query)
+        if not notes:
+            # Probably misspelled; show the titles and tags it is closest to
+            notes = similar_notes(request.user, search_query)
+            close_matches = bool(notes)
     elif tag_query:
         notes = Note.objects.filter(user=request.user).filter(tags__name__in=[tag_query]).order_by('-updated_at')
     else:
         notes = Note.objects.filter(user=request.user).order_by('-updated_at')
 
-    return render(request, 'notepage/note_list.html', {'notes': notes, 'tags': tags})
+    return render(request, 'notepage/note_list.html', {
+        'notes': notes, 'tags': tags, 'search_query': search_query, 'close_matches': close_matches
+    })
+
+
+@login_required
+def preview_note(request):
+    # The editor sends the whole document and the block keys it already shows; see notepage.preview
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST the note content'}, status=405)
+    try:
+        data = json.loads(request.body)
+        content = data.get('content', '')
+        known = set(data.get('known', []))
+    except (ValueError, AttributeError, TypeError):
+        return JsonResponse({'error': 'Send JSON with content and known'}, status=400)
+    if not isinstance(content, str) or len(content) > MAX_PREVIEW_CHARS:
+        return JsonResponse({'error': 'Content is missing or too long to preview'}, status=400)
+    keys, html = render_blocks(content, known)
+    return JsonResponse({'blocks': keys, 'html': html})
+
+
+@login_required
+def suggest_notes(request):
+    # Answered from an in-memory index, see notepage.suggest; called on each keystroke
+    suggestions = []
+    for kind, label, note_id in suggest(request.user.pk, request.GET.get('q', '')):
+        if kind == 'tag':
+            url = reverse('note_list') + '?' + urlencode({'tag': label})
+        else:
+            url = reverse('note_detail', args=[note_id])
+        suggestions.append({'kind': kind, 'label': label, 'url': url})
+    return JsonResponse({'suggestions': suggestions})
 
 
 @csrf_exempt
@@ -108,10 +163,10 @@ def autosave_note(request):
         content = data.get('content')
 
         if note_id:
-            note = get_object_or_404(Note, pk=note_id)
+            note = get_object_or_404(Note, pk=note_id, user=request.user)
             note.title = title
             note.content = content
-            note.user = request.user
+            # Writes only the columns this autosave changed; see Note.changed_fields
             note.save()
             return JsonResponse({
                 'success': True,
@@ -199,7 +254,15 @@ def import_file(request):
     return render(request, 'notepage/import_file.html', {'form': form})
 
 
+def _note_content_etag(request, pk):
+    if not request.user.is_authenticated:
+        return None
+    updated = Note.objects.filter(user=request.user, pk=pk).values_list('updated_at', flat=True).first()
+    return user_etag(request, pk, updated.isoformat()) if updated else None
+
+
 @csrf_exempt
+@revalidated(_note_content_etag)
 def get_note_content(request, pk):
 
     try:
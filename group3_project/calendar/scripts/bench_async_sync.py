@@ -0,0 +1,131 @@
+"""
+Compares threaded and asyncio Canvas syncs under concurrent load.
+
+Syncs --users fresh users against the local fake Canvas, --concurrency at
+a time, first with the httpx client on a single event loop and then with
+the threaded client (one request thread pool per sync). The async run goes
+first so the threaded client's long-lived pools are not counted against it.
+Both write to the same throwaway SQLite file database. Reports wall time,
+users per second, Canvas requests sent and the most client threads
+alive during each run.
+
+    python scripts/bench_async_sync.py --users 40 --concurrency 20 --latency 0.1
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "calendar_app.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.db import close_old_connections, connection  # noqa: E402
+from django.test.utils import override_settings, setup_test_environment  # noqa: E402
+
+from home.async_canvas import http2_available, loop_client  # noqa: E402
+from home.canvas import client_metrics  # noqa: E402
+from home.tests_support.fake_canvas import FakeCanvas  # noqa: E402
+from home.sync import async_sync_canvas, sync_canvas  # noqa: E402
+
+
+class ThreadPeak:
+    def __init__(self):
+        self.peak = self.client_threads()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+
+    @staticmethod
+    def client_threads():
+        # The fake Canvas serves each connection on a thread of its own; leave those out
+        return sum("process_request_thread" not in t.name for t in threading.enumerate())
+
+    def _watch(self):
+        while not self._done.wait(0.01):
+            self.peak = max(self.peak, self.client_threads())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._done.set()
+        self._thread.join()
+
+
+def run_threaded(users, canvas_url, concurrency):
+    def sync(user):
+        try:
+            return sync_canvas(user, canvas_url, f"bench-{user.pk}")
+        finally:
+            close_old_connections()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(sync, users))
+
+
+async def run_async(users, canvas_url, concurrency):
+    gate = asyncio.Semaphore(concurrency)
+
+    async def sync(user):
+        async with gate:
+            return await async_sync_canvas(user, canvas_url, f"bench-{user.pk}")
+
+    # One client for the whole run, so syncs that do not overlap still share its pool
+    async with loop_client():
+        return await asyncio.gather(*(sync(user) for user in users))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=20, help="Syncs in flight at once.")
+    parser.add_argument("--courses", type=int, default=5)
+    parser.add_argument("--assignments", type=int, default=20)
+    parser.add_argument("--modules", type=int, default=6)
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--per-host-limit", type=int, default=8, help="Overrides CANVAS_PER_HOST_LIMIT.")
+    args = parser.parse_args()
+
+    setup_test_environment()
+    # Threads need a database file they can all open; the default test database is in memory
+    db_dir = tempfile.mkdtemp()
+    connection.settings_dict["TEST"]["NAME"] = os.path.join(db_dir, "bench.sqlite3")
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        with override_settings(CANVAS_HTTP_CACHE_PATH=None, CANVAS_PER_HOST_LIMIT=args.per_host_limit), FakeCanvas(
+            courses=args.courses, assignments=args.assignments, modules=args.modules, latency=args.latency
+        ) as canvas:
+            print(f"{args.users} users, {args.concurrency} at a time, {args.latency * 1000:.0f}ms latency, "
+                  f"{args.per_host_limit} requests per host, HTTP/2 {'available' if http2_available() else 'unavailable'}")
+            for name in ("async", "threaded"):
+                users = [User.objects.create_user(username=f"bench-{name}-{n}") for n in range(args.users)]
+                canvas.reset_log()
+                before = client_metrics()
+                start = time.perf_counter()
+                with ThreadPeak() as threads:
+                    if name == "threaded":
+                        results = run_threaded(users, canvas.url, args.concurrency)
+                    else:
+                        results = asyncio.run(run_async(users, canvas.url, args.concurrency))
+                elapsed = time.perf_counter() - start
+                after = client_metrics()
+                failed = sum(counts is None for counts in results)
+                print(f"{name:>9}: {elapsed:.2f}s, {args.users / elapsed:.1f} users/s, "
+                      f"{after['requests'] - before['requests']} requests "
+                      f"({after['hedged'] - before['hedged']} hedged), "
+                      f"peak {threads.peak} client threads, {failed} failed")
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == "__main__":
+    main()
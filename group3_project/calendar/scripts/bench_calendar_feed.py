@@ -0,0 +1,139 @@
+"""
+Measures the calendar's events feed for a user with a long history.
+
+Fills a throwaway test database with --events events spread over --years
+years, then compares what the calendar page used to embed (every event,
+descriptions stripped of tags on each load) with one visible month from
+the calendar/events.json feed, built fresh and served from the calendar
+cache, and prints the feed query's plan. Then times the same history as
+an .ics subscription: rendered, from the cache, and answered 304.
+
+    python scripts/bench_calendar_feed.py --events 12000 --years 4
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "calendar_app.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.contrib.auth.models import User  # noqa: E402
+from django.core.cache import cache  # noqa: E402
+from django.core.serializers.json import DjangoJSONEncoder  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.db.models import F  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+from django.urls import reverse  # noqa: E402
+from django.utils.html import strip_tags  # noqa: E402
+
+from home.models import Course, Event  # noqa: E402
+from home.sanitize import render_description  # noqa: E402
+
+DESCRIPTION = "<div>" + "".join(
+    f"<p>Part {i}: read <a href='https://canvas.example/files/{i}'>section {i}</a> and answer the questions.</p>"
+    for i in range(20)
+) + "</div>"
+
+
+def best_of(rounds, fn):
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=12000)
+    parser.add_argument("--years", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    settings.ALLOWED_HOSTS = ["*"]
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        user = User.objects.create_user(username="historian")
+        courses = Course.objects.bulk_create(Course(user=user, name=f"Course {n}") for n in range(6))
+        html, text = render_description(DESCRIPTION)
+        first = datetime(datetime.now().year - args.years + 1, 1, 1, tzinfo=timezone.utc)
+        span = timedelta(days=365 * args.years)
+        Event.objects.bulk_create((
+            Event(user=user, title=f"Assignment {n}", description=DESCRIPTION, description_html=html,
+                  description_excerpt=text, due_date=first + span * n / args.events,
+                  event_type="assignment", course=courses[n % 6])
+            for n in range(args.events)
+        ), batch_size=1000)
+
+        def embedded():
+            events = list(Event.objects.filter(user=user).values(
+                "title", "description", "event_type", "due_date", "custom", course_name=F("course__name")
+            ))
+            for ev in events:
+                ev["description"] = strip_tags(ev["description"] or "")
+            return json.dumps(events, cls=DjangoJSONEncoder).encode()
+
+        client = Client()
+        client.force_login(user)
+        month = datetime(datetime.now().year, 3, 1, tzinfo=timezone.utc)
+        window = {"start": (month - timedelta(days=7)).isoformat(), "end": (month + timedelta(days=35)).isoformat()}
+
+        def cached_feed():
+            response = client.get(reverse("calendar_events"), window)
+            assert response.status_code == 200, response.status_code
+            return response.content
+
+        def feed():
+            cache.clear()
+            return cached_feed()
+
+        print(f"{args.events} events over {args.years} years, {len(DESCRIPTION)} byte descriptions")
+        for name, fn in (("embedded", embedded), ("feed", feed), ("cached", cached_feed)):
+            elapsed, body = best_of(args.rounds, fn)
+            print(f"{name:>9}: {len(json.loads(body))} events, {len(body) / 1024:.1f} KiB, best {elapsed * 1000:.1f} ms")
+
+        ics_url = reverse("calendar_ics", args=[user.userprofile.reset_ics_token()])
+        etag = None
+
+        def ics():
+            nonlocal etag
+            response = Client().get(ics_url)
+            etag = response["ETag"]
+            return b"".join(response.streaming_content)
+
+        def fresh_ics():
+            cache.clear()
+            return ics()
+
+        def revalidated_ics():
+            response = Client().get(ics_url, HTTP_IF_NONE_MATCH=etag)
+            assert response.status_code == 304, response.status_code
+            return b""
+
+        for name, fn in (("ics", fresh_ics), ("cached", ics), ("304", revalidated_ics)):
+            elapsed, body = best_of(args.rounds, fn)
+            print(f"{name:>9}: {body.count(b'BEGIN:VEVENT')} events, {len(body) / 1024:.1f} KiB, "
+                  f"best {elapsed * 1000:.1f} ms")
+
+        plan = Event.objects.filter(
+            user=user, due_date__gte=window["start"], due_date__lt=window["end"]
+        ).explain()
+        print(f"feed query plan: {plan}")
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Compares the old serial Canvas fetch loop against home.canvas.fetch_all.
+
+Runs against the local fake Canvas with injected latency, so the numbers only
+reflect round-trip overlap, not Canvas itself.
+
+    python scripts/bench_canvas_fetch.py --courses 7 --modules 12 --latency 0.05
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "calendar_app.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from home.canvas import fetch_all, fetch_json  # noqa: E402
+from home.tests_support.fake_canvas import FakeCanvas  # noqa: E402
+
+
+def serial_sync(base, headers):
+    courses = fetch_json(f"{base}/api/v1/courses?enrollment_state=active&per_page=100", headers)
+    jobs = []
+    for c in courses:
+        fetch_json(f"{base}/api/v1/courses/{c['id']}/assignments?per_page=100", headers)
+        for m in fetch_json(f"{base}/api/v1/courses/{c['id']}/modules?per_page=100", headers):
+            jobs.append((c["id"], m["id"]))
+    for cid, mid in jobs:
+        fetch_json(f"{base}/api/v1/courses/{cid}/modules/{mid}/items", headers)
+
+
+def concurrent_sync(base, headers):
+    courses = fetch_json(f"{base}/api/v1/courses?enrollment_state=active&per_page=100", headers)
+    urls = []
+    for c in courses:
+        urls.append(f"{base}/api/v1/courses/{c['id']}/assignments?per_page=100")
+        urls.append(f"{base}/api/v1/courses/{c['id']}/modules?per_page=100")
+    results = fetch_all(fetch_json, urls, headers, default=[])
+    jobs = [(c["id"], m["id"]) for i, c in enumerate(courses) for m in results[2 * i + 1]]
+    fetch_all(fetch_json, [f"{base}/api/v1/courses/{cid}/modules/{mid}/items" for cid, mid in jobs], headers)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--courses", type=int, default=7)
+    parser.add_argument("--modules", type=int, default=12)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    headers = {"Authorization": "Bearer bench"}
+    with FakeCanvas(courses=args.courses, modules=args.modules, latency=args.latency) as canvas:
+        for name, fn in (("serial", serial_sync), ("concurrent", concurrent_sync)):
+            best = None
+            for _ in range(args.rounds):
+                canvas.reset_log()
+                start = time.perf_counter()
+                fn(canvas.url, headers)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            print(f"{name:>10}: {len(canvas.requests)} requests, best {best:.3f}s, "
+                  f"peak in-flight {canvas.max_in_flight}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Measures showing a long, code-heavy note.
+
+Fills a throwaway test database with one note of --pages pages, each a
+few paragraphs, a list and a highlighted code block, then times rendering
+its Markdown against the note detail page as it renders every view and
+as it reads the stored HTML. Then times the editor's preview endpoint for
+a one-word edit in the middle of the note, with the other blocks cached,
+next to rendering the whole document again.
+
+    python scripts/bench_note_render.py --pages 20
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "calendar_app.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.contrib.auth.models import User  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+from django.urls import reverse  # noqa: E402
+
+from notepage.models import Note  # noqa: E402
+from notepage.preview import render_blocks  # noqa: E402
+from notepage.rendering import render_markdown  # noqa: E402
+
+PAGE = """## Lecture {n}
+
+Today we covered **dynamic programming** and _memoization_, with a worked
+example and a proof sketch. See the [course notes](https://example.edu/{n}) for more.
+
+- overlapping subproblems
+- optimal substructure
+- table filled bottom up
+
+```python
+def fib(n, memo={{}}):
+    if n < 2:
+        return n
+    if n not in memo:
+        memo[n] = fib(n - 1, memo) + fib(n - 2, memo)
+    return memo[n]
+```
+
+| n | fib(n) |
+|---|--------|
+| 10 | 55 |
+| 20 | 6765 |
+"""
+
+
+def document(pages):
+    return "\n".join(PAGE.format(n=n) for n in range(pages))
+
+
+def best_of(rounds, fn):
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    settings.ALLOWED_HOSTS = ["*"]
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        user = User.objects.create_user(username="writer")
+        content = document(args.pages)
+        note = Note.objects.create(user=user, title="Algorithms", content=content)
+        client = Client()
+        client.force_login(user)
+        url = reverse("note_detail", args=[note.pk])
+
+        def detail():
+            response = client.get(url)
+            assert response.status_code == 200, response.status_code
+            return response.content
+
+        def rendering_detail():
+            Note.objects.filter(pk=note.pk).update(content_html_key="")
+            return detail()
+
+        print(f"{args.pages} pages, {len(content) / 1024:.1f} KiB of Markdown")
+        for name, fn in (
+            ("render", lambda: render_markdown(content).encode()),
+            ("view+render", rendering_detail),
+            ("view stored", detail),
+        ):
+            elapsed, body = best_of(args.rounds, fn)
+            print(f"{name:>12}: {len(body) / 1024:.1f} KiB, best {elapsed * 1000:.1f} ms")
+
+        keys, _ = render_blocks(content)
+        middle = content.index(f"## Lecture {args.pages // 2}")
+        edits = iter(range(10 ** 9))
+
+        def edited():
+            # A different word each round so the edited block is never cached
+            return content[:middle] + f"## Lecture {next(edits)} (edited)" + content[content.index("\n", middle):]
+
+        def preview():
+            response = client.post(
+                reverse("preview_note"), json.dumps({"content": edited(), "known": keys}), content_type="application/json"
+            )
+            assert response.status_code == 200, response.status_code
+            return response.content
+
+        for name, fn in (("full render", lambda: render_markdown(edited()).encode()), ("preview", preview)):
+            elapsed, body = best_of(args.rounds, fn)
+            print(f"{name:>12}: {len(body) / 1024:.1f} KiB, best {elapsed * 1000:.1f} ms")
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == "__main__":
+    main()
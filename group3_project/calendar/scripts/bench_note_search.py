@@ -0,0 +1,121 @@
+"""
+Measures note search for a user with a lot of notes.
+
+Fills a throwaway test database with --notes notes of generated lecture
+text, then times the icontains scan note_list used to run against the
+full-text index in notepage.search for a few queries, and prints both
+query plans. Then times autocomplete (notepage.suggest): building the
+user's index once and each keystroke of a few typed words, with a typo.
+
+    python scripts/bench_note_search.py --notes 50000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "calendar_app.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.db.models import Q  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+
+from home.tests_support.query_plans import explain  # noqa: E402
+from notepage.models import Note  # noqa: E402
+from notepage.search import search_notes  # noqa: E402
+from notepage.suggest import invalidate, suggest  # noqa: E402
+
+WORDS = (
+    "graph tree heap stack queue array hash table pointer recursion proof lemma theorem matrix vector "
+    "integral derivative limit series entropy enzyme protein cell membrane market demand supply essay "
+    "thesis citation source argument lecture review exam quiz homework reading chapter section figure"
+).split()
+QUERIES = ("dijkstra", "recursion", "hash table", "lem")
+
+
+def paragraph(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def best_of(rounds, fn):
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--notes", type=int, default=50000)
+    parser.add_argument("--words", type=int, default=300, help="words per note")
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        rng = random.Random(4300)
+        user = User.objects.create_user(username="scribe")
+        # A rare word so one query has few matches
+        rare = set(rng.sample(range(args.notes), 25))
+        start = time.perf_counter()
+        Note.objects.bulk_create((
+            Note(user=user, title=f"Lecture {n}: {paragraph(rng, 3)}",
+                 content=paragraph(rng, args.words) + (" dijkstra" if n in rare else ""))
+            for n in range(args.notes)
+        ), batch_size=1000)
+        print(f"{args.notes} notes of {args.words} words, inserted and indexed in "
+              f"{time.perf_counter() - start:.1f} s")
+
+        def scan(text):
+            return list(Note.objects.filter(user=user).filter(
+                Q(title__icontains=text) | Q(content__icontains=text)
+            ).order_by("-updated_at"))
+
+        for text in QUERIES:
+            scan_time, scanned = best_of(args.rounds, lambda: scan(text))
+            index_time, found = best_of(args.rounds, lambda: search_notes(user, text))
+            print(f"{text!r:>13}: icontains {len(scanned):>5} notes in {scan_time * 1000:8.1f} ms, "
+                  f"index top {len(found):>3} of ranked matches in {index_time * 1000:6.1f} ms")
+
+        scan_sql = Note.objects.filter(user=user).filter(
+            Q(title__icontains="x") | Q(content__icontains="x")
+        ).order_by("-updated_at").query.sql_with_params()
+        print(f"icontains plan: {explain(*scan_sql)}")
+        if connection.vendor == "sqlite":
+            print("index plan: " + str(explain(
+                "SELECT notepage_note_fts.rowid FROM notepage_note_fts"
+                " JOIN notepage_note ON notepage_note.id = notepage_note_fts.rowid"
+                " WHERE notepage_note_fts MATCH %s AND notepage_note.user_id = %s ORDER BY notepage_note_fts.rank",
+                ['"x"*', user.pk],
+            )))
+
+        def build():
+            invalidate(user.pk)
+            return suggest(user.pk, "l")
+
+        build_time, _ = best_of(args.rounds, build)
+        print(f"suggest index built in {build_time * 1000:.1f} ms")
+        for typed in ("lecture 12", "heap sta", "recrusion"):
+            times = []
+            for end in range(1, len(typed) + 1):
+                elapsed, found = best_of(args.rounds, lambda: suggest(user.pk, typed[:end]))
+                times.append(elapsed)
+            print(f"{typed!r:>13}: {len(typed)} keystrokes, worst {max(times) * 1000:.2f} ms, "
+                  f"mean {sum(times) / len(times) * 1000:.2f} ms, last gave {len(found)} suggestions")
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == "__main__":
+    main()
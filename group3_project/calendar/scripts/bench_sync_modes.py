@@ -0,0 +1,60 @@
+"""
+Compares the per-course and planner Canvas sync modes.
+
+Each round syncs a fresh user from the local fake Canvas into a throwaway
+test database, so the numbers cover the full sync including the DB writes.
+The HTTP cache is disabled so every round makes the same calls.
+
+    python scripts/bench_sync_modes.py --courses 7 --assignments 20 --latency 0.05
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "calendar_app.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test.utils import override_settings, setup_test_environment  # noqa: E402
+
+from home.tests_support.fake_canvas import FakeCanvas  # noqa: E402
+from home.sync import sync_canvas  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--courses", type=int, default=7)
+    parser.add_argument("--assignments", type=int, default=20)
+    parser.add_argument("--modules", type=int, default=12)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        with override_settings(CANVAS_HTTP_CACHE_PATH=None), FakeCanvas(
+            courses=args.courses, assignments=args.assignments, modules=args.modules, latency=args.latency
+        ) as canvas:
+            for mode in ("courses", "planner"):
+                best = None
+                for n in range(args.rounds):
+                    user = User.objects.create_user(username=f"bench-{mode}-{n}")
+                    canvas.reset_log()
+                    start = time.perf_counter()
+                    sync_canvas(user, canvas.url, "bench", mode=mode)
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                print(f"{mode:>8}: {len(canvas.requests)} requests, best {best:.3f}s")
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == "__main__":
+    main()